@@ -0,0 +1,9 @@
+#!/bin/bash
+set -e 
+set -o pipefail
+
+REPO_DIR="$1"
+shift
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+python3 "$SCRIPT_DIR/index.py" "$REPO_DIR" "$@"
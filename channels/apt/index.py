@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Generates the APT indexes of a repository. The stanzas of the packages are stored in the repository so that only the new
+or changed packages are read when the indexes are generated again.
+
+Usage: index.py <repo dir> [--compress gz,bz2,xz[,zst]] [--jobs N] [--no-by-hash] [--pdiff N]
+"""
+import argparse
+import bz2
+import difflib
+import functools
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate
+
+DIST = "all"
+COMP = "main"
+ARCHITECTURES = ("all", "i386", "amd64")
+# The fields added to the control fields of the packages
+FILE_FIELDS = ("Filename", "Size", "MD5sum", "SHA1", "SHA256")
+# Order of the fields of the Packages stanzas written by dpkg-scanpackages, the other fields follow sorted by name
+FIELD_ORDER = (
+    "package", "package-type", "source", "version", "kernel-version", "built-for-profiles", "auto-built-package",
+    "architecture", "subarchitecture", "installer-menu-item", "build-essential", "essential", "protected", "origin",
+    "bugs", "maintainer", "installed-size", "pre-depends", "depends", "recommends", "suggests", "enhances",
+    "conflicts", "breaks", "replaces", "provides", "built-using", "static-built-using", "filename", "size", "md5sum",
+    "sha1", "sha256", "section", "priority", "multi-arch", "homepage", "description", "tag", "task",
+)
+STORE_FILE = os.path.join(".index", "packages.json")
+STORE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+# xz is preferred by apt when available, zst is supported by apt 2.x and newer only
+DEFAULT_COMPRESSIONS = ("gz", "bz2", "xz")
+# apt looks up the by-hash files with the strongest digest of the Release file
+BY_HASH_DIGESTS = ("SHA256", "SHA512")
+# Number of runs whose by-hash files are kept
+BY_HASH_KEEP = 3
+RELEASE_DIGESTS = (("MD5Sum", "md5"), ("SHA1", "sha1"), ("SHA256", "sha256"), ("SHA512", "sha512"))
+
+
+def read_ar_member(deb_file, prefix):
+    """
+    Reads the first member of the ar archive whose name starts with the prefix
+    :return the name and the content of the member
+    """
+    with open(deb_file, "rb") as f:
+        if f.read(8) != b"!<arch>\n":
+            raise ValueError(f"`{deb_file}` is not a debian package")
+        while True:
+            header = f.read(60)
+            if len(header) < 60:
+                raise ValueError(f"No `{prefix}` member found in `{deb_file}`")
+            name = header[:16].decode("ascii").strip().rstrip("/")
+            size = int(header[48:58].decode("ascii").strip())
+            if name.startswith(prefix):
+                return name, f.read(size)
+            # Members are aligned on 2 bytes
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def read_control(deb_file) -> str:
+    """
+    Reads the control file of a debian package without running dpkg-deb
+    """
+    name, content = read_ar_member(deb_file, "control.tar")
+    if name.endswith(".zst"):
+        try:
+            import zstandard
+            content = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)).read()
+        except ImportError:
+            content = subprocess.run(["zstd", "-dc"], input=content, stdout=subprocess.PIPE, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(content), mode="r:*") as tar:
+        for member in tar.getmembers():
+            if member.name in ("control", "./control"):
+                return tar.extractfile(member).read().decode("utf-8")
+    raise ValueError(f"No control file found in `{deb_file}`")
+
+
+def parse_control(control: str) -> list:
+    """
+    Splits a control file into its fields, keeping the continuation lines of multiline fields
+    :return the list of (name, value) of the fields
+    """
+    fields = []
+    for line in control.splitlines():
+        if not line.strip():
+            continue
+        if line[0] in " \t" and fields:
+            fields[-1] = (fields[-1][0], fields[-1][1] + "\n" + line)
+        else:
+            name, _, value = line.partition(":")
+            fields.append((name.strip(), value.strip()))
+    return fields
+
+
+def get_field_key(field):
+    """
+    Gets the sort key placing a (name, value) field where dpkg-scanpackages writes it
+    """
+    name = field[0].lower()
+    return (0, FIELD_ORDER.index(name), "") if name in FIELD_ORDER else (1, 0, field[0])
+
+
+def _compare_parts(a, b):
+    """
+    Compares the upstream versions or the revisions of two versions like dpkg does, the digit sequences are compared
+    as numbers and `~` sorts before anything, even the end of the part
+    """
+    def order(c):
+        if c.isdigit():
+            return 0
+        if c.isalpha():
+            return ord(c)
+        if c == "~":
+            return -1
+        return ord(c) + 256 if c else 0
+
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            difference = order(a[i] if i < len(a) else "") - order(b[j] if j < len(b) else "")
+            if difference:
+                return difference
+            i, j = i + 1, j + 1
+        number_a, number_b = "", ""
+        while i < len(a) and a[i].isdigit():
+            number_a, i = number_a + a[i], i + 1
+        while j < len(b) and b[j].isdigit():
+            number_b, j = number_b + b[j], j + 1
+        difference = int(number_a or 0) - int(number_b or 0)
+        if difference:
+            return difference
+    return 0
+
+
+def compare_versions(a, b):
+    """
+    Compares two debian package versions like `dpkg --compare-versions`
+    :return a negative number if a is older than b, 0 if they are equal and a positive number otherwise
+    """
+    def split(version):
+        epoch, _, version = version.partition(":") if ":" in version else ("0", "", version)
+        upstream, _, revision = version.rpartition("-") if "-" in version else (version, "", "")
+        return int(epoch or 0), upstream, revision
+
+    (epoch_a, upstream_a, revision_a), (epoch_b, upstream_b, revision_b) = split(a), split(b)
+    return epoch_a - epoch_b or _compare_parts(upstream_a, upstream_b) or _compare_parts(revision_a, revision_b)
+
+
+def get_digests(filename):
+    """
+    Computes the size and the md5, sha1 and sha256 digests of a file in a single read
+    """
+    digests = {"MD5sum": hashlib.md5(), "SHA1": hashlib.sha1(), "SHA256": hashlib.sha256()}
+    size = 0
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            size += len(chunk)
+            for digest in digests.values():
+                digest.update(chunk)
+    return size, {k: v.hexdigest() for k, v in digests.items()}
+
+
+def create_stanza(deb_file, filename):
+    """
+    Creates the Packages stanza of a debian package
+    :param filename the path of the package relative to the repository
+    :return the entry stored for the package
+    """
+    fields = parse_control(read_control(deb_file))
+    size, digests = get_digests(deb_file)
+    file_fields = [("Filename", filename), ("Size", str(size))] + list(digests.items())
+    fields = sorted([i for i in fields if i[0] not in FILE_FIELDS] + file_fields, key=get_field_key)
+    control = dict(fields)
+    return {
+        "package": control.get("Package", ""),
+        "version": control.get("Version", ""),
+        "architecture": control.get("Architecture", ""),
+        "sha256": digests["SHA256"],
+        "stanza": "".join(f"{k}: {v}\n" for k, v in fields),
+    }
+
+
+class IndexStore:
+    """
+    Stanzas of the packages of a repository keyed by their file name, size, modification time and sha256
+    """
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.store_file = os.path.join(repo_dir, STORE_FILE)
+        self.entries = dict()
+        # The by-hash files of the previous runs and the patches of the pdiff indexes
+        self.by_hash = []
+        self.pdiffs = dict()
+        try:
+            with open(self.store_file) as f:
+                store = json.load(f)
+            if store.get("version") == STORE_VERSION:
+                self.entries = store["packages"]
+                self.by_hash = store.get("by-hash", [])
+                self.pdiffs = store.get("pdiffs", dict())
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def update(self, pool_dir):
+        """
+        Updates the stanzas of the packages found in the pool, reading only the new and changed packages
+        :return the number of packages read and the number of packages reused
+        """
+        entries = dict()
+        read = 0
+        for root, _, files in os.walk(os.path.join(self.repo_dir, pool_dir)):
+            for file in files:
+                if not file.endswith(".deb"):
+                    continue
+                deb_file = os.path.join(root, file)
+                filename = os.path.relpath(deb_file, self.repo_dir).replace(os.sep, "/")
+                stat = os.stat(deb_file)
+                entry = self.entries.get(filename)
+                if entry and (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+                    # The content may be unchanged, e.g. when the same package is downloaded again
+                    if get_digests(deb_file)[1]["SHA256"] != entry["sha256"]:
+                        entry = None
+                if not entry:
+                    entry = create_stanza(deb_file, filename)
+                    read += 1
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime_ns
+                entries[filename] = entry
+        reused = len(entries) - read
+        self.entries = entries
+        return read, reused
+
+    def save(self):
+        """
+        Saves the stanzas next to the indexes. The store is replaced and never modified in place since it may be
+        hardlinked to a previous generation of the repository.
+        """
+        os.makedirs(os.path.dirname(self.store_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.store_file), suffix=".tmp", delete=False) as f:
+            json.dump({"version": STORE_VERSION, "packages": self.entries, "by-hash": self.by_hash,
+                       "pdiffs": self.pdiffs}, f)
+        os.replace(f.name, self.store_file)
+
+    def get_packages(self, architecture) -> str:
+        """
+        Gets the Packages index of an architecture, which also lists the architecture independent packages
+        """
+        entries = [i for i in self.entries.items() if i[1]["architecture"] in (architecture, "all")]
+        version_key = functools.cmp_to_key(compare_versions)
+        entries.sort(key=lambda x: (x[1]["package"], version_key(x[1]["version"]), x[0]))
+        return "".join(i[1]["stanza"] + "\n" for i in entries)
+
+
+def write_file(filename, content: bytes):
+    """
+    Writes a file through a temp file so that it is replaced and never modified in place
+    """
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(filename), delete=False) as f:
+        f.write(content)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, filename)
+
+
+def compress(content: bytes, compression):
+    if compression == "gz":
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    if compression == "bz2":
+        return bz2.compress(content)
+    if compression == "xz":
+        return lzma.compress(content, preset=6)
+    if compression == "zst":
+        try:
+            import zstandard
+            return zstandard.ZstdCompressor(level=19).compress(content)
+        except ImportError:
+            return subprocess.run(["zstd", "-19", "-q", "-c"], input=content, stdout=subprocess.PIPE,
+                                  check=True).stdout
+    return content
+
+
+def get_release_entry(content: bytes):
+    """
+    Computes the size and the digests listed in the Release file from the content of an index
+    """
+    return len(content), {name: hashlib.new(algorithm, content).hexdigest() for name, algorithm in RELEASE_DIGESTS}
+
+
+def write_index(filename, content: bytes, compression):
+    """
+    Compresses and writes an index. It runs in a worker process.
+    :return the size and the digests of the written file
+    """
+    content = compress(content, compression)
+    write_file(filename, content)
+    return get_release_entry(content)
+
+
+def get_compressions(compressions):
+    """
+    Filters out the zstd compression when neither the zstandard module nor the zstd tool is available
+    """
+    if "zst" in compressions:
+        try:
+            import zstandard
+        except ImportError:
+            if not shutil.which("zstd"):
+                print("WARNING: Packages.zst is not generated since zstd is not available")
+                compressions = [i for i in compressions if i != "zst"]
+    return compressions
+
+
+def get_ed_script(old_lines, new_lines):
+    """
+    Creates the `diff --ed` script turning the old lines into the new ones, as used by the pdiff patches
+    :return the script or None if it cannot be represented as an ed script
+    """
+    if "." in new_lines:
+        return None
+    script = []
+    opcodes = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes()
+    # The commands are applied from the end of the file so that the line numbers of the next ones do not change
+    for tag, i1, i2, j1, j2 in reversed(opcodes):
+        lines = f"{i1 + 1},{i2}" if i2 - i1 > 1 else f"{i1 + 1}"
+        if tag == "replace":
+            script += [f"{lines}c"] + new_lines[j1:j2] + ["."]
+        elif tag == "delete":
+            script.append(f"{lines}d")
+        elif tag == "insert":
+            script += [f"{i1}a"] + new_lines[j1:j2] + ["."]
+    return "".join(f"{i}\n" for i in script)
+
+
+def write_pdiff(binary_path, old_packages, packages, pdiffs, keep):
+    """
+    Adds the patch from the previous Packages index to the new one to the pdiff index of the binary dir
+    :param pdiffs the entries of the patches of the previous runs
+    :param keep the number of patches to keep
+    :return the entries of the patches
+    """
+    diff_dir = os.path.join(binary_path, "Packages.diff")
+    os.makedirs(diff_dir, exist_ok=True)
+    if old_packages is not None and old_packages != packages:
+        script = get_ed_script(old_packages.decode("utf-8").splitlines(), packages.decode("utf-8").splitlines())
+        if script is None:
+            pdiffs = []
+        else:
+            name = time.strftime("%Y-%m-%d-%H%M.%S", time.gmtime())
+            patch = script.encode("utf-8")
+            download = gzip.compress(patch, compresslevel=9, mtime=0)
+            write_file(os.path.join(diff_dir, f"{name}.gz"), download)
+            pdiffs = [i for i in pdiffs if i["name"] != name] + [{
+                "name": name,
+                "history": [hashlib.sha256(old_packages).hexdigest(), len(old_packages)],
+                "patch": [hashlib.sha256(patch).hexdigest(), len(patch)],
+                "download": [hashlib.sha256(download).hexdigest(), len(download)],
+            }]
+    elif old_packages is None:
+        # The patches cannot be applied without the index they were created from
+        pdiffs = []
+    pdiffs = pdiffs[-keep:]
+
+    names = {f"{i['name']}.gz" for i in pdiffs} | {"Index", "by-hash"}
+    for file in os.listdir(diff_dir):
+        if file not in names:
+            os.remove(os.path.join(diff_dir, file))
+    index = "".join((
+        f"SHA256-Current: {hashlib.sha256(packages).hexdigest()} {len(packages)}\n",
+        "SHA256-History:\n",
+        "".join(f" {i['history'][0]} {i['history'][1]} {i['name']}\n" for i in pdiffs),
+        "SHA256-Patches:\n",
+        "".join(f" {i['patch'][0]} {i['patch'][1]} {i['name']}\n" for i in pdiffs),
+        "SHA256-Download:\n",
+        "".join(f" {i['download'][0]} {i['download'][1]} {i['name']}.gz\n" for i in pdiffs),
+    )).encode("utf-8")
+    write_file(os.path.join(diff_dir, "Index"), index)
+    return pdiffs, get_release_entry(index)
+
+
+def write_by_hash(dist_dir, files, by_hash):
+    """
+    Links the indexes into the by-hash folders of their binary dir so that clients can get them by their digest while
+    the indexes are replaced. The by-hash files of the previous runs are kept for the clients still using their
+    Release file.
+    :param files dict of the size and digests of the indexes by their path relative to the dist dir
+    :param by_hash the by-hash files of the previous runs
+    :return the by-hash files of the kept runs
+    """
+    links = []
+    for file, (_, digests) in files.items():
+        for name in BY_HASH_DIGESTS:
+            link = f"{os.path.dirname(file)}/by-hash/{name}/{digests[name]}"
+            link_file = os.path.join(dist_dir, link)
+            if not os.path.exists(link_file):
+                os.makedirs(os.path.dirname(link_file), exist_ok=True)
+                try:
+                    os.link(os.path.join(dist_dir, file), link_file)
+                except OSError:
+                    shutil.copy2(os.path.join(dist_dir, file), link_file)
+            links.append(link)
+    by_hash = (by_hash + [sorted(set(links))])[-BY_HASH_KEEP:]
+
+    kept = {i for run in by_hash for i in run}
+    for root, _, names in os.walk(dist_dir):
+        if os.path.basename(os.path.dirname(root)) != "by-hash":
+            continue
+        for name in names:
+            if os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, "/") not in kept:
+                os.remove(os.path.join(root, name))
+    return by_hash
+
+
+def write_release(dist_dir, files, by_hash=True):
+    """
+    Writes the Release file listing the indexes with their size and digests
+    :param files dict of the size and digests of the indexes by their path relative to the dist dir
+    """
+    release = "".join((
+        f"Architectures: {' '.join(ARCHITECTURES)}\n",
+        f"Codename: {DIST}\n",
+        f"Components: {COMP}\n",
+        f"Date: {formatdate(usegmt=True)}\n",
+        "Origin: Intel Corporation\n",
+        f"Suite: {DIST}\n",
+    ))
+    if by_hash:
+        release += "Acquire-By-Hash: yes\n"
+    for name, _ in RELEASE_DIGESTS:
+        release += f"{name}:\n" + "".join(f" {digests[name]} {size} {file}\n"
+                                          for file, (size, digests) in sorted(files.items()))
+    write_file(os.path.join(dist_dir, "Release"), release.encode("utf-8"))
+
+
+def generate_index(repo_dir, compressions=DEFAULT_COMPRESSIONS, jobs=None, by_hash=True, pdiff=0):
+    """
+    Generates the Packages indexes and the Release file of the repository from the packages of its pool. The compressed
+    indexes are generated in parallel and the digests of all the indexes are computed from their content as they are
+    written.
+    :param compressions the compressed variants of the indexes to generate, among gz, bz2, xz and zst
+    :param jobs the number of processes compressing the indexes, the number of cpus by default
+    :param by_hash whether to publish the indexes in by-hash folders as well
+    :param pdiff the number of pdiff patches to keep, no pdiff indexes are generated if 0
+    """
+    print(f"Generating APT indexes for {repo_dir}...")
+    store = IndexStore(repo_dir)
+    read, reused = store.update(os.path.join("pool", COMP))
+    if not store.entries:
+        raise ValueError(f"No packages found in `{os.path.join(repo_dir, 'pool', COMP)}`")
+    print(f"{read} packages read, {reused} packages unchanged")
+
+    dist_dir = os.path.join(repo_dir, "dists", DIST)
+    compressions = get_compressions(compressions)
+    files = dict()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = dict()
+        for architecture in ARCHITECTURES:
+            binary_dir = f"{COMP}/binary-{architecture}"
+            os.makedirs(os.path.join(dist_dir, binary_dir), exist_ok=True)
+            packages = store.get_packages(architecture).encode("utf-8")
+            binary_path = os.path.join(dist_dir, binary_dir)
+            if pdiff:
+                old_packages = None
+                if os.path.isfile(os.path.join(binary_path, "Packages")):
+                    with open(os.path.join(binary_path, "Packages"), "rb") as f:
+                        old_packages = f.read()
+                store.pdiffs[binary_dir], files[f"{binary_dir}/Packages.diff/Index"] = write_pdiff(
+                    binary_path, old_packages, packages, store.pdiffs.get(binary_dir, []), pdiff)
+            else:
+                shutil.rmtree(os.path.join(binary_path, "Packages.diff"), ignore_errors=True)
+                store.pdiffs.pop(binary_dir, None)
+            for compression in compressions:
+                file = f"{binary_dir}/Packages.{compression}"
+                results[file] = executor.submit(write_index, os.path.join(dist_dir, file), packages, compression)
+            write_file(os.path.join(dist_dir, binary_dir, "Packages"), packages)
+            # Variants generated by a previous run are not listed in the Release file anymore
+            for file in os.listdir(binary_path):
+                if file.startswith("Packages.") and file[len("Packages."):] not in (*compressions, "diff"):
+                    os.remove(os.path.join(binary_path, file))
+            files[f"{binary_dir}/Packages"] = get_release_entry(packages)
+        files.update({file: result.result() for file, result in results.items()})
+    if by_hash:
+        store.by_hash = write_by_hash(dist_dir, files, store.by_hash)
+    else:
+        for architecture in ARCHITECTURES:
+            shutil.rmtree(os.path.join(dist_dir, COMP, f"binary-{architecture}", "by-hash"), ignore_errors=True)
+        store.by_hash = []
+    write_release(dist_dir, files, by_hash)
+    store.save()
+    print(f"Generating APT indexes for {repo_dir}...Done")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates the APT indexes of a repository")
+    parser.add_argument("repo_dir")
+    parser.add_argument("--compress", default=",".join(DEFAULT_COMPRESSIONS),
+                        help="Comma separated compressed variants of the indexes among gz, bz2, xz and zst")
+    parser.add_argument("--jobs", type=int, help="Number of compression processes, the number of cpus by default")
+    parser.add_argument("--no-by-hash", dest="by_hash", action="store_false",
+                        help="Do not publish the indexes in by-hash folders")
+    parser.add_argument("--pdiff", type=int, default=0,
+                        help="Number of pdiff patches to keep for incremental index downloads, 0 to disable")
+    arguments = parser.parse_args()
+    compressions = [i for i in arguments.compress.split(",") if i]
+    if any(i not in ("gz", "bz2", "xz", "zst") for i in compressions):
+        parser.error(f"Invalid compression `{arguments.compress}`. Choose from gz, bz2, xz and zst")
+    generate_index(arguments.repo_dir, compressions, arguments.jobs, arguments.by_hash, arguments.pdiff)
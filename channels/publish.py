@@ -0,0 +1,307 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# ioctl request cloning a file on copy-on-write filesystems (btrfs, xfs), see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+# Suffix of the generations being generated which are not complete yet
+_staging_suffix = ".staging"
+# Suffix of the file locked while a staging dir is in use, next to it
+_lock_suffix = ".lock"
+# Age of the staging dirs considered as left by a failed generation on the platforms without file locks
+stale_staging_seconds = 24 * 60 * 60
+# Locks of the staging dirs in use by the process, held until they are flipped or the process ends
+_staging_locks = dict()
+# Folder of the repositories holding the stores of the indexers, see channels/apt/index.py and channels/yum/repodata.py
+INDEX_DIR = ".index"
+
+
+def _reflink(source, destination):
+    """
+    Clones the data blocks of the source file into the destination file instead of copying them.
+    Raises OSError when the filesystem does not support it.
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+    shutil.copystat(source, destination)
+
+
+def link_file(source, destination):
+    """
+    Places a copy of the source file at the destination using, from the cheapest to the most expensive, a hardlink,
+    a reflink or a full copy. The source file is kept.
+    :return the method used, `link`, `reflink` or `copy`
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return "link"
+    except OSError:
+        pass
+    if sys.platform.startswith("linux"):
+        try:
+            _reflink(source, destination)
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+def move_file(source, destination):
+    """
+    Moves the source file to the destination with a rename, falling back to a copy when they are on different
+    filesystems.
+    :return the method used, `rename` or `copy`
+    """
+    try:
+        os.replace(source, destination)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # Copy next to the destination first so that the destination is never seen partially written
+    temp_destination = destination + ".part"
+    shutil.copy2(source, temp_destination)
+    os.replace(temp_destination, destination)
+    os.remove(source)
+    return "copy"
+
+
+def publish_files(files, move=True, jobs=4):
+    """
+    Places files at their destination. Renames and links are done right away while the files which have to be copied
+    since they are on another filesystem are copied in parallel.
+    :param files list of (source, destination) paths
+    :param move whether the source files are moved or linked
+    :param jobs the number of parallel copies
+    :return a dict with the number of files placed by each method
+    """
+    stats = dict()
+    copies = []
+    for source, destination in files:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if move:
+            try:
+                os.replace(source, destination)
+                stats["rename"] = stats.get("rename", 0) + 1
+                continue
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        copies.append((source, destination))
+
+    if copies:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            results = [executor.submit(move_file if move else link_file, source, destination)
+                       for source, destination in copies]
+            for result in results:
+                method = result.result()
+                stats[method] = stats.get(method, 0) + 1
+    return stats
+
+
+def find_files(source_dir, extension):
+    """
+    Finds the files with the extension in the source dir and its sub folders
+    """
+    found = []
+    for root, _, files in os.walk(source_dir):
+        found += [os.path.join(root, file) for file in files if file.endswith(extension)]
+    return found
+
+
+def publish_flat(source_dir, target_dir, extension, move=True, jobs=4):
+    """
+    Places all the files with the extension found in the source dir and its sub folders directly in the target dir
+    """
+    files = [(i, os.path.join(target_dir, os.path.basename(i))) for i in find_files(source_dir, extension)]
+    os.makedirs(target_dir, exist_ok=True)
+    return publish_files(files, move, jobs)
+
+
+def _exchange(path1, path2):
+    """
+    Atomically exchanges two paths with renameat2(RENAME_EXCHANGE).
+    Raises OSError when the platform or the filesystem does not support it.
+    """
+    libc_name = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+    if not libc or not hasattr(libc, "renameat2"):
+        raise OSError(errno.ENOSYS, "renameat2 is not available")
+    if libc.renameat2(_AT_FDCWD, os.fsencode(path1), _AT_FDCWD, os.fsencode(path2), _RENAME_EXCHANGE):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def get_generations_dir(publish_dir):
+    """
+    Gets the folder next to the publish dir holding the generations of the repository
+    """
+    publish_dir = os.path.abspath(publish_dir).rstrip(os.sep)
+    return os.path.join(os.path.dirname(publish_dir), f".{os.path.basename(publish_dir)}.generations")
+
+
+def get_current_generation(publish_dir):
+    """
+    Gets the generation the publish dir points to or None if it is not a generation link
+    """
+    if not os.path.islink(publish_dir):
+        return None
+    return os.path.realpath(publish_dir)
+
+
+def create_staging_dir(publish_dir, seed=False, jobs=4, seed_dirs=(INDEX_DIR,)):
+    """
+    Creates a new generation of the repository to be generated in, next to the publish dir so that the repository
+    served from the publish dir is untouched until the new generation is complete.
+    :param seed whether to hardlink the content of the current generation into the new one for incremental builds
+    :param seed_dirs the folders of the current generation which are always seeded, like the index stores
+    :return the staging dir
+    """
+    generations_dir = get_generations_dir(publish_dir)
+    os.makedirs(generations_dir, exist_ok=True)
+    prefix = time.strftime("%Y%m%d-%H%M%S-", time.localtime())
+    # The lock is created and held before the staging dir so that a concurrent prune never sees it unlocked
+    while True:
+        fd, lock_file = tempfile.mkstemp(prefix=prefix, suffix=_staging_suffix + _lock_suffix, dir=generations_dir)
+        if not fcntl:
+            break
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # A prune may have removed the lock file before it was locked
+        if os.path.exists(lock_file) and os.path.samestat(os.fstat(fd), os.stat(lock_file)):
+            break
+        os.close(fd)
+    staging_dir = lock_file[:-len(_lock_suffix)]
+    _staging_locks[staging_dir] = fd
+    os.mkdir(staging_dir)
+    os.chmod(staging_dir, 0o755)
+
+    current_dir = get_current_generation(publish_dir) or (publish_dir if os.path.isdir(publish_dir) else None)
+    if current_dir:
+        files = []
+        for seed_dir in [""] if seed else seed_dirs:
+            for root, _, names in os.walk(os.path.join(current_dir, seed_dir)):
+                relative_root = os.path.relpath(root, current_dir)
+                files += [(os.path.join(root, i), os.path.normpath(os.path.join(staging_dir, relative_root, i)))
+                          for i in names]
+        publish_files(files, move=False, jobs=jobs)
+    return staging_dir
+
+
+def flip_generation(publish_dir, staging_dir):
+    """
+    Atomically points the publish dir to the staging dir. A publish dir which is a plain folder is kept as a
+    generation.
+    :return the generation dir
+    """
+    publish_dir = os.path.abspath(publish_dir).rstrip(os.sep)
+    generation_dir = staging_dir[:-len(_staging_suffix)] if staging_dir.endswith(_staging_suffix) else staging_dir
+    os.rename(staging_dir, generation_dir)
+    _release_staging_dir(staging_dir)
+    staging_dir = generation_dir
+    temp_link = f"{publish_dir}.{os.getpid()}.link"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(staging_dir, temp_link)
+    if not os.path.isdir(publish_dir) or os.path.islink(publish_dir):
+        os.replace(temp_link, publish_dir)
+        return staging_dir
+
+    old_generation = os.path.join(get_generations_dir(publish_dir), time.strftime("%Y%m%d-%H%M%S-previous"))
+    try:
+        _exchange(temp_link, publish_dir)
+        os.rename(temp_link, old_generation)
+    except OSError:
+        # Without an atomic exchange the publish dir is missing for the time between two renames only
+        os.rename(publish_dir, old_generation)
+        os.replace(temp_link, publish_dir)
+    return staging_dir
+
+
+def _release_staging_dir(staging_dir):
+    fd = _staging_locks.pop(staging_dir, None)
+    if fd is None:
+        return
+    try:
+        os.remove(staging_dir + _lock_suffix)
+    except OSError:
+        pass
+    os.close(fd)
+
+
+def _remove_dead_staging_dir(staging_dir):
+    """
+    Removes a staging dir left by a failed generation. The staging dirs whose lock is held by a generation still
+    running, in this process or another one, are kept.
+    """
+    if staging_dir in _staging_locks:
+        return
+    lock_file = staging_dir + _lock_suffix
+    if not fcntl:
+        # Without file locks, only the staging dirs old enough to have been left by a failed generation are removed
+        try:
+            created = os.path.getmtime(lock_file if os.path.exists(lock_file) else staging_dir)
+        except OSError:
+            return
+        if time.time() - created > stale_staging_seconds:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if os.path.exists(lock_file):
+                os.remove(lock_file)
+        return
+    try:
+        fd = os.open(lock_file, os.O_RDWR)
+    except FileNotFoundError:
+        # Left by a version which did not lock the staging dirs
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return
+    try:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.remove(lock_file)
+    finally:
+        os.close(fd)
+
+
+def prune_generations(publish_dir, keep=1):
+    """
+    Removes the oldest generations of the repository keeping the current one and the `keep` previous ones. The staging
+    dirs left by failed generations are removed as well, the ones still being generated are kept.
+    """
+    generations_dir = get_generations_dir(publish_dir)
+    if not os.path.isdir(generations_dir):
+        return
+    current = get_current_generation(publish_dir)
+    generations = sorted(os.path.join(generations_dir, i) for i in os.listdir(generations_dir))
+    staging_dirs = {i[:-len(_lock_suffix)] if i.endswith(_lock_suffix) else i for i in generations
+                    if i.endswith(_staging_suffix) or i.endswith(_staging_suffix + _lock_suffix)}
+    for staging_dir in sorted(staging_dirs):
+        _remove_dead_staging_dir(staging_dir)
+    generations = [i for i in generations if not i.endswith(_staging_suffix) and not i.endswith(_lock_suffix)]
+    previous = [i for i in generations if os.path.realpath(i) != current]
+    for generation in previous[:max(len(previous) - keep, 0)]:
+        shutil.rmtree(generation, ignore_errors=True)
@@ -0,0 +1,265 @@
+import bz2
+import functools
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from channels.apt import index
+
+needs_dpkg_deb = pytest.mark.skipif(not shutil.which("dpkg-deb"), reason="No `dpkg-deb` command")
+
+
+def build_deb(tmp_path, deb_file, control, compression="xz"):
+    """
+    Builds a debian package with dpkg-deb from the fields of its control file
+    """
+    package_dir = tmp_path / "build" / os.path.basename(deb_file)
+    shutil.rmtree(package_dir, ignore_errors=True)
+    (package_dir / "DEBIAN").mkdir(parents=True)
+    (package_dir / "usr" / "share").mkdir(parents=True)
+    (package_dir / "usr" / "share" / "file.txt").write_text(control)
+    (package_dir / "DEBIAN" / "control").write_text(control)
+    os.makedirs(os.path.dirname(deb_file), exist_ok=True)
+    subprocess.run(["dpkg-deb", "--root-owner-group", f"-Z{compression}", "--build", str(package_dir), str(deb_file)],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def get_control(package, version, architecture="amd64", **fields):
+    control = {"Package": package, "Version": version, "Architecture": architecture,
+               "Maintainer": "Maintainer <maintainer@example.com>", **fields}
+    control.setdefault("Description", f"{package} summary\n Long description\n .\n of {package}")
+    return "".join(f"{k.replace('_', '-')}: {v}\n" for k, v in control.items())
+
+
+@needs_dpkg_deb
+@pytest.mark.skipif(not shutil.which("dpkg-scanpackages"), reason="No `dpkg-scanpackages` command")
+def test_stanzas_match_dpkg_scanpackages(tmp_path):
+    pool_dir = tmp_path / "repo" / "pool" / "main"
+    # The fields of the control files are not in the order of the Packages index
+    build_deb(tmp_path, pool_dir / "a" / "tool_1.0_amd64.deb", get_control(
+        "tool", "1.0", Description="tool summary", Section="devel", Priority="optional", Homepage="https://example.com",
+        Depends="libc6 (>= 2.17)", Installed_Size="12", Multi_Arch="foreign", X_Custom="custom", Bugs="mailto:a@b.c"))
+    build_deb(tmp_path, pool_dir / "b" / "library_2.0-1_all.deb", get_control("library", "2.0-1", "all"), "gzip")
+    build_deb(tmp_path, pool_dir / "b" / "zst_1.0_amd64.deb", get_control("zst", "1.0", Section="libs"), "zstd")
+
+    store = index.IndexStore(str(tmp_path / "repo"))
+    assert store.update("pool/main") == (3, 0)
+    packages = store.get_packages("amd64")
+    expected = subprocess.run(["dpkg-scanpackages", "--multiversion", "pool", "/dev/null"], cwd=tmp_path / "repo",
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode("utf-8")
+    assert sorted(packages.split("\n\n")) == sorted(expected.split("\n\n"))
+    assert "Package: library\n" in store.get_packages("i386")
+    assert "Package: tool\n" not in store.get_packages("i386")
+
+
+def test_versions_are_sorted_like_dpkg():
+    versions = ["1.10", "1.9", "1.9-1", "1.9-10", "1.9-2", "1:0.1", "1.0~rc1", "1.0", "1.0a", "1.0+b1", "1.0-0",
+                "2.0~~", "2.0~", "2.0", "2.0.0", "2.00", "0:2.0", "1.0-1~bpo1", "1.0-1"]
+    ordered = sorted(versions, key=functools.cmp_to_key(index.compare_versions))
+    assert ordered.index("1.9") < ordered.index("1.10")
+    assert ordered.index("1.0~rc1") < ordered.index("1.0") < ordered.index("1.0a") < ordered.index("1.0+b1")
+    assert ordered[-1] == "1:0.1"
+    if shutil.which("dpkg"):
+        for a, b in zip(ordered, ordered[1:]):
+            subprocess.run(["dpkg", "--compare-versions", a, "le", b], check=True)
+    assert index.compare_versions("2.0", "2.00") == index.compare_versions("1.0", "1.0-0") == 0
+
+
+@needs_dpkg_deb
+def test_only_changed_packages_are_read_again(tmp_path, monkeypatch):
+    repo_dir = tmp_path / "repo"
+    pool_dir = repo_dir / "pool" / "main"
+    for version in ("1.9", "1.10", "1.2"):
+        build_deb(tmp_path, pool_dir / f"package_{version}_amd64.deb", get_control("package", version))
+    build_deb(tmp_path, pool_dir / "other_1.0_all.deb", get_control("other", "1.0", "all"))
+    store = index.IndexStore(str(repo_dir))
+    assert store.update("pool/main") == (4, 0)
+    store.save()
+    packages = store.get_packages("amd64")
+    assert [i.split("\n")[1] for i in packages.split("\n\n") if i] == \
+           ["Version: 1.0", "Version: 1.2", "Version: 1.9", "Version: 1.10"]
+
+    read = []
+    create_stanza = index.create_stanza
+    monkeypatch.setattr(index, "create_stanza", lambda *args: read.append(args[1]) or create_stanza(*args))
+    # Downloaded again with the same content
+    os.utime(pool_dir / "package_1.9_amd64.deb", (0, 0))
+    build_deb(tmp_path, pool_dir / "package_1.2_amd64.deb", get_control("package", "1.2", Section="changed"))
+    os.remove(pool_dir / "other_1.0_all.deb")
+
+    store = index.IndexStore(str(repo_dir))
+    assert store.update("pool/main") == (1, 2)
+    assert read == ["pool/main/package_1.2_amd64.deb"]
+    packages = store.get_packages("amd64")
+    assert "Package: other\n" not in packages
+    assert "Section: changed\n" in packages
+    assert packages.count("Package: package\n") == 3
+
+    # The stanzas written by a previous version of the store are created again
+    store.save()
+    with open(repo_dir / index.STORE_FILE) as f:
+        content = json.load(f)
+    content["version"] = index.STORE_VERSION - 1
+    with open(repo_dir / index.STORE_FILE, "w") as f:
+        json.dump(content, f)
+    assert index.IndexStore(str(repo_dir)).update("pool/main") == (3, 0)
+
+
+def decompress(filename):
+    with open(filename, "rb") as f:
+        content = f.read()
+    if filename.endswith(".gz"):
+        return gzip.decompress(content)
+    if filename.endswith(".bz2"):
+        return bz2.decompress(content)
+    if filename.endswith(".xz"):
+        return lzma.decompress(content)
+    if filename.endswith(".zst"):
+        return subprocess.run(["zstd", "-dc"], input=content, stdout=subprocess.PIPE, check=True).stdout
+    return content
+
+
+def read_release(dist_dir):
+    """
+    Reads the size and the digests of the files listed in the Release file
+    """
+    files = dict()
+    digest = None
+    with open(os.path.join(dist_dir, "Release")) as f:
+        for line in f:
+            if not line.startswith(" "):
+                digest = line.split(":")[0]
+                continue
+            value, size, file = line.split()
+            files.setdefault(file, {"size": int(size)})[digest] = value
+    return files
+
+
+@needs_dpkg_deb
+def test_release_lists_the_written_indexes(tmp_path):
+    repo_dir = tmp_path / "repo"
+    build_deb(tmp_path, repo_dir / "pool" / "main" / "tool_1.0_amd64.deb", get_control("tool", "1.0"))
+    build_deb(tmp_path, repo_dir / "pool" / "main" / "library_1.0_all.deb", get_control("library", "1.0", "all"))
+    compressions = ["gz", "bz2", "xz"] + (["zst"] if shutil.which("zstd") else [])
+    index.generate_index(str(repo_dir), compressions, jobs=2, pdiff=2)
+
+    dist_dir = repo_dir / "dists" / index.DIST
+    files = read_release(dist_dir)
+    assert sorted(files) == sorted([f"main/binary-{architecture}/{name}" for architecture in index.ARCHITECTURES
+                                    for name in ["Packages", "Packages.diff/Index"] +
+                                    [f"Packages.{i}" for i in compressions]])
+    for file, entry in files.items():
+        with open(dist_dir / file, "rb") as f:
+            content = f.read()
+        assert entry["size"] == len(content)
+        for name, algorithm in index.RELEASE_DIGESTS:
+            assert entry[name] == hashlib.new(algorithm, content).hexdigest()
+        if "/Packages." in file and not file.endswith("/Index"):
+            assert decompress(str(dist_dir / file)) == (dist_dir / os.path.dirname(file) / "Packages").read_bytes()
+            # apt gets the indexes by their strongest digest
+            for name in index.BY_HASH_DIGESTS:
+                assert (dist_dir / os.path.dirname(file) / "by-hash" / name / entry[name]).read_bytes() == content
+    assert b"Package: library\n" in (dist_dir / "main" / "binary-i386" / "Packages").read_bytes()
+
+    # The variants which are not generated anymore are removed
+    index.generate_index(str(repo_dir), ["gz"], jobs=1, pdiff=0)
+    files = read_release(dist_dir)
+    assert sorted(files) == sorted(f"main/binary-{architecture}/{name}" for architecture in index.ARCHITECTURES
+                                   for name in ("Packages", "Packages.gz"))
+    for architecture in index.ARCHITECTURES:
+        binary_dir = dist_dir / "main" / f"binary-{architecture}"
+        assert sorted(i for i in os.listdir(binary_dir) if i != "by-hash") == ["Packages", "Packages.gz"]
+        assert decompress(str(binary_dir / "Packages.gz")) == (binary_dir / "Packages").read_bytes()
+
+
+def apply_ed_script(lines, script):
+    """
+    Applies the `c`, `d` and `a` commands of an ed script like apt applies the pdiff patches
+    """
+    lines = list(lines)
+    commands = script.splitlines()
+    position = 0
+    while position < len(commands):
+        command = commands[position]
+        position += 1
+        addresses, action = command[:-1], command[-1]
+        first, _, last = addresses.partition(",")
+        first, last = int(first), int(last or first)
+        text = []
+        if action in "ca":
+            while commands[position] != ".":
+                text.append(commands[position])
+                position += 1
+            position += 1
+        if action == "a":
+            lines[first:first] = text
+        elif action == "c":
+            lines[first - 1:last] = text
+        elif action == "d":
+            del lines[first - 1:last]
+    return lines
+
+
+def get_packages(count, seed):
+    generator = random.Random(seed)
+    return [f"Package: package-{i}\nVersion: 1.{generator.randint(0, 3)}\n" for i in range(count)]
+
+
+def test_ed_script_turns_old_packages_into_new_ones():
+    old_lines = "".join(get_packages(50, 1)).splitlines()
+    for seed in range(2, 10):
+        new_lines = "".join(get_packages(45 + seed, seed)).splitlines()
+        script = index.get_ed_script(old_lines, new_lines)
+        assert apply_ed_script(old_lines, script) == new_lines
+    assert index.get_ed_script(["a"], ["."]) is None
+
+
+def test_pdiff_index_lists_applicable_patches(tmp_path):
+    versions = ["".join(get_packages(20, seed)).encode("utf-8") for seed in range(4)]
+    pdiffs = []
+    for old_packages, packages in zip(versions, versions[1:]):
+        pdiffs, _ = index.write_pdiff(str(tmp_path), old_packages, packages, pdiffs, keep=5)
+        # The patches are named after the time of the run
+        os.rename(tmp_path / "Packages.diff" / f"{pdiffs[-1]['name']}.gz",
+                  tmp_path / "Packages.diff" / f"patch-{len(pdiffs)}.gz")
+        pdiffs[-1]["name"] = f"patch-{len(pdiffs)}"
+
+    lines = versions[0].decode("utf-8").splitlines()
+    for pdiff in pdiffs:
+        assert hashlib.sha256("".join(f"{i}\n" for i in lines).encode("utf-8")).hexdigest() == pdiff["history"][0]
+        with gzip.open(tmp_path / "Packages.diff" / f"{pdiff['name']}.gz", "rt") as f:
+            lines = apply_ed_script(lines, f.read())
+    assert "".join(f"{i}\n" for i in lines).encode("utf-8") == versions[-1]
+
+    pdiffs, _ = index.write_pdiff(str(tmp_path), versions[-1], versions[0], pdiffs, keep=2)
+    assert len(pdiffs) == 2
+    assert len(list((tmp_path / "Packages.diff").glob("*.gz"))) == 2
+    with open(tmp_path / "Packages.diff" / "Index") as f:
+        assert f.readline() == f"SHA256-Current: {hashlib.sha256(versions[0]).hexdigest()} {len(versions[0])}\n"
+
+
+def test_by_hash_keeps_the_files_of_the_last_runs(tmp_path):
+    dist_dir = tmp_path / "dists" / "all"
+    binary_dir = dist_dir / "main" / "binary-amd64"
+    binary_dir.mkdir(parents=True)
+    by_hash = []
+    runs = []
+    for run in range(5):
+        content = f"Package: package-{run}\n".encode("utf-8")
+        index.write_file(str(binary_dir / "Packages"), content)
+        files = {"main/binary-amd64/Packages": index.get_release_entry(content)}
+        by_hash = index.write_by_hash(str(dist_dir), files, by_hash)
+        runs.append(files["main/binary-amd64/Packages"][1]["SHA256"])
+
+        assert len(by_hash) == min(run + 1, index.BY_HASH_KEEP)
+        kept = sorted(os.listdir(binary_dir / "by-hash" / "SHA256"))
+        assert kept == sorted(runs[-index.BY_HASH_KEEP:])
+        for digest in kept:
+            assert hashlib.sha256((binary_dir / "by-hash" / "SHA256" / digest).read_bytes()).hexdigest() == digest
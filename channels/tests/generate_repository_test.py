@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import os
+
+import pytest
+
+import generate_repository
+from channels import publish
+from pdt_tool.helpers.cache import ChecksumCache
+
+
+def create_generation(publish_dir, files):
+    """
+    Creates a staging generation holding the webimage files given
+    """
+    repo_dir = publish.create_staging_dir(str(publish_dir))
+    os.makedirs(os.path.join(repo_dir, "webimage"))
+    for file in files:
+        with open(os.path.join(repo_dir, "webimage", file), "w") as f:
+            f.write(file)
+    return repo_dir
+
+
+def test_incomplete_repository_is_not_published(tmp_path):
+    publish_dir = tmp_path / "publish"
+    repo_dir = create_generation(publish_dir, ["a.sh", "b.sh"])
+    assert generate_repository.publish_generation(str(publish_dir), repo_dir, "webimage", ["a.sh", "b.sh"])
+    current = os.path.realpath(publish_dir)
+
+    repo_dir = create_generation(publish_dir, ["a.sh"])
+    assert generate_repository.verify_repository(repo_dir, "webimage", ["a.sh", "c.sh"]) == ["Missing package `c.sh`"]
+    assert not generate_repository.publish_generation(str(publish_dir), repo_dir, "webimage", ["a.sh", "c.sh"])
+    # The staging dir is discarded and the previous generation is still served
+    assert not os.path.exists(repo_dir)
+    assert os.path.realpath(publish_dir) == current
+    assert sorted(os.listdir(publish_dir / "webimage")) == ["a.sh", "b.sh"]
+
+
+def test_files_referenced_by_the_metadata_must_exist(tmp_path):
+    repo_dir = tmp_path / "apt"
+    (repo_dir / "pool" / "main").mkdir(parents=True)
+    (repo_dir / "pool" / "main" / "a.deb").write_bytes(b"a")
+    assert generate_repository.verify_repository(str(repo_dir), "apt", ["a.deb"]) == ["Missing `dists/all/Release`"]
+
+    binary_dir = repo_dir / "dists" / "all" / "main" / "binary-amd64"
+    binary_dir.mkdir(parents=True)
+    (repo_dir / "dists" / "all" / "Release").write_text("")
+    (binary_dir / "Packages").write_text("Package: a\nFilename: pool/main/a.deb\n\n"
+                                         "Package: b\nFilename: pool/main/b.deb\n\n")
+    assert generate_repository.verify_repository(str(repo_dir), "apt", ["a.deb"]) == [
+        "Missing `pool/main/b.deb` referenced by the metadata"]
+
+    repo_dir = tmp_path / "yum"
+    (repo_dir / "repodata").mkdir(parents=True)
+    assert generate_repository.verify_repository(str(repo_dir), "yum", []) == ["Missing `repodata/repomd.xml`"]
+    (repo_dir / "repodata" / "repomd.xml").write_text('<location href="repodata/primary.xml.gz"/>')
+    assert generate_repository.verify_repository(str(repo_dir), "yum", ["a.rpm"]) == [
+        "Missing package `a.rpm`", "Missing `repodata/primary.xml.gz` referenced by the metadata"]
+
+
+def get_arguments(manifest=None, repo_name=None, product_id=None, release_id=None, package_guid=None):
+    return argparse.Namespace(manifest=manifest and str(manifest), repo_name=repo_name, product_id=product_id,
+                              release_id=release_id, package_guid=package_guid)
+
+
+def test_manifest_packages(tmp_path):
+    packages = [{"product": "compiler", "release": "2024.0", "guid": "guid1"},
+                {"product": "mkl", "release": "2024.0", "guid": "guid2"}]
+    (tmp_path / "toolkit.json").write_text(json.dumps(packages))
+    (tmp_path / "toolkit.yaml").write_text("packages:\n" + "".join(
+        f"  - product: {i['product']}\n    release: '{i['release']}'\n    guid: {i['guid']}\n" for i in packages))
+    parser = argparse.ArgumentParser()
+
+    for manifest in ("toolkit.json", "toolkit.yaml"):
+        assert generate_repository.read_manifest(str(tmp_path / manifest)) == packages
+        # The repository is named after the manifest unless a name is given
+        assert generate_repository.get_requested_packages(get_arguments(tmp_path / manifest), parser) == \
+               (packages, "toolkit")
+        assert generate_repository.get_requested_packages(get_arguments(tmp_path / manifest, "oneapi"), parser) == \
+               (packages, "oneapi")
+
+    (tmp_path / "invalid.json").write_text(json.dumps([{"product": "compiler", "release": "2024.0"}]))
+    with pytest.raises(Exception, match="Invalid package"):
+        generate_repository.read_manifest(str(tmp_path / "invalid.json"))
+
+
+def test_manifest_arguments(tmp_path):
+    parser = argparse.ArgumentParser()
+    (tmp_path / "empty.json").write_text(json.dumps({"packages": []}))
+    with pytest.raises(SystemExit):
+        generate_repository.get_requested_packages(get_arguments(tmp_path / "empty.json"), parser)
+
+    (tmp_path / "toolkit.json").write_text(json.dumps([{"product": "compiler", "release": "2024.0", "guid": "guid"}]))
+    with pytest.raises(SystemExit):
+        generate_repository.get_requested_packages(
+            get_arguments(tmp_path / "toolkit.json", product_id="mkl", release_id="2024.0"), parser)
+    with pytest.raises(SystemExit):
+        generate_repository.get_requested_packages(get_arguments(product_id="mkl", release_id="2024.0"), parser)
+
+    assert generate_repository.get_requested_packages(
+        get_arguments(product_id="mkl", release_id="2024.0", package_guid="guid"), parser) == \
+        ({"product": "mkl", "release": "2024.0", "guid": "guid"}, None)
+
+
+def test_combined_repository_of_several_packages(monkeypatch):
+    calls = []
+    monkeypatch.setattr(generate_repository, "webimage", lambda *args: calls.append(args) or True)
+    packages = [{"product": "compiler", "release": "2024.0", "guid": "guid1"},
+                {"product": "mkl", "release": "2024.0", "guid": "guid2"}]
+    assert generate_repository.create_local_repos(packages, ["webimage"], "publish")
+    # All the packages are built into one repository named after the first product by default
+    assert calls[0][:4] == (packages, "publish", False, "compiler")
+
+    generate_repository.create_local_repos(packages[1], ["webimage"], "publish", repo_name="toolkit")
+    assert calls[1][:4] == ([packages[1]], "publish", False, "toolkit")
+
+
+def get_file(name, content, path=None):
+    return {"name": name, "path": path or f"{content}/{name}", "size": len(content),
+            "sha256": hashlib.sha256(content.encode()).hexdigest()}
+
+
+def test_download_plan_skips_duplicate_and_existing_files(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("ARTIFACTORY_USER", "user")
+    monkeypatch.setenv("ARTIFACTORY_PASS", "pass")
+    monkeypatch.setattr(generate_repository, "checksums", ChecksumCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(generate_repository, "cmd", lambda params: "")
+    listed_files = {
+        "compiler": [get_file("a.rpm", "compiler"), get_file("shared.rpm", "shared"), get_file("b.rpm", "compiler")],
+        "mkl": [get_file("shared.rpm", "shared", "mkl/shared.rpm"), get_file("a.rpm", "mkl"),
+                get_file("c.rpm", "mkl"), get_file("d.rpm", "mkl")],
+    }
+    monkeypatch.setattr(generate_repository, "read_meta_data",
+                        lambda filename: [dict(i) for i in listed_files[os.path.basename(filename).split("_")[0]]])
+    existing_dir = tmp_path / "existing"
+    existing_dir.mkdir()
+    (existing_dir / "b.rpm").write_text("compiler")
+    # Same size but another checksum
+    (existing_dir / "c.rpm").write_text("mkl".upper())
+    packages = [{"product": product, "release": "2024.0", "guid": "guid", "dependency": False}
+                for product in ("compiler", "mkl")]
+
+    plan = generate_repository.plan_download(packages, "yum", str(tmp_path), str(existing_dir))
+    # The first package providing a file wins
+    assert [(i["name"], i["package"]) for i in plan["files"]] == [
+        ("a.rpm", "compiler.2024.0"), ("shared.rpm", "compiler.2024.0"), ("c.rpm", "mkl.2024.0"),
+        ("d.rpm", "mkl.2024.0")]
+    assert [(i["name"], i["package"]) for i in plan["duplicate files"]] == [
+        ("shared.rpm", "mkl.2024.0"), ("a.rpm", "mkl.2024.0")]
+    assert [i["name"] for i in plan["existing files"]] == ["b.rpm"]
+    # Only the duplicate file with another checksum is reported
+    warnings = [i for i in capsys.readouterr().out.splitlines() if i.startswith("WARNING")]
+    assert warnings == ["WARNING: `mkl/a.rpm` is skipped since `a.rpm` is already provided by `compiler/a.rpm` with "
+                        "a different checksum"]
+
+    # The existing files are checked again when a saved plan is used
+    (existing_dir / "b.rpm").unlink()
+    (existing_dir / "d.rpm").write_text("mkl")
+    plan = generate_repository.update_plan(plan, str(existing_dir))
+    assert sorted(i["name"] for i in plan["files"]) == ["a.rpm", "b.rpm", "c.rpm", "shared.rpm"]
+    assert [i["name"] for i in plan["existing files"]] == ["d.rpm"]
+    assert len(plan["duplicate files"]) == 2
+
+
+def test_mirror_is_synced_with_the_planned_files(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(generate_repository, "checksums", ChecksumCache(str(tmp_path / "cache")))
+    mirror_dir = tmp_path / "mirror"
+    mirror_dir.mkdir()
+    (mirror_dir / "kept.rpm").write_text("kept")
+    (mirror_dir / "changed.rpm").write_text("old")
+    (mirror_dir / "removed.rpm").write_text("removed")
+    (mirror_dir / "comps.xml").write_text("comps")
+    files = [get_file("kept.rpm", "kept"), get_file("changed.rpm", "new"), get_file("added.rpm", "added")]
+    # A file of the mirror is only kept when it has the size and the checksum of the planned one
+    assert [generate_repository.is_existing_file(i, str(mirror_dir)) for i in files] == [True, False, False]
+    assert not generate_repository.is_existing_file(files[0], None)
+
+    source_dir = tmp_path / "SOURCES"
+    (source_dir / "rpm").mkdir(parents=True)
+    (source_dir / "rpm" / "changed.rpm").write_text("new")
+    (source_dir / "rpm" / "added.rpm").write_text("added")
+    generate_repository.sync_mirror(str(source_dir), str(mirror_dir), {i["name"] for i in files}, ".rpm")
+    assert {i.name: i.read_text() for i in mirror_dir.iterdir()} == {
+        "kept.rpm": "kept", "changed.rpm": "new", "added.rpm": "added", "comps.xml": "comps"}
+    assert "Mirror updated: 2 packages added, 1 removed, 3 in total" in capsys.readouterr().out
+
+    # Webimages have no extension so every file of the mirror which is not planned is removed
+    webimage_dir = tmp_path / "webimage"
+    webimage_dir.mkdir()
+    (webimage_dir / "kept.sh").write_text("kept")
+    (webimage_dir / "removed.sh").write_text("removed")
+    (source_dir / "webimage").mkdir()
+    (source_dir / "webimage" / "added.sh").write_text("added")
+    generate_repository.sync_mirror(str(source_dir / "webimage"), str(webimage_dir), {"kept.sh", "added.sh"}, "")
+    assert sorted(os.listdir(webimage_dir)) == ["added.sh", "kept.sh"]
+    assert "Mirror updated: 1 packages added, 1 removed, 2 in total" in capsys.readouterr().out
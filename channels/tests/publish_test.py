@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+
+from channels import publish
+
+
+def create_staging_dir(publish_dir, connection):
+    """
+    Creates a staging dir in another process and keeps it in use until told to exit
+    """
+    connection.send(publish.create_staging_dir(publish_dir))
+    connection.recv()
+
+
+def test_prune_keeps_staging_dirs_in_use(tmp_path):
+    publish_dir = str(tmp_path / "repo")
+    first = publish.create_staging_dir(publish_dir)
+    publish.flip_generation(publish_dir, first)
+    second = publish.create_staging_dir(publish_dir)
+    publish.flip_generation(publish_dir, second)
+
+    # A staging dir of the process, one of a generation running in another process and one of a failed generation
+    in_use = publish.create_staging_dir(publish_dir)
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=create_staging_dir, args=(publish_dir, child_connection))
+    process.start()
+    other_in_use = connection.recv()
+    failed_connection, child_connection = multiprocessing.Pipe()
+    failed = multiprocessing.Process(target=create_staging_dir, args=(publish_dir, child_connection))
+    failed.start()
+    dead = failed_connection.recv()
+    failed.kill()
+    failed.join()
+
+    try:
+        publish.prune_generations(publish_dir, keep=0)
+        assert os.path.isdir(in_use)
+        assert os.path.isdir(other_in_use)
+        assert not os.path.exists(dead)
+        assert not os.path.exists(dead + ".lock")
+        assert not os.path.exists(first[:-len(".staging")])
+        assert os.path.realpath(publish_dir) == second[:-len(".staging")]
+    finally:
+        connection.send(None)
+        process.join()
+
+    publish.prune_generations(publish_dir, keep=0)
+    assert os.path.isdir(in_use)
+    assert not os.path.exists(other_in_use)
+    assert sorted(os.listdir(publish.get_generations_dir(publish_dir))) == sorted(
+        os.path.basename(i) for i in (second[:-len(".staging")], in_use, in_use + ".lock"))
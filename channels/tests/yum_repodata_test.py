@@ -0,0 +1,289 @@
+import gzip
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from channels.yum import repodata
+
+NAMESPACES = {"common": "http://linux.duke.edu/metadata/common", "rpm": "http://linux.duke.edu/metadata/rpm",
+              "filelists": "http://linux.duke.edu/metadata/filelists", "other": "http://linux.duke.edu/metadata/other",
+              "repo": "http://linux.duke.edu/metadata/repo"}
+# Header types, see rpmtag.h
+INT16, INT32, INT64, STRING, BIN, STRING_ARRAY, I18NSTRING = 3, 4, 5, 6, 7, 8, 9
+ALIGNMENT = {INT16: 2, INT32: 4, INT64: 8}
+FORMATS = {INT16: "H", INT32: "I", INT64: "Q"}
+
+
+def build_header(tags, region_tag):
+    """
+    Serializes a header structure of an rpm package with its immutable region, like rpmbuild does
+    :param tags dict of the (type, value) of the tags
+    """
+    entries = [(region_tag, BIN, None)] + sorted((tag, *value) for tag, value in tags.items())
+    index = []
+    store = b""
+    for tag, tag_type, value in entries[1:]:
+        store += b"\x00" * (-len(store) % ALIGNMENT.get(tag_type, 1))
+        offset = len(store)
+        if tag_type in FORMATS:
+            store += struct.pack(f">{len(value)}{FORMATS[tag_type]}", *value)
+            count = len(value)
+        elif tag_type in (STRING, I18NSTRING):
+            store += value.encode("utf-8") + b"\x00"
+            count = 1
+        elif tag_type == STRING_ARRAY:
+            store += b"".join(i.encode("utf-8") + b"\x00" for i in value)
+            count = len(value)
+        else:
+            store += value
+            count = len(value)
+        index.append(struct.pack(">IIiI", tag, tag_type, offset, count))
+    # The region trailer refers back to the index entries of the region
+    index.insert(0, struct.pack(">IIiI", region_tag, BIN, len(store), 16))
+    store += struct.pack(">IIiI", region_tag, BIN, -16 * len(entries), 16)
+    return repodata.RPM_HEADER_MAGIC + b"\x00" * 4 + struct.pack(">II", len(entries), len(store)) + \
+        b"".join(index) + store
+
+
+def build_rpm(rpm_file, name, version, release, arch="x86_64", files=(), requires=(), changelogs=(), size=None,
+              archive_size=None):
+    """
+    Builds an rpm package without payload content, its headers list the files, dependencies and changelogs given
+    :param files list of the (path, mode) of the files
+    :param requires list of the (name, flags, version) of the dependencies
+    :param size the installed size, written in the 64 bits tags when it does not fit in 32 bits like rpm does
+    """
+    paths = [i[0] for i in files]
+    dirnames = sorted({os.path.dirname(i) + "/" for i in paths})
+    size = size if size is not None else 1024 * len(paths)
+    # Empty cpio archive holding the trailer only, its header fields are the inode, mode, uid, gid, nlink, mtime,
+    # filesize, the major and minor numbers of the device and the rdev, the name size and the checksum
+    archive = b"070701" + b"".join(b"%08x" % i for i in (0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 11, 0)) + b"TRAILER!!!\x00"
+    archive += b"\x00" * (-len(archive) % 4)
+    archive_size = archive_size if archive_size is not None else len(archive)
+    large = size >= 1 << 32 or archive_size >= 1 << 32
+    tags = {
+        100: (STRING_ARRAY, ["C"]),
+        1000: (STRING, name),
+        1001: (STRING, version),
+        1002: (STRING, release),
+        1004: (I18NSTRING, f"{name} summary"),
+        1005: (I18NSTRING, f"Description of {name} & <others>"),
+        1006: (INT32, [1700000000]),
+        1007: (STRING, "build.example.com"),
+        1014: (STRING, "MIT"),
+        1016: (I18NSTRING, "Unspecified"),
+        1020: (STRING, "https://example.com"),
+        1021: (STRING, "linux"),
+        1022: (STRING, arch),
+        1044: (STRING, f"{name}-{version}-{release}.src.rpm"),
+        1064: (STRING, "4.16.1.3"),
+        1124: (STRING, "cpio"),
+        1125: (STRING, "gzip"),
+        1126: (STRING, "9"),
+        1047: (STRING_ARRAY, [name]),
+        1112: (INT32, [repodata.RPMSENSE_EQUAL]),
+        1113: (STRING_ARRAY, [f"{version}-{release}"]),
+        1049: (STRING_ARRAY, [i[0] for i in requires] + ["rpmlib(PayloadFilesHavePrefix)"]),
+        1048: (INT32, [i[1] for i in requires] + [repodata.RPMSENSE_LESS | repodata.RPMSENSE_EQUAL | 1 << 24]),
+        1050: (STRING_ARRAY, [i[2] for i in requires] + ["4.0-1"]),
+    }
+    tags[5009 if large else 1009] = (INT64 if large else INT32, [size])
+    if paths:
+        tags.update({
+            5008 if large else 1028: (INT64 if large else INT32, [size // len(paths)] * len(paths)),
+            1030: (INT16, [i[1] for i in files]),
+            1037: (INT32, [repodata.RPMFILE_GHOST if i.endswith(".ghost") else 0 for i in paths]),
+            1116: (INT32, [dirnames.index(os.path.dirname(i) + "/") for i in paths]),
+            1117: (STRING_ARRAY, [os.path.basename(i) for i in paths]),
+            1118: (STRING_ARRAY, dirnames),
+        })
+    if changelogs:
+        tags.update({
+            1080: (INT32, [i[1] for i in changelogs]),
+            1081: (STRING_ARRAY, [i[0] for i in changelogs]),
+            1082: (STRING_ARRAY, [i[2] for i in changelogs]),
+        })
+    header = build_header(tags, 63)
+    payload = gzip.compress(archive, mtime=0)
+    signature_tags = {
+        269: (STRING, hashlib.sha1(header).hexdigest()),
+        273: (STRING, hashlib.sha256(header).hexdigest()),
+        1004: (BIN, hashlib.md5(header + payload).digest()),
+    }
+    if large:
+        signature_tags.update({270: (INT64, [len(header + payload)]), 271: (INT64, [archive_size])})
+    else:
+        signature_tags.update({1000: (INT32, [len(header + payload)]), 1007: (INT32, [archive_size])})
+    signature = build_header(signature_tags, 62)
+    lead = struct.pack(">4sBBhh66shh16s", b"\xed\xab\xee\xdb", 3, 0, 0, 1, f"{name}-{version}-{release}".encode(),
+                       1, 5, b"")
+    with open(rpm_file, "wb") as f:
+        f.write(lead + signature + b"\x00" * (-len(signature) % 8) + header + payload)
+    header_start = len(lead) + len(signature) + (-len(signature) % 8)
+    return header_start, header_start + len(header)
+
+
+def read_metadata(repo_dir, data_type):
+    repomd = ElementTree.parse(os.path.join(repo_dir, "repodata", "repomd.xml")).getroot()
+    for data in repomd.findall("repo:data", NAMESPACES):
+        if data.get("type") == data_type:
+            location = data.find("repo:location", NAMESPACES).get("href")
+            with gzip.open(os.path.join(repo_dir, location)) as f:
+                return ElementTree.parse(f).getroot()
+    raise KeyError(data_type)
+
+
+def get_packages(root):
+    return {i.find("common:name", NAMESPACES).text if i.get("name") is None else i.get("name"): i for i in root}
+
+
+def test_packages_metadata(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    header_range = build_rpm(
+        repo_dir / "tool-1.0-1.x86_64.rpm", "tool", "1.0", "1",
+        files=[("/usr/bin/tool", 0o100755), ("/usr/share/tool", 0o40755), ("/usr/share/tool/data", 0o100644),
+               ("/var/log/tool.ghost", 0o100644), ("/opt/tool/2024.0/bin/tool-cli", 0o100755),
+               ("/opt/tool/2024.0/lib/libtool.so", 0o100644), ("/etc/tool.conf", 0o100644),
+               ("/usr/lib/sendmail", 0o100755), ("/usr/lib/sendmail.d/file", 0o100644)],
+        requires=[("library", repodata.RPMSENSE_GREATER | repodata.RPMSENSE_EQUAL, "1:2.0-3"),
+                  ("/bin/sh", repodata.RPMSENSE_SCRIPT_PRE, "")],
+        changelogs=[("Packager <packager@example.com> - 1.0-1", 1690000000, "- Release 1.0"),
+                    ("Packager <packager@example.com> - 0.9-1", 1680000000, "- Release 0.9")])
+    repodata.generate_repodata(str(repo_dir))
+
+    package = get_packages(read_metadata(repo_dir, "primary"))["tool"]
+    rpm_file = repo_dir / "tool-1.0-1.x86_64.rpm"
+    assert package.find("common:arch", NAMESPACES).text == "x86_64"
+    assert package.find("common:version", NAMESPACES).attrib == {"epoch": "0", "ver": "1.0", "rel": "1"}
+    assert package.find("common:checksum", NAMESPACES).text == hashlib.sha256(rpm_file.read_bytes()).hexdigest()
+    assert package.find("common:description", NAMESPACES).text == "Description of tool & <others>"
+    assert package.find("common:size", NAMESPACES).attrib == {
+        "package": str(os.path.getsize(rpm_file)), "installed": "9216", "archive": "124"}
+    assert package.find("common:location", NAMESPACES).get("href") == "tool-1.0-1.x86_64.rpm"
+    package_format = package.find("common:format", NAMESPACES)
+    assert package_format.find("rpm:sourcerpm", NAMESPACES).text == "tool-1.0-1.src.rpm"
+    assert package_format.find("rpm:header-range", NAMESPACES).attrib == {
+        "start": str(header_range[0]), "end": str(header_range[1])}
+    assert [i.attrib for i in package_format.find("rpm:provides", NAMESPACES)] == [
+        {"name": "tool", "flags": "EQ", "epoch": "0", "ver": "1.0", "rel": "1"}]
+    assert [i.attrib for i in package_format.find("rpm:requires", NAMESPACES)] == [
+        {"name": "library", "flags": "GE", "epoch": "1", "ver": "2.0", "rel": "3"}, {"name": "/bin/sh", "pre": "1"}]
+    # Like createrepo_c, primary.xml lists the files of /etc, sendmail and any path holding a `bin/` folder
+    assert sorted(i.text for i in package_format.findall("common:file", NAMESPACES)) == [
+        "/etc/tool.conf", "/opt/tool/2024.0/bin/tool-cli", "/usr/bin/tool", "/usr/lib/sendmail"]
+
+    files = get_packages(read_metadata(repo_dir, "filelists"))["tool"]
+    assert [(i.text, i.get("type")) for i in files.findall("filelists:file", NAMESPACES)][:4] == [
+        ("/usr/bin/tool", None), ("/usr/share/tool", "dir"), ("/usr/share/tool/data", None),
+        ("/var/log/tool.ghost", "ghost")]
+    assert len(files.findall("filelists:file", NAMESPACES)) == 9
+    other = get_packages(read_metadata(repo_dir, "other"))["tool"]
+    # The oldest changelogs come first
+    assert [(i.get("date"), i.text) for i in other.findall("other:changelog", NAMESPACES)] == [
+        ("1680000000", "- Release 0.9"), ("1690000000", "- Release 1.0")]
+
+
+def test_packages_over_4_gib(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    size = 5 * 1024 ** 3
+    build_rpm(repo_dir / "large-1.0-1.noarch.rpm", "large", "1.0", "1", "noarch",
+              files=[("/opt/large/data1", 0o100644), ("/opt/large/data2", 0o100644)], size=size,
+              archive_size=size + 1024)
+    repodata.generate_repodata(str(repo_dir))
+
+    package = get_packages(read_metadata(repo_dir, "primary"))["large"]
+    assert package.find("common:size", NAMESPACES).get("installed") == str(size)
+    assert package.find("common:size", NAMESPACES).get("archive") == str(size + 1024)
+
+
+def test_only_changed_packages_are_read_again(tmp_path, monkeypatch):
+    repo_dir = tmp_path / "repo"
+    (repo_dir / "packages").mkdir(parents=True)
+    for version in ("1.0", "1.1", "2.0"):
+        build_rpm(repo_dir / "packages" / f"package-{version}-1.noarch.rpm", "package", version, "1", "noarch")
+    cache = repodata.HeaderCache(str(repo_dir))
+    assert cache.update() == (3, 0)
+    cache.close()
+
+    read = []
+    create_package = repodata.create_package
+    monkeypatch.setattr(repodata, "create_package", lambda *args: read.append(args[1]) or create_package(*args))
+    # Downloaded again with the same content
+    os.utime(repo_dir / "packages" / "package-1.0-1.noarch.rpm", (0, 0))
+    build_rpm(repo_dir / "packages" / "package-1.1-1.noarch.rpm", "package", "1.1", "1", "noarch",
+              files=[("/usr/bin/package", 0o100755)])
+    os.remove(repo_dir / "packages" / "package-2.0-1.noarch.rpm")
+
+    cache = repodata.HeaderCache(str(repo_dir))
+    assert cache.update() == (1, 1)
+    assert read == ["packages/package-1.1-1.noarch.rpm"]
+    packages = list(cache.packages())
+    cache.close()
+    assert [i["version"] for i in packages] == ["1.0", "1.1"]
+    assert packages[0]["time_file"] == 0
+    assert packages[1]["files"] == [["/usr/bin/package", None]]
+
+
+def test_repomd_describes_the_written_files(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    # Enough packages for the metadata files to span several gzip blocks
+    for i in range(200):
+        files = [(f"/usr/bin/package{i}", 0o100755), (f"/usr/share/package{i}/{os.urandom(8).hex()}", 0o100644)]
+        build_rpm(repo_dir / f"package{i}-1.0-1.noarch.rpm", f"package{i}", "1.0", "1", "noarch", files=files)
+    repodata.generate_repodata(str(repo_dir))
+
+    repomd = ElementTree.parse(repo_dir / "repodata" / "repomd.xml").getroot()
+    data = repomd.findall("repo:data", NAMESPACES)
+    assert sorted(i.get("type") for i in data) == sorted(repodata.METADATA)
+    for entry in data:
+        location = entry.find("repo:location", NAMESPACES).get("href")
+        content = (repo_dir / location).read_bytes()
+        open_content = gzip.decompress(content)
+        assert entry.find("repo:checksum", NAMESPACES).text == hashlib.sha256(content).hexdigest()
+        assert entry.find("repo:size", NAMESPACES).text == str(len(content))
+        assert entry.find("repo:open-checksum", NAMESPACES).text == hashlib.sha256(open_content).hexdigest()
+        assert entry.find("repo:open-size", NAMESPACES).text == str(len(open_content))
+        assert os.path.basename(location) == f"{hashlib.sha256(content).hexdigest()}-{entry.get('type')}.xml.gz"
+        assert len(ElementTree.fromstring(open_content)) == 200
+    assert sorted(os.listdir(repo_dir / "repodata")) == sorted(
+        ["repomd.xml"] + [os.path.basename(i.find("repo:location", NAMESPACES).get("href")) for i in data])
+
+
+def normalize(element):
+    """
+    Gets a comparable form of an xml element ignoring the whitespaces between the elements
+    """
+    return element.tag, sorted(element.attrib.items()), (element.text or "").strip(), [normalize(i) for i in element]
+
+
+@pytest.mark.skipif(not shutil.which("createrepo_c"), reason="No `createrepo_c` command")
+def test_metadata_matches_createrepo_c(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    build_rpm(repo_dir / "tool-1.0-1.x86_64.rpm", "tool", "1.0", "1",
+              files=[("/usr/bin/tool", 0o100755), ("/usr/share/tool", 0o40755), ("/etc/tool.conf", 0o100644),
+                     ("/opt/tool/bin/tool-cli", 0o100755), ("/opt/tool/lib/libtool.so", 0o100644)],
+              requires=[("library", repodata.RPMSENSE_GREATER | repodata.RPMSENSE_EQUAL, "2.0")],
+              changelogs=[("Packager <packager@example.com> - 1.0-1", 1690000000, "- Release 1.0")])
+    build_rpm(repo_dir / "large-1.0-1.noarch.rpm", "large", "1.0", "1", "noarch",
+              files=[("/opt/large/data", 0o100644)], size=5 * 1024 ** 3, archive_size=5 * 1024 ** 3 + 512)
+    reference_dir = tmp_path / "reference"
+    shutil.copytree(repo_dir, reference_dir)
+    subprocess.run(["createrepo_c", "--no-database", str(reference_dir)], check=True, stdout=subprocess.DEVNULL)
+    repodata.generate_repodata(str(repo_dir))
+
+    for data_type in repodata.METADATA:
+        expected = read_metadata(reference_dir, data_type)
+        actual = read_metadata(repo_dir, data_type)
+        assert actual.attrib == expected.attrib
+        assert {k: normalize(v) for k, v in get_packages(actual).items()} == \
+               {k: normalize(v) for k, v in get_packages(expected).items()}
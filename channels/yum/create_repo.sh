@@ -3,8 +3,8 @@ set -e
 set -o pipefail
 
 SOURCE_DIR="$1"
-PUBLISH_DIR="$2"
-SIGNFILE_DIR="$3"
+SIGNFILE_DIR="$2"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
 echo "Creating yum repository from $SOURCE_DIR"
 
@@ -17,12 +17,6 @@ echo "No files to process";
 exit 1;
 fi
 
-createrepo -q $SOURCE_DIR
-
-echo "Publishing build results from $SOURCE_DIR to $PUBLISH_DIR"
-
-for f in $(find $SOURCE_DIR -name '*.rpm'); do mv "$f" $PUBLISH_DIR; done;
-mv 'repodata' $PUBLISH_DIR
+python3 "$SCRIPT_DIR/repodata.py" $SOURCE_DIR
 
 echo "Done"
-
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+Generates the yum metadata of a repository. The headers of the packages are cached in the repository so that only the
+new or changed packages are read when the metadata is generated again.
+
+Usage: repodata.py <repo dir>
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+CACHE_FILE = os.path.join(".index", "rpm-headers.sqlite")
+CACHE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+CHANGELOG_LIMIT = 10
+
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+
+# Header tags, see rpmtag.h
+TAG_NAME = 1000
+TAG_VERSION = 1001
+TAG_RELEASE = 1002
+TAG_EPOCH = 1003
+TAG_SUMMARY = 1004
+TAG_DESCRIPTION = 1005
+TAG_BUILDTIME = 1006
+TAG_BUILDHOST = 1007
+TAG_SIZE = 1009
+TAG_VENDOR = 1011
+TAG_LICENSE = 1014
+TAG_PACKAGER = 1015
+TAG_GROUP = 1016
+TAG_URL = 1020
+TAG_ARCH = 1022
+TAG_OLDFILENAMES = 1027
+TAG_FILEMODES = 1030
+TAG_FILEFLAGS = 1037
+TAG_SOURCERPM = 1044
+TAG_ARCHIVESIZE = 1046
+TAG_CHANGELOGTIME = 1080
+TAG_CHANGELOGNAME = 1081
+TAG_CHANGELOGTEXT = 1082
+TAG_DIRINDEXES = 1116
+TAG_BASENAMES = 1117
+TAG_DIRNAMES = 1118
+# The 64 bits sizes written instead of the 32 bits ones by rpm when they do not fit, for packages over 4 GiB
+TAG_LONGSIZE = 5009
+SIGTAG_PAYLOADSIZE = 1007
+SIGTAG_LONGARCHIVESIZE = 271
+# The name, flags and version tags of each kind of dependency
+DEPENDENCY_TAGS = {
+    "provides": (1047, 1112, 1113),
+    "requires": (1049, 1048, 1050),
+    "conflicts": (1054, 1053, 1055),
+    "obsoletes": (1090, 1114, 1115),
+    "suggests": (5049, 5051, 5050),
+    "enhances": (5055, 5057, 5056),
+    "recommends": (5046, 5048, 5047),
+    "supplements": (5052, 5054, 5053),
+}
+
+RPMSENSE_LESS = 1 << 1
+RPMSENSE_GREATER = 1 << 2
+RPMSENSE_EQUAL = 1 << 3
+RPMSENSE_PREREQ = 1 << 6
+RPMSENSE_SCRIPT_PRE = 1 << 9
+RPMSENSE_SCRIPT_POST = 1 << 10
+RPMFILE_GHOST = 1 << 6
+COMPARISON_FLAGS = {
+    RPMSENSE_EQUAL: "EQ",
+    RPMSENSE_LESS: "LT",
+    RPMSENSE_GREATER: "GT",
+    RPMSENSE_LESS | RPMSENSE_EQUAL: "LE",
+    RPMSENSE_GREATER | RPMSENSE_EQUAL: "GE",
+}
+# The files listed in primary.xml on top of filelists.xml, like createrepo_c does: the files of /etc, sendmail and any
+# path holding a `bin/` folder, e.g. /opt/intel/oneapi/compiler/latest/bin/icx
+PRIMARY_FILES_REGEX = re.compile(r"^/etc/|^/usr/lib/sendmail$|bin/")
+INVALID_XML_CHARS_REGEX = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def read_header(f):
+    """
+    Reads a header structure of an rpm package at the current position of the file
+    :return the dict of the values of the tags of the header and the size of the header
+    """
+    intro = f.read(16)
+    if len(intro) < 16 or intro[:4] != RPM_HEADER_MAGIC:
+        raise ValueError("Invalid rpm header")
+    count, store_size = struct.unpack(">II", intro[8:16])
+    index = f.read(16 * count)
+    store = f.read(store_size)
+
+    tags = dict()
+    for i in range(count):
+        tag, tag_type, offset, tag_count = struct.unpack(">IIII", index[16 * i:16 * (i + 1)])
+        if tag_type == 3:
+            tags[tag] = list(struct.unpack(f">{tag_count}H", store[offset:offset + 2 * tag_count]))
+        elif tag_type == 4:
+            tags[tag] = list(struct.unpack(f">{tag_count}I", store[offset:offset + 4 * tag_count]))
+        elif tag_type == 5:
+            tags[tag] = list(struct.unpack(f">{tag_count}Q", store[offset:offset + 8 * tag_count]))
+        elif tag_type in (6, 8, 9):
+            # Strings are NUL terminated, i18n strings hold one string per language, the first one is the default
+            strings = []
+            position = offset
+            for _ in range(1 if tag_type == 6 else tag_count):
+                end = store.index(b"\x00", position)
+                strings.append(store[position:end].decode("utf-8", errors="replace"))
+                position = end + 1
+            tags[tag] = strings[0] if tag_type in (6, 9) else strings
+        elif tag_type == 7:
+            tags[tag] = store[offset:offset + tag_count]
+    return tags, 16 + 16 * count + store_size
+
+
+def read_rpm_headers(rpm_file):
+    """
+    Reads the signature and the main header of an rpm package
+    :return the signature tags, the main header tags and the byte range of the main header in the file
+    """
+    with open(rpm_file, "rb") as f:
+        lead = f.read(RPM_LEAD_SIZE)
+        if len(lead) < RPM_LEAD_SIZE or lead[:4] != b"\xed\xab\xee\xdb":
+            raise ValueError(f"`{rpm_file}` is not an rpm package")
+        signature, signature_size = read_header(f)
+        # The signature header is padded to 8 bytes
+        header_start = RPM_LEAD_SIZE + signature_size + (8 - signature_size % 8) % 8
+        f.seek(header_start)
+        header, header_size = read_header(f)
+    return signature, header, (header_start, header_start + header_size)
+
+
+def get_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_evr(evr):
+    """
+    Splits an `[epoch:]version[-release]` string
+    """
+    epoch, _, version = evr.rpartition(":") if ":" in evr else ("", "", evr)
+    version, _, release = version.partition("-")
+    return epoch or "0", version, release or None
+
+
+def get_dependencies(header, kind):
+    name_tag, flags_tag, version_tag = DEPENDENCY_TAGS[kind]
+    names = header.get(name_tag, [])
+    flags = header.get(flags_tag, [0] * len(names))
+    versions = header.get(version_tag, [""] * len(names))
+    dependencies = []
+    seen = set()
+    for name, flag, version in zip(names, flags, versions):
+        if kind == "requires" and name.startswith("rpmlib("):
+            continue
+        entry = [name, COMPARISON_FLAGS.get(flag & 0xf)]
+        entry += list(parse_evr(version)) if version else [None, None, None]
+        if kind == "requires":
+            entry.append(bool(flag & (RPMSENSE_PREREQ | RPMSENSE_SCRIPT_PRE | RPMSENSE_SCRIPT_POST)))
+        if tuple(entry) not in seen:
+            seen.add(tuple(entry))
+            dependencies.append(entry)
+    return dependencies
+
+
+def get_files(header):
+    """
+    Gets the files of the package as a list of (path, type) where the type is `dir`, `ghost` or None
+    """
+    if TAG_BASENAMES in header:
+        dirnames = header[TAG_DIRNAMES]
+        paths = [dirnames[i] + j for i, j in zip(header[TAG_DIRINDEXES], header[TAG_BASENAMES])]
+    else:
+        paths = header.get(TAG_OLDFILENAMES, [])
+    modes = header.get(TAG_FILEMODES, [0] * len(paths))
+    flags = header.get(TAG_FILEFLAGS, [0] * len(paths))
+    files = []
+    for path, mode, flag in zip(paths, modes, flags):
+        file_type = "dir" if (mode & 0o170000) == 0o040000 else "ghost" if flag & RPMFILE_GHOST else None
+        files.append([path, file_type])
+    return files
+
+
+def create_package(rpm_file, location, sha256=None):
+    """
+    Reads the metadata of an rpm package
+    :param location the path of the package relative to the repository
+    :return the package record stored in the cache
+    """
+    signature, header, header_range = read_rpm_headers(rpm_file)
+    stat = os.stat(rpm_file)
+    changelogs = list(zip(header.get(TAG_CHANGELOGNAME, []), header.get(TAG_CHANGELOGTIME, []),
+                          header.get(TAG_CHANGELOGTEXT, [])))[:CHANGELOG_LIMIT]
+    # rpm merges the signature tags into the main header, so the archive size may be found in either of them
+    archive_size = (signature.get(SIGTAG_LONGARCHIVESIZE) or header.get(SIGTAG_LONGARCHIVESIZE)
+                    or header.get(TAG_ARCHIVESIZE) or signature.get(SIGTAG_PAYLOADSIZE) or [0])
+    return {
+        "pkgid": sha256 or get_sha256(rpm_file),
+        "name": header.get(TAG_NAME, ""),
+        "arch": header.get(TAG_ARCH, "") if header.get(TAG_SOURCERPM) else "src",
+        "epoch": str(header.get(TAG_EPOCH, [0])[0]),
+        "version": header.get(TAG_VERSION, ""),
+        "release": header.get(TAG_RELEASE, ""),
+        "summary": header.get(TAG_SUMMARY, ""),
+        "description": header.get(TAG_DESCRIPTION, ""),
+        "packager": header.get(TAG_PACKAGER, ""),
+        "url": header.get(TAG_URL, ""),
+        "time_file": int(stat.st_mtime),
+        "time_build": header.get(TAG_BUILDTIME, [0])[0],
+        "size_package": stat.st_size,
+        "size_installed": (header.get(TAG_LONGSIZE) or header.get(TAG_SIZE) or [0])[0],
+        "size_archive": archive_size[0],
+        "location": location,
+        "license": header.get(TAG_LICENSE, ""),
+        "vendor": header.get(TAG_VENDOR, ""),
+        "group": header.get(TAG_GROUP, ""),
+        "buildhost": header.get(TAG_BUILDHOST, ""),
+        "sourcerpm": header.get(TAG_SOURCERPM, ""),
+        "header_range": list(header_range),
+        "dependencies": {i: get_dependencies(header, i) for i in DEPENDENCY_TAGS},
+        "files": get_files(header),
+        "changelogs": [list(i) for i in reversed(changelogs)],
+    }
+
+
+class HeaderCache:
+    """
+    Package records of a repository keyed by their location, size, modification time and sha256, stored in sqlite
+    so that they do not need to be held in memory
+    """
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.cache_file = os.path.join(repo_dir, CACHE_FILE)
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        if os.path.exists(self.cache_file) and os.stat(self.cache_file).st_nlink > 1:
+            # The cache may be hardlinked to a previous generation of the repository which must not be modified
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(self.cache_file), delete=False) as f:
+                pass
+            shutil.copy2(self.cache_file, f.name)
+            os.replace(f.name, self.cache_file)
+        self.db = sqlite3.connect(self.cache_file)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS packages")
+            self.db.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.db.execute("CREATE TABLE IF NOT EXISTS packages (location TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,"
+                        " sha256 TEXT, record TEXT)")
+
+    def close(self):
+        self.db.close()
+
+    def update(self):
+        """
+        Updates the records of the packages found in the repository, reading only the new and changed packages
+        :return the number of packages read and the number of packages reused
+        """
+        cached = {i[0]: i[1:] for i in self.db.execute("SELECT location, size, mtime, sha256 FROM packages")}
+        locations = set()
+        read = 0
+        for root, dirs, files in os.walk(self.repo_dir):
+            dirs[:] = [i for i in dirs if i not in ("repodata", ".index")]
+            for file in files:
+                if not file.endswith(".rpm"):
+                    continue
+                rpm_file = os.path.join(root, file)
+                location = os.path.relpath(rpm_file, self.repo_dir).replace(os.sep, "/")
+                locations.add(location)
+                stat = os.stat(rpm_file)
+                entry = cached.get(location)
+                if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                # The content may be unchanged, e.g. when the same package is downloaded again
+                sha256 = get_sha256(rpm_file)
+                if entry and entry[2] == sha256:
+                    record = json.loads(self.db.execute("SELECT record FROM packages WHERE location = ?",
+                                                        (location,)).fetchone()[0])
+                    record["time_file"] = int(stat.st_mtime)
+                else:
+                    record = create_package(rpm_file, location, sha256)
+                    read += 1
+                self.db.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)",
+                                (location, stat.st_size, stat.st_mtime_ns, sha256, json.dumps(record)))
+        self.db.executemany("DELETE FROM packages WHERE location = ?", [(i,) for i in cached if i not in locations])
+        self.db.commit()
+        return read, len(locations) - read
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def packages(self):
+        """
+        Iterates over the package records ordered by location
+        """
+        for row in self.db.execute("SELECT record FROM packages ORDER BY location"):
+            yield json.loads(row[0])
+
+
+def xml_text(value):
+    return escape(INVALID_XML_CHARS_REGEX.sub("", str(value)))
+
+
+def xml_attr(value):
+    return quoteattr(INVALID_XML_CHARS_REGEX.sub("", str(value)))
+
+
+def format_version(package):
+    return (f'<version epoch={xml_attr(package["epoch"])} ver={xml_attr(package["version"])} '
+            f'rel={xml_attr(package["release"])}/>')
+
+
+def format_file(path, file_type):
+    type_attribute = f" type={xml_attr(file_type)}" if file_type else ""
+    return f"<file{type_attribute}>{xml_text(path)}</file>"
+
+
+def format_dependencies(kind, dependencies):
+    if not dependencies:
+        return ""
+    entries = []
+    for dependency in dependencies:
+        name, flags, epoch, version, release = dependency[:5]
+        entry = f"<rpm:entry name={xml_attr(name)}"
+        if flags:
+            entry += f" flags={xml_attr(flags)}"
+        if version is not None:
+            entry += f" epoch={xml_attr(epoch)} ver={xml_attr(version)}"
+            if release is not None:
+                entry += f" rel={xml_attr(release)}"
+        if kind == "requires" and dependency[5]:
+            entry += ' pre="1"'
+        entries.append(entry + "/>")
+    return f"<rpm:{kind}>\n" + "".join(f"      {i}\n" for i in entries) + f"    </rpm:{kind}>\n"
+
+
+def format_primary(package):
+    primary_files = [i for i in package["files"] if PRIMARY_FILES_REGEX.search(i[0])]
+    return "".join((
+        '<package type="rpm">\n',
+        f'  <name>{xml_text(package["name"])}</name>\n',
+        f'  <arch>{xml_text(package["arch"])}</arch>\n',
+        f'  {format_version(package)}\n',
+        f'  <checksum type="sha256" pkgid="YES">{package["pkgid"]}</checksum>\n',
+        f'  <summary>{xml_text(package["summary"])}</summary>\n',
+        f'  <description>{xml_text(package["description"])}</description>\n',
+        f'  <packager>{xml_text(package["packager"])}</packager>\n',
+        f'  <url>{xml_text(package["url"])}</url>\n',
+        f'  <time file="{package["time_file"]}" build="{package["time_build"]}"/>\n',
+        f'  <size package="{package["size_package"]}" installed="{package["size_installed"]}" '
+        f'archive="{package["size_archive"]}"/>\n',
+        f'  <location href={xml_attr(package["location"])}/>\n',
+        '  <format>\n',
+        f'    <rpm:license>{xml_text(package["license"])}</rpm:license>\n',
+        f'    <rpm:vendor>{xml_text(package["vendor"])}</rpm:vendor>\n',
+        f'    <rpm:group>{xml_text(package["group"])}</rpm:group>\n',
+        f'    <rpm:buildhost>{xml_text(package["buildhost"])}</rpm:buildhost>\n',
+        f'    <rpm:sourcerpm>{xml_text(package["sourcerpm"])}</rpm:sourcerpm>\n',
+        f'    <rpm:header-range start="{package["header_range"][0]}" end="{package["header_range"][1]}"/>\n',
+        "".join(f"    {format_dependencies(k, v)}" for k, v in package["dependencies"].items() if v),
+        "".join(f"    {format_file(*i)}\n" for i in primary_files),
+        '  </format>\n',
+        '</package>\n',
+    ))
+
+
+def format_filelists(package):
+    return "".join((
+        f'<package pkgid="{package["pkgid"]}" name={xml_attr(package["name"])} arch={xml_attr(package["arch"])}>\n',
+        f'  {format_version(package)}\n',
+        "".join(f"  {format_file(*i)}\n" for i in package["files"]),
+        '</package>\n',
+    ))
+
+
+def format_other(package):
+    return "".join((
+        f'<package pkgid="{package["pkgid"]}" name={xml_attr(package["name"])} arch={xml_attr(package["arch"])}>\n',
+        f'  {format_version(package)}\n',
+        "".join(f'  <changelog author={xml_attr(author)} date="{date}">{xml_text(text)}</changelog>\n'
+                for author, date, text in package["changelogs"]),
+        '</package>\n',
+    ))
+
+
+METADATA = {
+    "primary": ('<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm"'
+                ' packages="{count}">\n', "</metadata>\n", format_primary),
+    "filelists": ('<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="{count}">\n',
+                  "</filelists>\n", format_filelists),
+    "other": ('<otherdata xmlns="http://linux.duke.edu/metadata/other" packages="{count}">\n',
+              "</otherdata>\n", format_other),
+}
+
+
+class HashingFile:
+    """
+    Write-only file computing the sha256 and the size of what is written to it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class MetadataWriter:
+    """
+    Streams a gzipped metadata file to disk computing the checksums and sizes of both its compressed and uncompressed
+    content on the fly, so that neither the document is held in memory nor the file read back for repomd.xml
+    """
+
+    def __init__(self, repodata_dir, data_type, count):
+        self.repodata_dir = repodata_dir
+        self.data_type = data_type
+        start, self.end, self.format_package = METADATA[data_type]
+        self.temp_file = os.path.join(repodata_dir, f"{data_type}.xml.gz")
+        self.file = open(self.temp_file, "wb")
+        self.compressed = HashingFile(self.file)
+        self.gzip = gzip.GzipFile(filename="", mode="wb", fileobj=self.compressed, mtime=0)
+        self.uncompressed = HashingFile(self.gzip)
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.write(start.format(count=count))
+
+    def write(self, text):
+        self.uncompressed.write(text.encode("utf-8"))
+
+    def add(self, package):
+        self.write(self.format_package(package))
+
+    def close(self):
+        """
+        Completes the file and names it after its checksum
+        :return the repomd.xml entry of the file
+        """
+        self.write(self.end)
+        self.gzip.close()
+        self.file.close()
+        checksum = self.compressed.sha256.hexdigest()
+        filename = f"{checksum}-{self.data_type}.xml.gz"
+        os.replace(self.temp_file, os.path.join(self.repodata_dir, filename))
+        return {
+            "type": self.data_type,
+            "checksum": checksum,
+            "open-checksum": self.uncompressed.sha256.hexdigest(),
+            "location": f"repodata/{filename}",
+            "timestamp": int(time.time()),
+            "size": self.compressed.size,
+            "open-size": self.uncompressed.size,
+        }
+
+
+def write_metadata(repodata_dir, packages, count):
+    """
+    Writes all the metadata files in a single pass over the package records
+    :param packages iterable of the package records
+    :param count the number of packages
+    :return the repomd.xml entries of the files
+    """
+    writers = [MetadataWriter(repodata_dir, i, count) for i in METADATA]
+    for package in packages:
+        for writer in writers:
+            writer.add(package)
+    return [i.close() for i in writers]
+
+
+def write_repomd(repodata_dir, entries):
+    repomd = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n',
+        f'  <revision>{int(time.time())}</revision>\n',
+    ]
+    for entry in entries:
+        repomd += [
+            f'  <data type="{entry["type"]}">\n',
+            f'    <checksum type="sha256">{entry["checksum"]}</checksum>\n',
+            f'    <open-checksum type="sha256">{entry["open-checksum"]}</open-checksum>\n',
+            f'    <location href="{entry["location"]}"/>\n',
+            f'    <timestamp>{entry["timestamp"]}</timestamp>\n',
+            f'    <size>{entry["size"]}</size>\n',
+            f'    <open-size>{entry["open-size"]}</open-size>\n',
+            '  </data>\n',
+        ]
+    repomd.append("</repomd>\n")
+    with open(os.path.join(repodata_dir, "repomd.xml"), "w", encoding="utf-8") as f:
+        f.writelines(repomd)
+
+
+def generate_repodata(repo_dir):
+    """
+    Generates the repodata of the repository from the packages found in it
+    """
+    print(f"Generating yum metadata for {repo_dir}...")
+    cache = HeaderCache(repo_dir)
+    try:
+        read, reused = cache.update()
+        if not cache.count():
+            raise ValueError(f"No packages found in `{repo_dir}`")
+        print(f"{read} packages read, {reused} packages unchanged")
+
+        # The new repodata is written next to the current one which is then replaced at once
+        repodata_dir = tempfile.mkdtemp(prefix=".repodata.", dir=repo_dir)
+        os.chmod(repodata_dir, 0o755)
+        entries = write_metadata(repodata_dir, cache.packages(), cache.count())
+        write_repomd(repodata_dir, entries)
+    finally:
+        cache.close()
+    shutil.rmtree(os.path.join(repo_dir, "repodata"), ignore_errors=True)
+    os.rename(repodata_dir, os.path.join(repo_dir, "repodata"))
+    print(f"Generating yum metadata for {repo_dir}...Done")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        sys.exit(1)
+    generate_repodata(sys.argv[1])
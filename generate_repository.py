@@ -1,14 +1,27 @@
 import os
 import argparse
+import contextlib
 import shutil
 import subprocess
 import base64
 import sys
 import platform
+import tempfile
 import json
+import glob
+import hashlib
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from distutils.dir_util import copy_tree
 
+from channels import publish
+from pdt_tool.helpers.cache import ChecksumCache
+from pdt_tool.helpers.metrics import metrics, profile
+from pdt_tool.helpers.plan import estimate_duration, format_plan, summarize_plan
+from pdt_tool.helpers.shard import ShardQueue, default_shards
+
 
 def log(*arg, **kwarg):
     timestamp = datetime.now().strftime("%H:%M:%S")
@@ -37,207 +50,823 @@ def check_prerequisites():
         sys.exit(1)
 
 
-def create_local_repo(package: dict, distribution_channel: str, publish_dir: str):
-    available_distributions = {"yum": yum, "apt": apt}
-    product = package['product']
-    release = package['release']
-    guid = package['guid']
-    return available_distributions[distribution_channel](product, release, guid, publish_dir)
+def create_local_repo(package, distribution_channel: str, publish_dir: str, mirror=False, repo_name=None, jobs=1,
+                      resolved=None, keep=1, plan=None, apt_pdiff=0):
+    """
+    :param package a dict with the `product`, `release` and `guid` of the package, or a list of such dicts to build one
+    combined repository for all of them
+    :param repo_name the name to register the repository with. Defaults to the product of the first package.
+    :param jobs the number of parallel downloads
+    :param resolved the packages already resolved by `resolve_packages`
+    :param keep the number of previous generations of the repository to keep
+    :param plan the download plan of the channel as created by `create_download_plan`
+    :param apt_pdiff the number of pdiff patches kept in an APT repository, 0 to disable them
+    """
+    available_distributions = {"yum": yum, "apt": apt, "webimage": webimage}
+    packages = package if isinstance(package, list) else [package]
+    repo_name = repo_name or packages[0]['product']
+    options = {"pdiff": apt_pdiff} if distribution_channel == "apt" else dict()
+    with metrics.span("generate.repository", channel=distribution_channel):
+        return available_distributions[distribution_channel](packages, publish_dir, mirror, repo_name, jobs, resolved,
+                                                             keep, plan, **options)
+
+
+def create_local_repos(package, distribution_channels: list, publish_dir: str, mirror=False, repo_name=None, jobs=1,
+                       keep=1, plan=None, apt_pdiff=0):
+    """
+    Generates the repositories of several distribution channels concurrently. The packages are resolved once for all
+    the channels and each repository is published in a sub folder of the publish dir named after its channel.
+    :param plan the download plan created by `create_download_plan`. The packages are not resolved nor listed again.
+    """
+    resolved = plan["packages"] if plan else None
+    if len(distribution_channels) == 1:
+        return create_local_repo(package, distribution_channels[0], publish_dir, mirror, repo_name, jobs, resolved,
+                                 keep, get_channel_plan(plan, distribution_channels[0]), apt_pdiff)
+
+    packages = package if isinstance(package, list) else [package]
+    if not resolved:
+        temp_dir = get_temp_dir()
+        try:
+            with metrics.span("generate.resolve"):
+                resolved = resolve_packages(packages, temp_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    with ThreadPoolExecutor(max_workers=len(distribution_channels)) as executor:
+        results = [executor.submit(create_local_repo, packages, channel, os.path.join(publish_dir, channel), mirror,
+                                   repo_name, jobs, resolved, keep, get_channel_plan(plan, channel), apt_pdiff)
+                   for channel in distribution_channels]
+        return all(i.result() for i in results)
+
+
+def get_channel_plan(plan, channel):
+    if not plan:
+        return None
+    if channel not in plan["channels"]:
+        raise Exception(f"The download plan has no `{channel}` channel. Planned channels: "
+                        f"{', '.join(plan['channels'])}")
+    return plan["channels"][channel]
+
+
+def create_download_plan(package, distribution_channels: list, publish_dir: str, mirror=False, jobs=1):
+    """
+    Resolves the packages and their dependency packages and lists the files of each channel without downloading
+    anything. The plan can be executed later, or its files fetched by several hosts.
+    :param mirror whether the files already in the repositories of the publish dir are not downloaded again
+    :return the resolved `packages`, the plan of each of the `channels` and the totals with the estimated duration of
+    the downloads
+    """
+    packages = package if isinstance(package, list) else [package]
+    plan = {"packages": [], "channels": dict()}
+    temp_dir = get_temp_dir()
+    try:
+        with metrics.span("generate.resolve"):
+            plan["packages"] = resolve_packages(packages, temp_dir)
+        for channel in distribution_channels:
+            channel_publish_dir = publish_dir if len(distribution_channels) == 1 else os.path.join(publish_dir, channel)
+            existing_dir = os.path.join(channel_publish_dir, channel_mirror_path[channel]) if mirror else None
+            with metrics.span("generate.plan", channel=channel):
+                channel_plan = plan_download(plan["packages"], channel, temp_dir, existing_dir)
+            plan["channels"][channel] = summarize_plan(channel_plan, jobs=jobs)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # The channels are downloaded concurrently sharing the bandwidth
+    channel_plans = plan["channels"].values()
+    for key in ("download files", "download bytes", "skipped files", "skipped bytes"):
+        plan[key] = sum(i[key] for i in channel_plans)
+    plan["estimated seconds"] = round(estimate_duration(plan["download bytes"], plan["download files"],
+                                                        jobs * len(distribution_channels)), 1)
+    return plan
 
 
 def read_meta_data(filename):
     with open(filename) as file:
         return json.load(file)
 
-def package_download(product, release, guid, package_channel, download_dir):
 
+def read_manifest(filename):
+    """
+    Reads the list of packages to build a combined repository for from a json or yaml file
+    """
+    with open(filename) as file:
+        if filename.lower().endswith((".yaml", ".yml")):
+            import yaml
+            packages = yaml.safe_load(file)
+        else:
+            packages = json.load(file)
+    if isinstance(packages, dict):
+        packages = packages.get('packages', [])
+    for package in packages:
+        if not all(package.get(key) for key in ('product', 'release', 'guid')):
+            raise Exception(f"Invalid package `{package}` in manifest `{filename}`. "
+                            "Each package needs a `product`, `release` and `guid`.")
+    return packages
+
+
+def get_requested_packages(arguments, parser):
+    """
+    Gets the packages requested on the command line, either in a manifest or with `--product_id`, `--release_id` and
+    `--package_guid`
+    :return the package or the list of packages of the manifest, and the name of the repository which defaults to the
+    name of the manifest
+    """
+    repo_name = arguments.repo_name
+    if arguments.manifest:
+        if arguments.product_id or arguments.release_id or arguments.package_guid:
+            parser.error("--manifest cannot be combined with --product_id, --release_id and --package_guid")
+        package = read_manifest(arguments.manifest)
+        if not package:
+            parser.error(f"No packages found in manifest `{arguments.manifest}`")
+        repo_name = repo_name or os.path.splitext(os.path.basename(arguments.manifest))[0]
+    else:
+        if not (arguments.product_id and arguments.release_id and arguments.package_guid):
+            parser.error("--product_id, --release_id and --package_guid are required unless --manifest is provided")
+        package = dict()
+        package['product'] = arguments.product_id
+        package['release'] = arguments.release_id
+        package['guid'] = arguments.package_guid
+    return package, repo_name
+
+
+pdt_tool = os.path.join("pdt_tool", "pdt.py")
+channel_repo_path = {"yum": "repositories/yum_native",
+                     "apt": "repositories/apt_native/pool/main",
+                     "webimage": "webimage/"}
+# Where the downloaded files of each channel are kept in its repository
+channel_mirror_path = {"yum": "",
+                       "apt": os.path.join("pool", "main"),
+                       "webimage": "webimage"}
+product_skip_list = ["oneapi_installer", "openvino_installer", "pset_build_tools", "software_installer", "wi"]
+# Checksums of the files of the mirrors and of the fetch dirs, saved once the files are planned or fetched
+checksums = ChecksumCache()
+
+
+@contextlib.contextmanager
+def pdt_server():
+    """
+    Runs a pdt server during the enclosed block so that the pdt runs send it their actions instead of each of them
+    setting up its own Artifactory session
+    """
     ARTIFACTORY_USER = os.environ['ARTIFACTORY_USER']
     ARTIFACTORY_PASS = os.environ['ARTIFACTORY_PASS']
 
-    #This is for handlig exceptions in case lack of 'dependency.packages' in meta.yaml
-    EMPTY_PROD_ID = 'Empty_product'
-    EMPTY_PROD_VER = 'Empty_version'
-    EMPTY_POSTFIX = 'Empty_postfix'
-
-    pdt_tool = os.path.join("pdt_tool", "pdt.py")
+    socket_dir = tempfile.mkdtemp(prefix="pdt_server_")
+    socket_path = os.path.join(socket_dir, "pdt.sock")
+    process = subprocess.Popen([sys.executable, "-u", pdt_tool,
+                                                "-u", ARTIFACTORY_USER,
+                                                "-p", ARTIFACTORY_PASS,
+                                                "serve",
+                                                "--socket", socket_path])
+    try:
+        while not os.path.exists(socket_path):
+            if process.poll() is not None:
+                raise Exception(f"The pdt server failed to start with exit code {process.returncode}")
+            time.sleep(0.1)
+        os.environ["PDT_SERVER"] = socket_path
+        yield socket_path
+    finally:
+        os.environ.pop("PDT_SERVER", None)
+        process.terminate()
+        process.wait()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def get_temp_dir():
+    """
+    Creates a unique temp dir so that the repositories of several channels can be generated at the same time
+    """
     if platform.system() in ['Linux', 'Darwin']:
         repositories_path = os.path.join("/work", "repositories")
-        temp_dir = os.path.join(repositories_path, "temp")
     else:
         repo_path = os.path.dirname(__file__)
         repositories_path = os.path.join(repo_path, "repositories")
-        temp_dir = os.path.join(repositories_path, "temp")
-    channel_repo_path = {"yum": "repositories/yum_native",
-                         "apt": "repositories/apt_native/pool/main",
-                         "webimage": "webimage/"}
-    product_skip_list = ["oneapi_installer", "openvino_installer", "pset_build_tools", "software_installer", "wi"]
-    if not os.path.exists(repositories_path):
-        os.mkdir(repositories_path)
-        os.mkdir(temp_dir)
-    log("Downloading {channel} channel for package {id}.{version}...".format(channel=package_channel,
-                                                                         id=product,
-                                                                         version=release))
-    stdout = cmd([sys.executable, "-u", pdt_tool,
-                                  "-u", ARTIFACTORY_USER,
-                                  "-p", ARTIFACTORY_PASS,
-                                  "download",
-                                  "-p", product,
-                                  "-r", release,
-                                  "-g", guid,
-                                  "-d", download_dir,
-                                  "--part", channel_repo_path[package_channel],
-                                  "--shallow"])
-    log("DONE!")
-    stdout = cmd([sys.executable, "-u", pdt_tool,
-                                  "-u", ARTIFACTORY_USER,
-                                  "-p", ARTIFACTORY_PASS,
-                                  "search",
-                                  "-p", product,
-                                  "-r", release,
-                                  "-g", guid,
-                                  "-mf", os.path.join(temp_dir, "meta.json")])
-    upper_level_meta_data = read_meta_data(os.path.join(temp_dir, "meta.json"))
+    os.makedirs(repositories_path, exist_ok=True)
+    return tempfile.mkdtemp(prefix="temp_", dir=repositories_path)
+
+
+def get_dependency_packages(meta: dict) -> list:
+    """
+    Gets the dependency packages of a package from its resolved properties
+    :return the list of (product, release, guid) tuples of the dependency packages
+    """
+    #This is for handlig exceptions in case lack of 'dependency.packages' in meta.yaml
+    EMPTY_PROD_ID = 'Empty_product'
+    EMPTY_PROD_VER = 'Empty_version'
+    EMPTY_POSTFIX = 'Empty_postfix'
+
     try:
-        dependency_packages = upper_level_meta_data['resolved properties']['dependency.packages'][0].split(":")
+        dependency_packages = meta['resolved properties']['dependency.packages'][0].split(":")
     except:
         dependency_packages = [''.join(f'{EMPTY_PROD_ID}.{EMPTY_PROD_VER}.{EMPTY_POSTFIX}')]
+    dependencies = list()
     for dependency_package in dependency_packages:
         dependency_product_id, version, _ = dependency_package.split(".")
         dependency_release_id = ".".join(version.split("_"))
-        if dependency_product_id in product_skip_list or package_channel == "webimage":
+        if dependency_product_id in product_skip_list or dependency_product_id == EMPTY_PROD_ID:
             continue
         guid_property_name = "dependency.package." + dependency_package
-        log("Downloading {channel} channel for package {id}.{version}...".format(channel=package_channel,
-                                                                         id=dependency_product_id,
-                                                                         version=dependency_release_id))
+        dependencies.append((dependency_product_id, dependency_release_id,
+                             meta['resolved properties'][guid_property_name][0]))
+    return dependencies
+
+
+def resolve_packages(packages: list, temp_dir):
+    """
+    Resolves the packages and all their transitive dependency packages. The resolution does not depend on the
+    distribution channel so it can be shared by the repositories of several channels.
+    :param packages the dicts with the `product`, `release` and `guid` of the packages
+    :return the dicts with the `product`, `release`, `guid` and `path` of the unique packages, flagged as `dependency`
+    when they were only required by other packages
+    """
+    ARTIFACTORY_USER = os.environ['ARTIFACTORY_USER']
+    ARTIFACTORY_PASS = os.environ['ARTIFACTORY_PASS']
+
+    resolved = dict()
+    queue = [(i['product'], i['release'], i['guid'], False) for i in packages]
+    while queue:
+        product, release, guid, dependency = queue.pop(0)
+        if (product, release, guid) in resolved:
+            continue
+
+        log("Resolving package {id}.{version}...".format(id=product, version=release))
+        meta_file = os.path.join(temp_dir, f"{product}_{release}_{guid}_meta.json")
+        stdout = cmd([sys.executable, "-u", pdt_tool,
+                                      "-u", ARTIFACTORY_USER,
+                                      "-p", ARTIFACTORY_PASS,
+                                      "search",
+                                      "-p", product,
+                                      "-r", release,
+                                      "-g", guid,
+                                      "-mf", meta_file])
+        meta = read_meta_data(meta_file)
+        resolved[(product, release, guid)] = {
+            "product": product,
+            "release": release,
+            "guid": guid,
+            "path": meta["path"],
+            "dependency": dependency,
+        }
+        queue += [i + (True,) for i in get_dependency_packages(meta)]
+    return list(resolved.values())
+
+
+def plan_download(packages: list, package_channel, temp_dir, existing_dir=None):
+    """
+    Lists the files of the channel of the resolved packages and deduplicates the files shared by several packages so
+    that each of them is downloaded once
+    :param packages the resolved packages as returned by `resolve_packages`
+    :param existing_dir folder holding previously downloaded packages which are not downloaded again
+    :return the download plan
+    """
+    ARTIFACTORY_USER = os.environ['ARTIFACTORY_USER']
+    ARTIFACTORY_PASS = os.environ['ARTIFACTORY_PASS']
+
+    plan = {
+        "channel": package_channel,
+        "packages": [],
+        "files": [],
+        "existing files": [],
+        "duplicate files": [],
+    }
+    planned_files = dict()
+    for package in packages:
+        # The webimage channel of the package already contains its dependencies
+        if package["dependency"] and package_channel == "webimage":
+            continue
+        product, release, guid = package["product"], package["release"], package["guid"]
+
+        log("Listing {channel} channel for package {id}.{version}...".format(channel=package_channel,
+                                                                         id=product,
+                                                                         version=release))
+        files_file = os.path.join(temp_dir, f"{product}_{release}_{guid}_{package_channel}_files.json")
         stdout = cmd([sys.executable, "-u", pdt_tool,
                                       "-u", ARTIFACTORY_USER,
                                       "-p", ARTIFACTORY_PASS,
-                                      "download",
-                                      "-p", dependency_product_id,
-                                      "-r", dependency_release_id,
-                                      "-g", upper_level_meta_data['resolved properties'][guid_property_name][0],
-                                      "-d", download_dir,
+                                      "list",
+                                      "-p", product,
+                                      "-r", release,
+                                      "-g", guid,
                                       "--part", channel_repo_path[package_channel],
-                                      "--shallow"])
-        log("DONE!")
-    shutil.rmtree(temp_dir)
+                                      "--shallow",
+                                      "-o", files_file])
+        plan["packages"].append(package)
+
+        for file in read_meta_data(files_file):
+            file["package"] = f"{product}.{release}"
+            planned_file = planned_files.get(file["name"])
+            if planned_file:
+                if planned_file["sha256"] != file["sha256"]:
+                    print(f"WARNING: `{file['path']}` is skipped since `{file['name']}` is already provided by "
+                          f"`{planned_file['path']}` with a different checksum")
+                plan["duplicate files"].append(file)
+                continue
+            planned_files[file["name"]] = file
+            if is_existing_file(file, existing_dir):
+                plan["existing files"].append(file)
+            else:
+                plan["files"].append(file)
+    checksums.save()
+
+    download_size = sum(i["size"] for i in plan["files"])
+    saved_size = sum(i["size"] for i in plan["duplicate files"] + plan["existing files"])
+    log(f"Download plan: {len(plan['packages'])} packages, {len(plan['files'])} files to download "
+        f"({download_size / 1024 / 1024:.1f} MB), {len(plan['duplicate files'])} duplicate and "
+        f"{len(plan['existing files'])} existing files skipped ({saved_size / 1024 / 1024:.1f} MB saved)")
+    return plan
+
+
+def is_existing_file(file: dict, existing_dir) -> bool:
+    """
+    Checks that a planned file exists in a folder with the same size and checksum
+    """
+    existing_file = os.path.join(existing_dir, file["name"]) if existing_dir else None
+    if not existing_file or not os.path.isfile(existing_file) or os.path.getsize(existing_file) != file["size"]:
+        return False
+    return not file.get("sha256") or checksums.get_sha256(existing_file) == file["sha256"]
+
+
+def update_plan(plan: dict, existing_dir=None) -> dict:
+    """
+    Checks again which files of a saved download plan already exist since the existing dir may have changed since the
+    plan was created
+    """
+    files = plan["files"] + plan["existing files"]
+    plan = dict(plan)
+    plan["files"] = [i for i in files if not is_existing_file(i, existing_dir)]
+    plan["existing files"] = [i for i in files if is_existing_file(i, existing_dir)]
+    checksums.save()
+    log(f"Download plan: {len(plan['packages'])} packages, {len(plan['files'])} files to download, "
+        f"{len(plan['existing files'])} existing files skipped")
+    return plan
+
+
+def download_files(files: list, download_dir, temp_dir, jobs=1, queue_dir=None, shards=None):
+    """
+    Downloads the files of a download plan with parallel pdt processes claiming the shards of the files from a queue
+    :param queue_dir the folder of the shard queue, shared with the workers on other hosts. Defaults to a queue of the
+    run only.
+    :param shards the number of shards of a new queue
+    """
+    ARTIFACTORY_USER = os.environ['ARTIFACTORY_USER']
+    ARTIFACTORY_PASS = os.environ['ARTIFACTORY_PASS']
 
+    if not files:
+        return
+    fd, files_file = tempfile.mkstemp(prefix="fetch_", suffix=".json", dir=temp_dir)
+    with os.fdopen(fd, "w") as file:
+        json.dump(files, file)
+    queue_dir = queue_dir or tempfile.mkdtemp(prefix="queue_", dir=temp_dir)
+    shards = shards or default_shards
 
-def yum(product, release, guid, publish_dir):
+    def fetch(worker_index):
+        stdout = cmd([sys.executable, "-u", pdt_tool,
+                                      "-u", ARTIFACTORY_USER,
+                                      "-p", ARTIFACTORY_PASS,
+                                      "fetch",
+                                      "--files-from", files_file,
+                                      "--queue-dir", queue_dir,
+                                      "--shards", str(shards),
+                                      "-d", download_dir])
+
+    jobs = max(min(jobs, len(files), shards), 1)
+    log(f"Downloading {len(files)} files...")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(fetch, range(jobs)))
+    log("DONE!")
+
+
+def get_plan_key(plan: dict) -> str:
+    """
+    Identifies the files of a channel plan, including the ones which already exist, so that a fetch dir reused for
+    another plan gets a new shard queue instead of the shards done for the previous plan
+    """
+    files = sorted([i["name"], i.get("sha256")] for i in plan["files"] + plan["existing files"])
+    return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()[:16]
+
+
+def fetch_shared_files(plan: dict, package_channel, temp_dir, jobs=1, wait=True):
+    """
+    Downloads the files of a download plan in a folder shared with workers on other hosts, each file being downloaded
+    by a single of them. Running again after a crash resumes the download.
+    :param plan the download plan of the channel with its `fetch dir`, the shared folder. The files of each channel
+    are downloaded in a sub folder named after it.
+    :param wait whether to wait for the shards downloaded by the other workers, and to download the files missing
+    :return the folder of the files of the channel
+    """
+    files, fetch_dir, shards = plan["files"], plan["fetch dir"], plan.get("shards")
+    channel_fetch_dir = os.path.join(fetch_dir, package_channel)
+    # The shards done are tied to the files of the plan
+    queue_dir = os.path.join(fetch_dir, ".queue", package_channel, get_plan_key(plan))
+    download_files(files, channel_fetch_dir, temp_dir, jobs, queue_dir, shards)
+    if not wait or not files:
+        return channel_fetch_dir
+
+    queue = ShardQueue(queue_dir, shards or default_shards)
+    while queue.get_pending():
+        log(f"Waiting for the {len(queue.get_pending())} {package_channel} shards downloaded by other workers...")
+        time.sleep(10)
+        # The shards of the workers which failed are released
+        download_files(files, channel_fetch_dir, temp_dir, jobs, queue_dir, shards)
+
+    # Files which were not planned when the queue was filled
+    missing = [i for i in files if not is_existing_file(i, channel_fetch_dir)]
+    checksums.save()
+    if missing:
+        download_files(missing, channel_fetch_dir, temp_dir, jobs)
+    return channel_fetch_dir
+
+
+def fetch_plan(plan: dict, distribution_channels: list, jobs=1):
+    """
+    Downloads the files of the channels of a plan in its fetch dir as a worker, without waiting for the other workers
+    """
+    temp_dir = get_temp_dir()
+    try:
+        for channel in distribution_channels:
+            channel_plan = get_channel_plan(plan, channel)
+            with metrics.span("generate.download", channel=channel):
+                fetch_shared_files(channel_plan, channel, temp_dir, jobs, wait=False)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def link_files(files: list, source_dir, target_dir):
+    """
+    Hard links the files into the target dir, or copies them when the folders are on different file systems
+    """
+    for file in files:
+        target_file = os.path.join(target_dir, file["name"])
+        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+        try:
+            os.link(os.path.join(source_dir, file["name"]), target_file)
+        except OSError:
+            shutil.copy2(os.path.join(source_dir, file["name"]), target_file)
+
+
+def package_download(packages: list, package_channel, download_dir, existing_dir=None, jobs=1, resolved=None,
+                     plan=None):
+    """
+    Downloads the channel of the packages and of their dependency packages. Files shared by several packages are
+    downloaded once.
+    :param packages the dicts with the `product`, `release` and `guid` of the packages
+    :param existing_dir folder holding previously downloaded packages which are not downloaded again
+    :param jobs the number of parallel downloads
+    :param resolved the packages already resolved by `resolve_packages`
+    :param plan the download plan of the channel as created by `create_download_plan`. When the plan has a `fetch dir`,
+    the files are downloaded there, together with the workers sharing it, before being linked into the download dir.
+    :return the names of all the files of the channel, including the ones not downloaded since they already exist
+    """
+    temp_dir = get_temp_dir()
+    try:
+        if plan:
+            plan = update_plan(plan, existing_dir)
+        else:
+            if not resolved:
+                with metrics.span("generate.resolve"):
+                    resolved = resolve_packages(packages, temp_dir)
+            with metrics.span("generate.plan", channel=package_channel):
+                plan = plan_download(resolved, package_channel, temp_dir, existing_dir)
+        with metrics.span("generate.download", channel=package_channel) as span:
+            span.bytes = sum(i["size"] for i in plan["files"])
+            channel_download_dir = os.path.join(download_dir, channel_repo_path[package_channel])
+            if plan.get("fetch dir"):
+                channel_fetch_dir = fetch_shared_files(plan, package_channel, temp_dir, jobs)
+                link_files(plan["files"], channel_fetch_dir, channel_download_dir)
+            else:
+                download_files(plan["files"], channel_download_dir, temp_dir, jobs)
+        return {i["name"] for i in plan["files"] + plan["existing files"]}
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def sync_mirror(source_dir, mirror_dir, packages, extension, jobs=1):
+    """
+    Moves the newly downloaded packages into the mirror and removes the ones which are no longer part of it
+    :param source_dir the folder where the new packages were downloaded
+    :param mirror_dir the folder holding the packages of the mirror
+    :param packages the names of all the files which should be part of the mirror
+    :param extension the extension of the package files
+    :param jobs the number of parallel copies when the packages cannot be moved
+    """
+    os.makedirs(mirror_dir, exist_ok=True)
+    added = sum(publish.publish_flat(source_dir, mirror_dir, extension, jobs=jobs).values())
+    removed = 0
+    for file in os.listdir(mirror_dir):
+        if file.endswith(extension) and file not in packages:
+            os.remove(os.path.join(mirror_dir, file))
+            removed += 1
+    total = len([i for i in packages if i.endswith(extension)])
+    log(f"Mirror updated: {added} packages added, {removed} removed, {total} in total")
+
+
+def verify_repository(repo_dir, package_channel, files):
+    """
+    Checks that a generated repository is complete before it is published
+    :param files the names of all the files which should be part of the repository
+    :return the list of the problems found
+    """
+    package_dirs = {"yum": repo_dir,
+                    "apt": os.path.join(repo_dir, "pool", "main"),
+                    "webimage": os.path.join(repo_dir, "webimage")}
+    errors = [f"Missing package `{i}`" for i in sorted(files)
+              if not os.path.isfile(os.path.join(package_dirs[package_channel], i))]
+
+    # Every file referenced by the metadata must be part of the repository
+    referenced = []
+    if package_channel == "yum":
+        repomd = os.path.join(repo_dir, "repodata", "repomd.xml")
+        if not os.path.isfile(repomd):
+            errors.append("Missing `repodata/repomd.xml`")
+        else:
+            with open(repomd) as f:
+                referenced = re.findall(r'<location href="([^"]+)"', f.read())
+    elif package_channel == "apt":
+        release = os.path.join(repo_dir, "dists", "all", "Release")
+        if not os.path.isfile(release):
+            errors.append("Missing `dists/all/Release`")
+        for packages_file in glob.glob(os.path.join(repo_dir, "dists", "all", "main", "binary-*", "Packages")):
+            with open(packages_file, encoding="utf-8", errors="ignore") as f:
+                referenced += re.findall(r"^Filename: (.+)$", f.read(), re.MULTILINE)
+    errors += [f"Missing `{i}` referenced by the metadata" for i in sorted(set(referenced))
+               if not os.path.isfile(os.path.normpath(os.path.join(repo_dir, i)))]
+    return errors
+
+
+def publish_generation(publish_dir, repo_dir, package_channel, files, keep=1):
+    """
+    Verifies the generated repository and, if it is complete, atomically makes the publish dir point to it. The
+    previous generations but the `keep` latest ones are removed. An incomplete repository is discarded and the publish
+    dir keeps serving the current generation.
+    """
+    with metrics.span("generate.publish", channel=package_channel):
+        shutil.rmtree(os.path.join(repo_dir, "SOURCES"), ignore_errors=True)
+        errors = verify_repository(repo_dir, package_channel, files)
+        if errors:
+            for error in errors[:10]:
+                log(f"ERROR: {error}")
+            log(f"ERROR: The {package_channel} repository is incomplete, {publish_dir} is not updated")
+            shutil.rmtree(repo_dir, ignore_errors=True)
+            return False
+        generation_dir = publish.flip_generation(publish_dir, repo_dir)
+        publish.prune_generations(publish_dir, keep)
+        log(f"Published {package_channel} repository {generation_dir} to {publish_dir}")
+        return True
+
+
+def yum(packages, publish_dir, mirror=False, repo_name=None, jobs=1, resolved=None, keep=1, plan=None):
     channel_dir = "yum"
-    source_dir = os.path.join(publish_dir, "SOURCES")
     yum_repo_gen_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "channels", "yum", "create_repo.sh")
 
-    if os.path.exists(publish_dir):
-        shutil.rmtree(publish_dir)
-    os.makedirs(publish_dir)
-    
-    package_download(product, release, guid, channel_dir, source_dir)
+    # The repository is generated in a new generation while the current one keeps being served from the publish dir
+    repo_dir = publish.create_staging_dir(publish_dir, seed=mirror, jobs=jobs)
+    source_dir = os.path.join(repo_dir, "SOURCES")
 
-    shutil.rmtree(os.path.join(source_dir, "repositories", "yum_native", "repodata"))
-    
-    try:
-        output = subprocess.check_output("createrepo --help", shell=True)
-    except subprocess.CalledProcessError as e:
-        print(e)
-        print("createrepo tool is required for generating YUM repository.")
-        exit(1)
+    repo_name = repo_name or packages[0]['product']
+    files = package_download(packages, channel_dir, source_dir, existing_dir=repo_dir if mirror else None, jobs=jobs,
+                             resolved=resolved, plan=plan)
 
-    log("Generating YUM repository for {product}...".format(product=product))
+    log("Generating YUM repository for {product}...".format(product=repo_name))
     output = ''
     try:
-        output = subprocess.check_output(["/bin/bash", yum_repo_gen_script_path, os.path.join(source_dir, "repositories", "yum_native"),
-                                        publish_dir], stderr=subprocess.STDOUT).decode("utf-8", errors='ignore')
-
+        # The repodata of the downloaded packages is not used, the metadata of the packages which did not change since
+        # the previous generation is reused from its header cache
+        with metrics.span("generate.sync", channel=channel_dir):
+            sync_mirror(os.path.join(source_dir, "repositories", "yum_native"), repo_dir, files, ".rpm", jobs)
         shutil.rmtree(source_dir)
+        with metrics.span("generate.index", channel=channel_dir):
+            output = subprocess.check_output(["/bin/bash", yum_repo_gen_script_path, repo_dir],
+                                             stderr=subprocess.STDOUT).decode("utf-8", errors='ignore')
         log("Generating YUM repository...Done")
     except subprocess.CalledProcessError as e:
         print(e)
         output = e.output.decode('utf-8', errors='ignore')
-        shutil.rmtree(source_dir)
+        shutil.rmtree(source_dir, ignore_errors=True)
     except Exception as e:
         print(e)
     print(output)
 
-    print("Registering YUM repository on machine")
-    local_repo_filename = product + ".repo"
-    repo_file_path = os.path.join(os.getcwd(), local_repo_filename)
-    repo_file_content = ''.join(("[{id}]\n".format(id=product),
-                                 "name=Intel(R) oneAPI repository\n",
-                                 "baseurl=file:{repo_dir}\n".format(repo_dir=publish_dir),
-                                 "enabled=1\n",
-                                 "gpgcheck=0\n",
-                                 "repo_gpgcheck=0\n"))
-    with open(repo_file_path, "w") as file:
-        file.write(repo_file_content)
-    shutil.copyfile(repo_file_path, "/etc/yum.repos.d/" + local_repo_filename)
-    os.remove(repo_file_path)
-    print("Registering YUM repository on machine...Done")
+    if not publish_generation(publish_dir, repo_dir, channel_dir, files, keep):
+        return False
+
+    with metrics.span("generate.register", channel=channel_dir):
+        print("Registering YUM repository on machine")
+        local_repo_filename = repo_name + ".repo"
+        repo_file_path = os.path.join(os.getcwd(), local_repo_filename)
+        repo_file_content = ''.join(("[{id}]\n".format(id=repo_name),
+                                     "name=Intel(R) oneAPI repository\n",
+                                     "baseurl=file:{repo_dir}\n".format(repo_dir=publish_dir),
+                                     "enabled=1\n",
+                                     "gpgcheck=0\n",
+                                     "repo_gpgcheck=0\n"))
+        with open(repo_file_path, "w") as file:
+            file.write(repo_file_content)
+        shutil.copyfile(repo_file_path, "/etc/yum.repos.d/" + local_repo_filename)
+        os.remove(repo_file_path)
+        print("Registering YUM repository on machine...Done")
     return True
 
 
-def apt(product, release, guid, publish_dir):
+def apt(packages, publish_dir, mirror=False, repo_name=None, jobs=1, resolved=None, keep=1, plan=None, pdiff=0):
     channel_dir = "apt"
-    source_dir = os.path.join(publish_dir, "SOURCES")
     apt_repo_gen_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "channels", "apt", "create_repo.sh")
-    
-    if os.path.exists(publish_dir):
-        shutil.rmtree(publish_dir)
-    os.makedirs(publish_dir)
 
-    package_download(product, release, guid, channel_dir, source_dir)
+    # The repository is generated in a new generation while the current one keeps being served from the publish dir.
+    # The previous indexes are needed for their by-hash files and pdiff patches.
+    repo_dir = publish.create_staging_dir(publish_dir, seed=mirror, jobs=jobs, seed_dirs=(publish.INDEX_DIR, "dists"))
+    source_dir = os.path.join(repo_dir, "SOURCES")
+    pool_dir = os.path.join(repo_dir, "pool", "main")
+
+    repo_name = repo_name or packages[0]['product']
+    files = package_download(packages, channel_dir, source_dir, existing_dir=pool_dir if mirror else None, jobs=jobs,
+                             resolved=resolved, plan=plan)
 
     print("Generating APT repository...")
     output = ''
     try:
-        output = subprocess.check_output(["/bin/bash", apt_repo_gen_script_path,
-                                                        os.path.join(source_dir, "repositories", "apt_native", "pool", "main"),
-                                                        publish_dir], stderr=subprocess.STDOUT).decode("utf-8", errors='ignore')
+        with metrics.span("generate.sync", channel=channel_dir):
+            sync_mirror(os.path.join(source_dir, "repositories", "apt_native", "pool", "main"), pool_dir, files,
+                        ".deb", jobs)
         shutil.rmtree(source_dir)
+        with metrics.span("generate.index", channel=channel_dir):
+            output = subprocess.check_output(["/bin/bash", apt_repo_gen_script_path, repo_dir,
+                                              "--pdiff", str(pdiff)],
+                                             stderr=subprocess.STDOUT).decode("utf-8", errors='ignore')
         print("Generating APT repository...Done")
     except subprocess.CalledProcessError as e:
         print(e)
         output = e.output.decode('utf-8', errors='ignore')
-        shutil.rmtree(source_dir)
+        shutil.rmtree(source_dir, ignore_errors=True)
     except Exception as e:
         print(e)
     print(output)
 
-    print("Registering APT repository on machine...")
-    local_repo_filename = product + ".list"
-    repo_file_path = os.path.join(os.getcwd(), local_repo_filename)
-    repo_file_content = 'deb [trusted=yes] file://{path} all main'.format(path=publish_dir)
-    with open(repo_file_path, "w") as file:
-        file.write(repo_file_content)
-    os.makedirs("/etc/apt/sources.list.d", exist_ok=True)
-    shutil.copyfile(repo_file_path, "/etc/apt/sources.list.d/" + local_repo_filename)
-    os.remove(repo_file_path)
-    subprocess.check_output("apt update", shell=True)
-    print("Registering APT repository on machine...Done")
+    if not publish_generation(publish_dir, repo_dir, channel_dir, files, keep):
+        return False
+
+    with metrics.span("generate.register", channel=channel_dir):
+        print("Registering APT repository on machine...")
+        local_repo_filename = repo_name + ".list"
+        repo_file_path = os.path.join(os.getcwd(), local_repo_filename)
+        repo_file_content = 'deb [trusted=yes] file://{path} all main'.format(path=publish_dir)
+        with open(repo_file_path, "w") as file:
+            file.write(repo_file_content)
+        os.makedirs("/etc/apt/sources.list.d", exist_ok=True)
+        shutil.copyfile(repo_file_path, "/etc/apt/sources.list.d/" + local_repo_filename)
+        os.remove(repo_file_path)
+        subprocess.check_output("apt update", shell=True)
+        print("Registering APT repository on machine...Done")
     return True
 
 
+def webimage(packages, publish_dir, mirror=False, repo_name=None, jobs=1, resolved=None, keep=1, plan=None):
+    channel_dir = "webimage"
+    repo_dir = publish.create_staging_dir(publish_dir, seed=mirror, jobs=jobs)
+    source_dir = os.path.join(repo_dir, "SOURCES")
+    webimage_dir = os.path.join(repo_dir, "webimage")
+
+    files = package_download(packages, channel_dir, source_dir, existing_dir=webimage_dir if mirror else None,
+                             jobs=jobs, resolved=resolved, plan=plan)
+    with metrics.span("generate.sync", channel=channel_dir):
+        sync_mirror(os.path.join(source_dir, "webimage"), webimage_dir, files, "", jobs)
+    shutil.rmtree(source_dir, ignore_errors=True)
+    log("Downloading webimages...Done")
+    return publish_generation(publish_dir, repo_dir, channel_dir, files, keep)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--product_id", type=str, required=True)
-    parser.add_argument("--release_id", type=str, required=True)
-    parser.add_argument("--package_guid", type=str, required=True)
-    parser.add_argument("--distribution", required=True, choices=("apt","yum"))
-    parser.add_argument("--publish_dir", type=str, required=True)
+    parser.add_argument("--product_id", type=str)
+    parser.add_argument("--release_id", type=str)
+    parser.add_argument("--package_guid", type=str)
+    parser.add_argument("--manifest", type=str,
+                        help="json/yaml list of packages (`product`, `release`, `guid`) to build one combined "
+                             "repository for, instead of `--product_id`, `--release_id` and `--package_guid`")
+    parser.add_argument("--repo_name", type=str,
+                        help="Name to register the repository with. Defaults to the product, or to the manifest "
+                             "file name when building a combined repository")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="Number of parallel downloads")
+    parser.add_argument("--distribution", required=True,
+                        help="Comma separated distribution channels (apt, yum, webimage). When several channels are "
+                             "provided, their repositories are generated concurrently in sub folders of the publish dir")
+    parser.add_argument("--publish_dir", type=str,
+                        help="Folder where to publish the repositories. Required unless --fetch_only is provided")
+    parser.add_argument("--mirror", action="store_true",
+                        help="Keep the repository in the publish dir between runs and only download the new packages, "
+                             "remove the dropped ones and update the repository metadata")
+    parser.add_argument("--apt_pdiff", type=int, default=0,
+                        help="Number of pdiff patches to keep in APT repositories so that clients download the changes "
+                             "of the Packages indexes only, 0 to disable")
+    parser.add_argument("--keep_generations", type=int, default=1,
+                        help="Number of previous generations of the repository to keep next to the publish dir. The "
+                             "publish dir is a link to the current generation which is switched once a new generation "
+                             "is generated and verified")
+    parser.add_argument("--metrics_file", type=str,
+                        help="File where to write the timings of the phases of the run (resolution, download, "
+                             "indexing, publishing, registration) with the bytes and requests of the pdt runs. Written "
+                             "as a Prometheus textfile if it has the `.prom` extension, as json lines otherwise")
+    parser.add_argument("--profile", type=str, nargs="?", const="",
+                        help="Profile the run with cProfile, printing the slowest functions and dumping the stats to "
+                             "the file if specified")
+    parser.add_argument("--plan", type=str,
+                        help="Do not download anything but resolve the packages and their dependency packages and "
+                             "write to this file the json plan of the download of each channel: the files with their "
+                             "size and checksums, the ones skipped since they already exist in the mirror or are "
+                             "provided by several packages, and the estimated duration")
+    parser.add_argument("--from_plan", type=str,
+                        help="Generate the repositories from a plan written by `--plan` without resolving and listing "
+                             "the packages again")
+    parser.add_argument("--fetch_dir", type=str,
+                        help="Folder, possibly shared by several hosts, where the files of the plan are downloaded "
+                             "before being indexed. Each file is downloaded once by one of the runs and workers sharing "
+                             "the folder, and an interrupted download is resumed. Requires --from_plan")
+    parser.add_argument("--fetch_only", action="store_true",
+                        help="Run as a worker only downloading the files of the plan in the fetch dir, the repositories "
+                             "being generated by the run started without this option")
+    parser.add_argument("--max_requests_per_second", type=float,
+                        help="Maximum number of requests per second sent to Artifactory by all the downloads of the run")
+    parser.add_argument("--max_bytes_per_second", type=float,
+                        help="Maximum number of bytes per second downloaded from Artifactory by all the downloads of "
+                             "the run")
+    parser.add_argument("--pdt_server", action="store_true",
+                        help="Run a pdt server for the run so that the pdt runs share a single Artifactory session and "
+                             "search cache, and identical concurrent downloads are done once")
+    parser.add_argument("--shards", type=int, default=default_shards,
+                        help="Number of shards the files of the plan are split in by the hash of their path when "
+                             "downloaded in the fetch dir")
 
     arguments = parser.parse_args()
 
-    distribution: str = arguments.distribution
+    distributions = [i.strip() for i in arguments.distribution.split(",") if i.strip()]
+    if not distributions or any(i not in ("apt", "yum", "webimage") for i in distributions):
+        parser.error(f"Invalid distribution `{arguments.distribution}`. Choose from apt, yum and webimage")
+    if arguments.fetch_dir and not arguments.from_plan:
+        parser.error("--fetch_dir requires --from_plan")
+    if arguments.fetch_only and not arguments.fetch_dir:
+        parser.error("--fetch_only requires --fetch_dir")
+    if not arguments.publish_dir and not arguments.fetch_only:
+        parser.error("--publish_dir is required unless --fetch_only is provided")
     publish_dir: str = arguments.publish_dir
-
-    package = dict()
-    package['product'] = arguments.product_id
-    package['release'] = arguments.release_id
-    package['guid'] = arguments.package_guid
+    repo_name: str = arguments.repo_name
+
+    download_plan = None
+    if arguments.from_plan:
+        if arguments.plan or arguments.manifest or arguments.product_id or arguments.release_id \
+                or arguments.package_guid:
+            parser.error("--from_plan cannot be combined with --plan, --manifest, --product_id, --release_id and "
+                         "--package_guid")
+        download_plan = read_meta_data(arguments.from_plan)
+        package = [i for i in download_plan["packages"] if not i["dependency"]]
+        if arguments.fetch_dir:
+            for channel_plan in download_plan["channels"].values():
+                channel_plan["fetch dir"] = os.path.abspath(arguments.fetch_dir)
+                channel_plan["shards"] = arguments.shards
+    else:
+        package, repo_name = get_requested_packages(arguments, parser)
 
 
     check_prerequisites()
 
-    create_local_repo(package, distribution, publish_dir)
-    exit(0)
+    governor_file = None
+    if arguments.max_requests_per_second or arguments.max_bytes_per_second:
+        # Read by the pdt runs which share their limits through the governor file
+        fd, governor_file = tempfile.mkstemp(prefix="pdt_governor_", suffix=".json")
+        os.close(fd)
+        os.environ["PDT_GOVERNOR_FILE"] = governor_file
+        if arguments.max_requests_per_second:
+            os.environ["PDT_MAX_REQUESTS_PER_SECOND"] = str(arguments.max_requests_per_second)
+        if arguments.max_bytes_per_second:
+            os.environ["PDT_MAX_BYTES_PER_SECOND"] = str(arguments.max_bytes_per_second)
+
+    children_metrics_file = None
+    if arguments.metrics_file:
+        # The pdt runs append their metrics to a file which is merged into the metrics of the run
+        fd, children_metrics_file = tempfile.mkstemp(prefix="pdt_metrics_", suffix=".jsonl")
+        os.close(fd)
+        os.environ["PDT_METRICS_FILE"] = children_metrics_file
+
+    # A repository which is not published, e.g. since it is incomplete, fails the run
+    ok = True
+    try:
+        with profile(arguments.profile) if arguments.profile is not None else contextlib.nullcontext(), \
+                pdt_server() if arguments.pdt_server else contextlib.nullcontext():
+            if arguments.plan:
+                download_plan = create_download_plan(package, distributions, publish_dir, arguments.mirror,
+                                                     arguments.jobs)
+                with open(arguments.plan, "w") as file:
+                    json.dump(download_plan, file, indent=4)
+                log(f"Download plan written to {arguments.plan}: {format_plan(download_plan)}")
+            elif arguments.fetch_only:
+                fetch_plan(download_plan, distributions, arguments.jobs)
+            else:
+                ok = create_local_repos(package, distributions, publish_dir, arguments.mirror, repo_name,
+                                        arguments.jobs, arguments.keep_generations, download_plan, arguments.apt_pdiff)
+    finally:
+        if arguments.metrics_file:
+            metrics.load(children_metrics_file)
+            os.remove(children_metrics_file)
+            metrics.export(arguments.metrics_file)
+        if governor_file:
+            os.remove(governor_file)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,153 @@
+"""
+End-to-end throughput benchmarks of the Artifactory transfers against a local mock Artifactory.
+
+Run from the `pdt_tool` folder with `python -m pytest benchmarks/artifactory_benchmark.py`. pytest-benchmark reports
+the timings while the throughput section reports the files/s, MB/s and requests of a round. Compare runs with
+`--benchmark-autosave` and `--benchmark-compare`.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.conftest import *
+from tools import cdt, pdt
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+channel_size = file_count * file_size
+
+
+@pytest.fixture
+def download_dir(tmp_path):
+    """
+    Gets a function emptying the download dir, used as the setup of every round
+    """
+    path = str(tmp_path / "download")
+
+    def setup():
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    setup()
+    return path, setup
+
+
+def test_search_latest(throughput, api):
+    throughput(lambda: pdt.do_search(api, product, release, "linux"))
+
+
+def test_search_guid(throughput, api):
+    throughput(lambda: pdt.do_search(api, product, release, "linux", guid=package_guids[0]))
+
+
+def test_list_files(throughput, api):
+    path = get_package_path(0)
+    files = throughput(lambda: api.list_files(path, deep=True))
+    assert len(files) == file_count * len(channel_dirs)
+
+
+def test_download_file(throughput, api, network, download_dir):
+    path = f"{get_package_path(0)}/{channel_dirs['yum'][0]}"
+    files = api.list_files(path)
+    directory, setup = download_dir
+
+    def download():
+        for file in files:
+            api.download_file(file["path"], directory)
+
+    throughput(download, file_count, channel_size, setup=setup)
+    assert len(os.listdir(directory)) == file_count
+
+
+def test_download_file_with_failures(throughput, api, mock_artifactory, download_dir):
+    path = f"{get_package_path(0)}/{channel_dirs['yum'][0]}"
+    files = api.list_files(path)
+    directory, setup = download_dir
+
+    def download():
+        for file in files:
+            api.download_file(file["path"], directory)
+
+    mock_artifactory.failure_rate = 0.05
+    try:
+        throughput(download, file_count, channel_size, setup=setup)
+    finally:
+        mock_artifactory.failure_rate = 0.0
+    assert len(os.listdir(directory)) == file_count
+
+
+def test_download_folder_archive(throughput, api, network, download_dir):
+    path = f"{get_package_path(0)}/{channel_dirs['yum'][0]}"
+    directory, setup = download_dir
+    throughput(lambda: api.download_folder(path, directory), file_count, channel_size, setup=setup)
+    assert len(os.listdir(directory)) == file_count
+
+
+def test_download_folder_file_by_file(throughput, api, mock_artifactory, download_dir):
+    path = f"{get_package_path(0)}/{channel_dirs['yum'][0]}"
+    directory, setup = download_dir
+    mock_artifactory.max_archive_size = 0
+    try:
+        throughput(lambda: api.download_folder(path, directory), file_count, channel_size, setup=setup)
+    finally:
+        mock_artifactory.max_archive_size = None
+    assert len(os.listdir(directory)) == file_count
+
+
+def test_pdt_download_shallow(throughput, api, network, download_dir):
+    directory, setup = download_dir
+    throughput(lambda: pdt.do_download(api, product, release, guid=package_guids[0], package_os="linux",
+                                       download_dir=directory, shallow=True, part=channel_dirs["apt"][0]),
+               file_count, channel_size, setup=setup)
+    assert len(os.listdir(os.path.join(directory, channel_dirs["apt"][0]))) == file_count
+
+
+def test_pdt_fetch(throughput, api, network, download_dir):
+    path = f"{get_package_path(0)}/{channel_dirs['webimage'][0]}"
+    files = pdt.get_files_list(api.list_files(path), path)
+    directory, setup = download_dir
+    throughput(lambda: pdt.do_fetch(api, files, directory), file_count, channel_size, setup=setup)
+    assert len(os.listdir(directory)) == file_count
+
+
+def test_upload_folder(throughput, api, mock_artifactory, tmp_path):
+    source_dir = tmp_path / "upload"
+    source_dir.mkdir()
+    for i in range(file_count):
+        (source_dir / f"file-{i}.bin").write_bytes(os.urandom(file_size))
+    throughput(lambda: api.upload(str(source_dir), "benchmarks/upload", properties={"benchmark": "upload"}),
+               file_count, channel_size)
+    assert len(mock_artifactory.list_paths("benchmarks/upload")) == file_count
+
+
+def test_cdt_drop(throughput, api, mock_artifactory, tmp_path, monkeypatch):
+    component_dir = tmp_path / "l_component"
+    component_dir.mkdir()
+    for i in range(file_count):
+        (component_dir / f"file-{i}.bin").write_bytes(os.urandom(file_size))
+    monkeypatch.setattr(cdt, "execution_dir", str(tmp_path))
+    throughput(lambda: cdt.do_drop(api, product, release, "l_component", str(component_dir),
+                                   reports_dir=str(tmp_path / "reports"), timestamp="20230101000000"),
+               file_count, channel_size)
+    assert mock_artifactory.exists(f"products/{product}/{release}/drops/l_component/20230101000000/fileset")
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_package_download(throughput, mock_artifactory, download_dir, monkeypatch, jobs):
+    monkeypatch.syspath_prepend(repository_dir)
+    monkeypatch.chdir(repository_dir)
+    monkeypatch.setenv("ARTIFACTORY_URL", mock_artifactory.url)
+    monkeypatch.setenv("ARTIFACTORY_USER", "username")
+    monkeypatch.setenv("ARTIFACTORY_PASS", "password")
+    generate_repository = pytest.importorskip("generate_repository")
+
+    packages = [{"product": product, "release": release, "guid": i} for i in package_guids]
+    directory, setup = download_dir
+    files = throughput(lambda: generate_repository.package_download(packages, "yum", directory, jobs=jobs),
+                       file_count, channel_size, setup=setup, rounds=1)
+    # The files shared by the packages are downloaded once
+    assert len(files) == file_count
+    assert len(os.listdir(os.path.join(directory, generate_repository.channel_repo_path["yum"]))) == file_count
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from benchmarks.mock_artifactory import MockArtifactory
+from helpers.artifactory import ArtifactoryHelper
+
+product = "product"
+release = "2023.1"
+package_base = f"products/{product}/{release}/packages"
+package_guids = ["00000000-0000-0000-0000-000000000001", "00000000-0000-0000-0000-000000000002"]
+# Files of each channel of each package
+file_count = 40
+file_size = 256 * 1024
+channel_dirs = {
+    "yum": ("repositories/yum_native", ".rpm"),
+    "apt": ("repositories/apt_native/pool/main", ".deb"),
+    "webimage": ("webimage", ".sh"),
+}
+
+# Throughput of the benchmarks run, printed at the end of the session
+results = list()
+
+
+def get_package_path(index):
+    return f"{package_base}/l_{product}_p_{release}.{index}_offline"
+
+
+def populate(server: MockArtifactory):
+    """
+    Adds packages of `file_count` files of `file_size` bytes in each channel. The packages share the same files so that
+    they can be deduplicated.
+    """
+    files = {
+        channel: [(f"{directory}/{product}-{i}{extension}", os.urandom(file_size)) for i in range(file_count)]
+        for channel, (directory, extension) in channel_dirs.items()
+    }
+    for index, guid in enumerate(package_guids):
+        path = get_package_path(index)
+        server.add_folder(path, {"auto.guid": guid, "auto.package_id": f"{product}.{release}.{index}"})
+        for channel_files in files.values():
+            for name, data in channel_files:
+                server.add_file(f"{path}/{name}", data)
+
+
+@pytest.fixture(scope="session")
+def mock_artifactory():
+    with MockArtifactory() as server:
+        populate(server)
+        yield server
+
+
+@pytest.fixture(params=[(0.0, None), (0.01, 100 * 1024 * 1024)], ids=["lan", "wan"])
+def network(request, mock_artifactory):
+    """
+    Runs the benchmark without latency nor bandwidth limit and with a 10ms latency and a 100MB/s bandwidth
+    """
+    mock_artifactory.latency, mock_artifactory.bandwidth = request.param
+    yield request.param
+    mock_artifactory.latency, mock_artifactory.bandwidth = 0.0, None
+
+
+@pytest.fixture
+def api(mock_artifactory):
+    helper = ArtifactoryHelper("username", "password", artifactory_url=mock_artifactory.url)
+    helper.retry_sleep = 0
+    return helper
+
+
+@pytest.fixture
+def throughput(request, benchmark, mock_artifactory):
+    """
+    Benchmarks a function transferring `files` files of `size` bytes in total and reports the files/s, MB/s and number
+    of requests of a round
+    """
+
+    def run(func, files=0, size=0, setup=None, rounds=3):
+        mock_artifactory.reset_stats()
+        result = benchmark.pedantic(func, setup=setup, rounds=rounds, iterations=1)
+        if not benchmark.stats:
+            # Run once without timings with `--benchmark-disable`
+            return result
+        stats = mock_artifactory.stats()
+        seconds = benchmark.stats.stats.mean
+        info = {
+            "files/s": round(files / seconds, 1),
+            "MB/s": round(size / seconds / 1024 / 1024, 1),
+            "requests": round(stats["requests"] / rounds, 1),
+            "requests by endpoint": {k: round(v / rounds, 1) for k, v in stats["requests by endpoint"].items()},
+        }
+        benchmark.extra_info.update(info)
+        results.append((request.node.name, seconds, info))
+        return result
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not results:
+        return
+    terminalreporter.section("throughput")
+    terminalreporter.write_line(f"{'benchmark':<50}{'mean s':>10}{'files/s':>10}{'MB/s':>10}{'requests':>10}")
+    for name, seconds, info in results:
+        terminalreporter.write_line(f"{name:<50}{seconds:>10.3f}{info['files/s']:>10.1f}{info['MB/s']:>10.1f}"
+                                    f"{info['requests']:>10.1f}")
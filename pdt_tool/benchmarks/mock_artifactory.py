@@ -0,0 +1,720 @@
+"""
+Local stand-in for the Artifactory REST API used by `ArtifactoryHelper`, so that its throughput can be measured and
+its behavior checked without a network.
+
+It implements, on an in-memory repository:
+- the storage API: item info, `?properties` and `?list&deep=...&listFolders=...`
+- the metadata API setting properties (`PATCH api/metadata`)
+- AQL `items.find` with `$and`/`$or`, `$eq`/`$ne`/`$match`/`$nmatch`/`$gt`/`$gte`/`$lt`/`$lte`, `.include`, `.sort`
+  and `.limit`
+- folder archive download (`api/archive/download`), failing as Artifactory does above `max_archive_size`
+- file download, deploy (with matrix properties and `X-Explode-Archive`), folder creation and deletion
+
+The latency is added before every response, the bandwidth caps every single transfer (both ways) and the failures
+answer a request with an error instead of serving it, either at random or for the next requests.
+
+    with MockArtifactory(latency=0.01) as server:
+        server.add_file("products/product/file.txt", b"content", properties={"key": "value"})
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+"""
+import collections
+import fnmatch
+import hashlib
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+import urllib.parse
+import zipfile
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_repository = "satgoneapi-or-local"
+# Size of the blocks responses and uploads are transferred with, which is also the granularity of the bandwidth cap
+transfer_block_size = 64 * 1024
+
+
+class MockItem:
+    """
+    A file (with `data`) or a folder (without) of the mock repository
+    """
+
+    def __init__(self, data=None, properties=None):
+        self.data = data
+        self.properties = dict()
+        self.created = time.time()
+        self.checksums = dict()
+        if data is not None:
+            self.checksums = {
+                "md5": hashlib.md5(data).hexdigest(),
+                "sha1": hashlib.sha1(data).hexdigest(),
+                "sha256": hashlib.sha256(data).hexdigest(),
+            }
+        self.update_properties(properties)
+
+    @property
+    def is_folder(self):
+        return self.data is None
+
+    @property
+    def size(self):
+        return len(self.data) if self.data is not None else 0
+
+    def update_properties(self, properties):
+        for key, value in (properties or dict()).items():
+            if value is None:
+                self.properties.pop(key, None)
+            else:
+                self.properties[key] = [str(i) for i in value] if isinstance(value, (list, tuple, set)) \
+                    else [str(value)]
+
+
+class MockArtifactoryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def _match(value, pattern):
+    return fnmatch.fnmatchcase(str(value), pattern)
+
+
+class _AqlQuery:
+    """
+    Parsed `items.find(...)` AQL query
+    """
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, text):
+        text = text.strip()
+        if not text.startswith("items.find"):
+            raise MockArtifactoryError(400, f"Only `items.find` queries are supported: `{text}`")
+        position = len("items.find")
+        self.criteria, position = self._parse_arguments(text, position)
+        self.criteria = self.criteria[0] if self.criteria else dict()
+        self.include = None
+        self.sort = None
+        self.limit = None
+        while position < len(text):
+            method = re.compile(r"\s*\.(\w+)").match(text, position)
+            if not method:
+                raise MockArtifactoryError(400, f"Invalid AQL query at {position}: `{text}`")
+            arguments, position = self._parse_arguments(text, method.end())
+            if method.group(1) == "include":
+                self.include = arguments
+            elif method.group(1) == "sort":
+                self.sort = arguments[0]
+            elif method.group(1) == "limit":
+                self.limit = arguments[0]
+            else:
+                raise MockArtifactoryError(400, f"Unsupported AQL method `{method.group(1)}`")
+        if self.sort and self.include and "property" in self.include:
+            # Artifactory does not sort results including properties
+            raise MockArtifactoryError(400, "Sorting is not supported when including properties")
+
+    @classmethod
+    def _parse_arguments(cls, text, position):
+        """
+        Parses the comma separated json values between parentheses starting at the position
+        :return the values and the position after the closing parenthesis
+        """
+        arguments = []
+        position = cls._skip_spaces(text, position)
+        if text[position:position + 1] != "(":
+            raise MockArtifactoryError(400, f"Expected `(` at {position}: `{text}`")
+        position = cls._skip_spaces(text, position + 1)
+        while text[position:position + 1] != ")":
+            value, position = cls._decoder.raw_decode(text, position)
+            arguments.append(value)
+            position = cls._skip_spaces(text, position)
+            if text[position:position + 1] == ",":
+                position = cls._skip_spaces(text, position + 1)
+        return arguments, position + 1
+
+    @staticmethod
+    def _skip_spaces(text, position):
+        while position < len(text) and text[position].isspace():
+            position += 1
+        return position
+
+    @classmethod
+    def _evaluate_value(cls, value, condition):
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                result = value is not None and str(value) == str(operand)
+            elif operator == "$ne":
+                result = value is None or str(value) != str(operand)
+            elif operator == "$match":
+                result = value is not None and _match(value, operand)
+            elif operator == "$nmatch":
+                result = value is None or not _match(value, operand)
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if isinstance(operand, (int, float)):
+                    value = float(value)
+                result = {"$gt": value > operand, "$gte": value >= operand, "$lt": value < operand,
+                          "$lte": value <= operand}[operator]
+            else:
+                raise MockArtifactoryError(400, f"Unsupported AQL operator `{operator}`")
+            if not result:
+                return False
+        return True
+
+    @classmethod
+    def _evaluate_property(cls, values, condition):
+        if isinstance(condition, dict) and ("$ne" in condition or "$nmatch" in condition):
+            # Negative conditions must hold for all the values
+            return all(cls._evaluate_value(i, condition) for i in values or [None])
+        return any(cls._evaluate_value(i, condition) for i in values)
+
+    @classmethod
+    def evaluate(cls, fields, properties, criteria):
+        for key, condition in criteria.items():
+            if key == "$and":
+                if not all(cls.evaluate(fields, properties, i) for i in condition):
+                    return False
+            elif key == "$or":
+                if not any(cls.evaluate(fields, properties, i) for i in condition):
+                    return False
+            elif key.startswith("@"):
+                if not cls._evaluate_property(properties.get(key[1:], []), condition):
+                    return False
+            elif not cls._evaluate_value(fields.get(key), condition):
+                return False
+        return True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which Nagle's algorithm would delay until the client ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.mock.handle(self)
+
+    def do_HEAD(self):
+        self.server.mock.handle(self)
+
+    def do_PUT(self):
+        self.server.mock.handle(self)
+
+    def do_POST(self):
+        self.server.mock.handle(self)
+
+    def do_PATCH(self):
+        self.server.mock.handle(self)
+
+    def do_DELETE(self):
+        self.server.mock.handle(self)
+
+
+class MockArtifactory:
+    """
+    Artifactory stand-in served on a local port
+    :param latency the seconds waited before every response
+    :param bandwidth the maximum bytes per second of every download and upload, None for no limit
+    :param failure_rate the probability for a request to fail with `failure_status`
+    :param failure_status the HTTP status of the injected failures
+    :param retry_after the `Retry-After` header of the injected failures, None for no header
+    :param max_archive_size the maximum size in bytes of the folders downloaded as archive
+    :param credentials the (username, password) requests must be authenticated with, None to accept any
+    :param seed the seed of the random failures
+    """
+
+    def __init__(self, repository=default_repository, latency=0.0, bandwidth=None, failure_rate=0.0,
+                 failure_status=503, max_archive_size=None, credentials=None, seed=0, retry_after=None):
+        self.repository = repository
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.max_archive_size = max_archive_size
+        self.credentials = credentials
+
+        self._lock = threading.RLock()
+        self._items = {repository: MockItem()}
+        self._random = random.Random(seed)
+        self._failures = 0
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/artifactory"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        # A short poll interval so that stopping the server does not wait
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name="mock-artifactory",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    ######################################################################################################
+    # Repository content
+    ######################################################################################################
+
+    def _key(self, path, repository=None):
+        path = path.replace("\\", "/").strip("/")
+        return f"{repository or self.repository}/{path}".rstrip("/")
+
+    def _put_item(self, key, item):
+        with self._lock:
+            parent = key.rsplit("/", 1)[0]
+            while "/" in parent and parent not in self._items:
+                self._items[parent] = MockItem()
+                parent = parent.rsplit("/", 1)[0]
+            if parent not in self._items:
+                self._items[parent] = MockItem()
+            self._items[key] = item
+
+    def _get_descendants(self, key):
+        prefix = key + "/"
+        return sorted(i for i in self._items if i.startswith(prefix))
+
+    def add_file(self, path, data: bytes, properties: dict = None, repository=None):
+        """
+        Adds a file, creating its parent folders
+        """
+        self._put_item(self._key(path, repository), MockItem(data, properties))
+
+    def add_folder(self, path, properties: dict = None, repository=None):
+        """
+        Adds a folder, creating its parent folders. The properties of an existing folder are updated.
+        """
+        key = self._key(path, repository)
+        with self._lock:
+            if key in self._items:
+                self._items[key].update_properties(properties)
+            else:
+                self._put_item(key, MockItem(properties=properties))
+
+    def exists(self, path, repository=None):
+        return self._key(path, repository) in self._items
+
+    def read_file(self, path, repository=None) -> bytes:
+        return self._items[self._key(path, repository)].data
+
+    def get_properties(self, path, repository=None) -> dict:
+        return dict(self._items[self._key(path, repository)].properties)
+
+    def list_paths(self, path="", repository=None) -> list:
+        """
+        Lists the paths of the files under the folder, relative to the folder
+        """
+        key = self._key(path, repository)
+        with self._lock:
+            return [i[len(key) + 1:] for i in self._get_descendants(key) if not self._items[i].is_folder]
+
+    ######################################################################################################
+    # Failures and statistics
+    ######################################################################################################
+
+    def fail_next(self, count=1):
+        """
+        Makes the next `count` requests fail with `failure_status`
+        """
+        with self._lock:
+            self._failures += count
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "requests by endpoint": dict(self.requests),
+                "bytes sent": self.bytes_sent,
+                "bytes received": self.bytes_received,
+            }
+
+    def _should_fail(self):
+        with self._lock:
+            if self._failures:
+                self._failures -= 1
+                return True
+            return bool(self.failure_rate) and self._random.random() < self.failure_rate
+
+    ######################################################################################################
+    # HTTP
+    ######################################################################################################
+
+    def _throttle(self, size, start, transferred):
+        """
+        Sleeps so that `transferred + size` bytes are not transferred faster than the bandwidth since the start
+        """
+        if self.bandwidth:
+            delay = start + (transferred + size) / self.bandwidth - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _read_body(self, handler) -> bytes:
+        start = time.perf_counter()
+        body = io.BytesIO()
+        if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(handler.rfile.readline().split(b";")[0].strip(), 16)
+                if not size:
+                    handler.rfile.readline()
+                    break
+                self._throttle(size, start, body.tell())
+                body.write(handler.rfile.read(size))
+                handler.rfile.readline()
+        else:
+            remaining = int(handler.headers.get("Content-Length") or 0)
+            while remaining:
+                size = min(remaining, transfer_block_size)
+                self._throttle(size, start, body.tell())
+                block = handler.rfile.read(size)
+                if not block:
+                    break
+                body.write(block)
+                remaining -= len(block)
+        with self._lock:
+            self.bytes_received += body.tell()
+        return body.getvalue()
+
+    def _send(self, handler, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or dict()).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        if handler.command == "HEAD":
+            return
+
+        start = time.perf_counter()
+        view = memoryview(body)
+        for offset in range(0, len(body), transfer_block_size):
+            block = view[offset:offset + transfer_block_size]
+            self._throttle(len(block), start, offset)
+            handler.wfile.write(block)
+        with self._lock:
+            self.bytes_sent += len(body)
+
+    def _send_error(self, handler, status, message, headers=None):
+        self._send(handler, status, {"errors": [{"status": status, "message": message}]}, headers=headers)
+
+    def _is_authorized(self, handler):
+        if not self.credentials:
+            return True
+        expected = "Basic " + b64encode(":".join(self.credentials).encode()).decode()
+        return handler.headers.get("Authorization") == expected
+
+    def handle(self, handler):
+        url = urllib.parse.urlsplit(handler.path)
+        # Matrix parameters are appended after the quoted path
+        path, *matrix = url.path.split(";")
+        path = urllib.parse.unquote(path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        body = self._read_body(handler) if handler.command in ("PUT", "POST", "PATCH") else b""
+
+        if self.latency:
+            time.sleep(self.latency)
+        if not self._is_authorized(handler):
+            self._record("unauthorized")
+            return self._send_error(handler, 401, "Bad credentials")
+        if self._should_fail():
+            self._record("failure")
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return self._send_error(handler, self.failure_status, "Injected failure", headers)
+        if not path.startswith("/artifactory/"):
+            self._record("unknown")
+            return self._send_error(handler, 404, "Not Found")
+        path = path[len("/artifactory/"):]
+
+        try:
+            if path.startswith("api/storage/"):
+                self._handle_storage(handler, path[len("api/storage/"):], query)
+            elif path.startswith("api/metadata/") and handler.command == "PATCH":
+                self._handle_metadata(handler, path[len("api/metadata/"):], query, body)
+            elif path == "api/search/aql" and handler.command == "POST":
+                self._handle_aql(handler, body)
+            elif path.startswith("api/archive/download/") and handler.command == "GET":
+                self._handle_archive(handler, path[len("api/archive/download/"):], query)
+            elif path.startswith("api/"):
+                self._record("unknown")
+                self._send_error(handler, 404, "Not Found")
+            else:
+                self._handle_repository(handler, path, matrix, body)
+        except MockArtifactoryError as e:
+            self._send_error(handler, e.status, e.message)
+
+    def _record(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _get_item(self, path):
+        key = path.strip("/")
+        item = self._items.get(key)
+        if item is None:
+            raise MockArtifactoryError(404, "Unable to find item")
+        return key, item
+
+    ######################################################################################################
+    # Endpoints
+    ######################################################################################################
+
+    def _get_info(self, key, item):
+        repository, _, path = key.partition("/")
+        info = {
+            "repo": repository,
+            "path": f"/{path}",
+            "created": _format_time(item.created),
+            "createdBy": "mock",
+            "lastModified": _format_time(item.created),
+            "modifiedBy": "mock",
+            "lastUpdated": _format_time(item.created),
+            "uri": f"{self.url}/api/storage/{key}",
+        }
+        if item.is_folder:
+            info["children"] = [
+                {"uri": "/" + i.rsplit("/", 1)[1], "folder": self._items[i].is_folder}
+                for i in self._get_descendants(key) if "/" not in i[len(key) + 1:]
+            ]
+        else:
+            info.update({
+                "downloadUri": f"{self.url}/{key}",
+                "mimeType": "application/octet-stream",
+                "size": str(item.size),
+                "checksums": dict(item.checksums),
+                "originalChecksums": dict(item.checksums),
+            })
+        return info
+
+    def _handle_storage(self, handler, path, query):
+        if handler.command not in ("GET", "HEAD"):
+            self._record("unknown")
+            raise MockArtifactoryError(405, "Method not allowed")
+        with self._lock:
+            key, item = self._get_item(path)
+            if "properties" in query:
+                self._record("properties")
+                if not item.properties:
+                    raise MockArtifactoryError(404, "No properties could be found.")
+                response = {"properties": dict(item.properties), "uri": f"{self.url}/api/storage/{key}"}
+            elif "list" in query:
+                self._record("list")
+                deep = query.get("deep", ["0"])[0] == "1"
+                list_folders = query.get("listFolders", ["0"])[0] == "1"
+                files = []
+                for i in self._get_descendants(key):
+                    relative_path = i[len(key):]
+                    child = self._items[i]
+                    if (not deep and "/" in relative_path[1:]) or (child.is_folder and not list_folders):
+                        continue
+                    file = {"uri": relative_path, "size": child.size, "lastModified": _format_time(child.created),
+                            "folder": child.is_folder}
+                    if not child.is_folder:
+                        file.update({"sha1": child.checksums["sha1"], "sha2": child.checksums["sha256"]})
+                    files.append(file)
+                response = {"uri": f"{self.url}/api/storage/{key}", "created": _format_time(item.created),
+                            "files": files}
+            else:
+                self._record("storage")
+                response = self._get_info(key, item)
+        self._send(handler, 200, response)
+
+    def _handle_metadata(self, handler, path, query, body):
+        self._record("metadata")
+        properties = json.loads(body or b"{}").get("props", dict())
+        recursive = query.get("recursive", ["0"])[0] == "1"
+        with self._lock:
+            key, item = self._get_item(path)
+            item.update_properties(properties)
+            if recursive:
+                for i in self._get_descendants(key):
+                    self._items[i].update_properties(properties)
+        self._send(handler, 204)
+
+    def _handle_aql(self, handler, body):
+        self._record("aql")
+        query = _AqlQuery(body.decode())
+        results = []
+        with self._lock:
+            for key, item in self._items.items():
+                repository, _, path = key.partition("/")
+                if not path:
+                    continue
+                parent, _, name = path.rpartition("/")
+                fields = {
+                    "repo": repository,
+                    "path": parent or ".",
+                    "name": name,
+                    "type": "folder" if item.is_folder else "file",
+                    "size": item.size,
+                    "created": _format_time(item.created),
+                    "modified": _format_time(item.created),
+                    "sha256": item.checksums.get("sha256"),
+                    "actual_sha1": item.checksums.get("sha1"),
+                    "actual_md5": item.checksums.get("md5"),
+                }
+                if not _AqlQuery.evaluate(fields, item.properties, query.criteria):
+                    continue
+                if query.include:
+                    result = {k: v for k, v in fields.items() if k in query.include}
+                    if "property" in query.include and item.properties:
+                        result["properties"] = [{"key": k, "value": v} for k, values in item.properties.items()
+                                                for v in values]
+                else:
+                    result = {k: fields[k] for k in ("repo", "path", "name", "type", "size", "created", "modified")}
+                results.append(result)
+
+        for direction, keys in (query.sort or dict()).items():
+            results.sort(key=lambda x: [str(x.get(i, "")) for i in keys], reverse=direction == "$desc")
+        if query.limit is not None:
+            results = results[:query.limit]
+        self._send(handler, 200, {
+            "results": results,
+            "range": {"start_pos": 0, "end_pos": len(results), "total": len(results)},
+        })
+
+    def _handle_archive(self, handler, path, query):
+        self._record("archive")
+        archive_type = query.get("archiveType", ["zip"])[0]
+        with self._lock:
+            key, item = self._get_item(path)
+            if not item.is_folder:
+                raise MockArtifactoryError(400, "Only folders can be downloaded as archive")
+            files = [(i[len(key) + 1:], self._items[i]) for i in self._get_descendants(key)]
+        size = sum(i.size for _, i in files)
+        if self.max_archive_size is not None and size > self.max_archive_size:
+            raise MockArtifactoryError(400, f"Size of the folder `{key}` ({size} bytes) exceeds the max allowed "
+                                            f"folder download size ({self.max_archive_size} bytes)")
+
+        archive = io.BytesIO()
+        if archive_type == "zip":
+            with zipfile.ZipFile(archive, "w") as f:
+                for name, file in files:
+                    if not file.is_folder:
+                        f.writestr(name, file.data)
+        else:
+            with tarfile.open(fileobj=archive, mode="w:gz" if archive_type in ("tar.gz", "tgz") else "w") as f:
+                for name, file in files:
+                    info = tarfile.TarInfo(name)
+                    info.mtime = int(file.created)
+                    if file.is_folder:
+                        info.type = tarfile.DIRTYPE
+                        info.mode = 0o755
+                        f.addfile(info)
+                    else:
+                        info.size = file.size
+                        info.mode = 0o644
+                        f.addfile(info, io.BytesIO(file.data))
+        self._send(handler, 200, archive.getvalue(), "application/octet-stream")
+
+    def _explode(self, key, data):
+        """
+        Extracts a deployed archive in the folder it is deployed to
+        """
+        parent = key.rsplit("/", 1)[0]
+        self._put_item(parent, self._items.get(parent) or MockItem())
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as f:
+                for info in f.infolist():
+                    name = info.filename.strip("/")
+                    if info.is_dir():
+                        self._put_item(f"{parent}/{name}", self._items.get(f"{parent}/{name}") or MockItem())
+                    else:
+                        self._put_item(f"{parent}/{name}", MockItem(f.read(info)))
+            return
+        with tarfile.open(fileobj=io.BytesIO(data)) as f:
+            for member in f.getmembers():
+                name = member.name.lstrip("./").strip("/")
+                if not name:
+                    continue
+                if member.isdir():
+                    self._put_item(f"{parent}/{name}", self._items.get(f"{parent}/{name}") or MockItem())
+                elif member.isfile():
+                    self._put_item(f"{parent}/{name}", MockItem(f.extractfile(member).read()))
+
+    def _handle_repository(self, handler, path, matrix, body):
+        key = path.strip("/")
+        if handler.command in ("GET", "HEAD"):
+            self._record("download")
+            with self._lock:
+                key, item = self._get_item(key)
+            if item.is_folder:
+                return self._send(handler, 200, "", "text/html")
+            return self._send(handler, 200, item.data, "application/octet-stream")
+
+        if handler.command == "PUT":
+            if path.endswith("/") and not body:
+                self._record("mkdir")
+                with self._lock:
+                    self._put_item(key, self._items.get(key) or MockItem())
+                    response = self._get_info(key, self._items[key])
+                return self._send(handler, 201, response)
+
+            self._record("deploy")
+            if handler.headers.get("X-Explode-Archive", "").lower() == "true":
+                with self._lock:
+                    self._explode(key, body)
+                return self._send(handler, 200)
+            properties = dict()
+            for parameter in matrix:
+                name, _, value = parameter.partition("=")
+                if name:
+                    properties.setdefault(urllib.parse.unquote(name), []).append(urllib.parse.unquote(value))
+            item = MockItem(body, properties)
+            with self._lock:
+                self._put_item(key, item)
+                info = self._get_info(key, item)
+            return self._send(handler, 201, {i: info[i] for i in
+                                             ("repo", "path", "created", "createdBy", "downloadUri", "mimeType",
+                                              "size", "checksums", "originalChecksums", "uri")})
+
+        if handler.command == "DELETE":
+            self._record("delete")
+            with self._lock:
+                key, _ = self._get_item(key)
+                for i in self._get_descendants(key) + [key]:
+                    del self._items[i]
+            return self._send(handler, 204)
+
+        self._record("unknown")
+        raise MockArtifactoryError(405, "Method not allowed")
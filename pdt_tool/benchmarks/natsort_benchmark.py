@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of the natural sorting helpers over 100k package paths.
+
+Run from the `pdt_tool` folder with `python -m benchmarks.natsort_benchmark`.
+"""
+import random
+import re
+import timeit
+
+from helpers.natsort import latest, natural_key, sort_list_naturally, top_k
+
+path_count = 100 * 1000
+repeat = 5
+
+
+def reference_sort_list_naturally(list_to_sort, reverse=False, key=None):
+    # The implementation before the keys were precompiled and memoized
+    key = key or str
+    return sorted(list_to_sort,
+                  key=lambda x: [int(c) if c.isdigit() else c for c in re.split(r"(\d+)", key(x).replace('_', '.'))],
+                  reverse=reverse)
+
+
+def generate_paths(count):
+    rng = random.Random(0)
+    return [f"products/product_{rng.randint(1, 20)}/2023.{rng.randint(0, 2)}.{rng.randint(0, 9)}/packages/"
+            f"l_product_p_2023.{rng.randint(0, 2)}.{rng.randint(0, 9)}.{rng.randint(1, 50000)}_offline"
+            for _ in range(count)]
+
+
+def measure(name, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"{name:<40}{seconds * 1000:>10.1f} ms")
+    return seconds
+
+
+def main():
+    paths = generate_paths(path_count)
+    assert sort_list_naturally(paths) == reference_sort_list_naturally(paths)
+    assert latest(paths) == reference_sort_list_naturally(paths)[-1]
+
+    print(f"Natural sorting of {path_count} paths (best of {repeat})")
+    measure("reference sort", lambda: reference_sort_list_naturally(paths))
+    measure("sort (cold key cache)", lambda: (natural_key.cache_clear(), sort_list_naturally(paths)))
+    measure("sort (warm key cache)", lambda: sort_list_naturally(paths))
+    measure("reference sort + [-1]", lambda: reference_sort_list_naturally(paths)[-1])
+    measure("latest (cold key cache)", lambda: (natural_key.cache_clear(), latest(paths)))
+    measure("latest (warm key cache)", lambda: latest(paths))
+    measure("top_k(10) (warm key cache)", lambda: top_k(paths, 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Startup benchmark of the pdt and cdt command lines, the time until `--help` is printed and the import time of the tools.
+
+Run from the `pdt_tool` folder with `python -m benchmarks.startup_benchmark`.
+"""
+import subprocess
+import sys
+import time
+
+from tests.startup_test import get_import_times, tool_dir
+
+repeat = 10
+
+
+def measure(args):
+    """
+    :return the best wall time in seconds of running the command line
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=tool_dir, stdout=subprocess.DEVNULL, check=True)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def main():
+    baseline = measure(["-c", "pass"])
+    print(f"{'command':<40}{'wall ms':>10}{'over python ms':>16}{'import ms':>12}")
+    print(f"{'python -c pass':<40}{baseline * 1000:>10.1f}{0:>16.1f}{0:>12.1f}")
+    for args in (["pdt.py", "--help"], ["cdt.py", "--help"]):
+        seconds = measure(args)
+        imports = get_import_times(*args)[f"tools.{args[0][:-3]}"] / 1000
+        print(f"{' '.join(args):<40}{seconds * 1000:>10.1f}{(seconds - baseline) * 1000:>16.1f}{imports:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
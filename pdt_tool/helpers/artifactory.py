@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import re
@@ -11,36 +12,18 @@ import urllib3
 from artifactory import ArtifactoryPath
 from dohq_artifactory.exception import ArtifactoryException
 
+from helpers.cache import default_cache_dir
+from helpers.governor import Governor, default_bytes_per_second, default_requests_per_second, default_state_file
+from helpers.metrics import metrics
+from helpers.natsort import latest, sort_list_naturally
+from helpers.singleflight import SingleFlight, get_key
+from helpers.transport import TransportStats, create_session, default_pool_size, operation
+
 urllib3.disable_warnings()
 
 forbidden_key_chars = "(){}[]*+^$/\\~`!@%&,<>;= "
 
 
-def sort_list_naturally(list_to_sort, reverse=False, key=None):
-    """
-    Sorts a list with considering consecutive digits as a single int.
-
-    The way this function works is that it splits each string in the list into another list grouping consecutive digits
-    together and anything else together then sorting the initial list accordingly. For example, if the list to be sorted
-    contains the strings
-    [
-        "something-123/something_else.1.2.211",
-        "something-2/something_else.1.2.0",
-    ]
-    then this function will split generate the following list
-    [
-        ["something-", 123, "/something_else.", 1, ".", 2, ".", 211], # Notice that the numbers are not strings here!
-        ["something-", 2, "/something_else.", 1, ".", 2, ".", 0],
-    ]
-    then when sorting the 2 sub-lists, each item will be compared to its corresponding index in the other list where
-    numbers will be sorted correctly.
-    """
-    key = key or str
-    return sorted(list_to_sort,
-                  key=lambda x: [int(c) if c.isdigit() else c for c in re.split(r"(\d+)", key(x).replace('_', '.'))],
-                  reverse=reverse)
-
-
 def validate_properties(properties: dict):
     if not properties:
         return
@@ -49,17 +32,65 @@ def validate_properties(properties: dict):
             raise Exception(f"Invalid characters found in property key `{key}`.")
 
 
+def _is_recorded_file(record: dict) -> bool:
+    """
+    Checks that a downloaded file was not changed since its download was recorded
+    """
+    try:
+        stat = os.stat(record["path"])
+    except OSError:
+        return False
+    return stat.st_size == record["size"] and stat.st_mtime == record["mtime"]
+
+
+def _copy_downloaded_file(source: str, target: str):
+    """
+    Hard links a file downloaded by another download, or copies it when the folders are on different file systems
+    """
+    if os.path.abspath(source) == os.path.abspath(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _timed(func):
+    """
+    Records a span of the calls of a helper method with the requests issued and the bytes received during the call.
+    The requests are traced as issued by the method.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with metrics.span(f"artifactory.{func.__name__}", stats=self.transport_stats), operation(func.__name__):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
 class ArtifactoryHelper:
-    def __init__(self, username: str, password: str, artifactory_url=None, artifactory_repository=None, verbose=False):
-        self.artifactory_url = artifactory_url or "https://ubit-artifactory-or.intel.com/artifactory"
+    def __init__(self, username: str, password: str, artifactory_url=None, artifactory_repository=None, verbose=False,
+                 pool_size=None, governor: Governor = None):
+        # The environment allows to point the tools, including when run by generate_repository.py, to another instance
+        self.artifactory_url = artifactory_url or os.environ.get("ARTIFACTORY_URL") or \
+            "https://ubit-artifactory-or.intel.com/artifactory"
         self.repository = artifactory_repository or "satgoneapi-or-local"
         self.repository_url = f"{self.artifactory_url}/{self.repository}"
         self.retry_count = 10
         self.retry_sleep = 30
 
-        session = requests.Session()
-        session.auth = (username, password)
-        self.session = session
+        self.transport_stats = TransportStats()
+        # Limits the traffic to the limits set in the environment, if any, and adapts the concurrency to throttling
+        self.governor = governor or Governor(default_requests_per_second, default_bytes_per_second,
+                                             pool_size or default_pool_size, default_state_file)
+        self.session = create_session(username, password, pool_size=pool_size, stats=self.transport_stats,
+                                      governor=self.governor)
+        # Shares the transfer of a file between the concurrent downloads of the process and of the other processes
+        self.downloads = SingleFlight(os.path.join(default_cache_dir, "downloads"))
 
         # 200MB
         self.chunk_size = 200 * 1024 * 1024
@@ -67,12 +98,14 @@ class ArtifactoryHelper:
         if verbose:
             logging.basicConfig()
             logging.getLogger("artifactory").setLevel(logging.DEBUG)
+            logging.getLogger("pdt.transport").setLevel(logging.DEBUG)
 
     def _get_path(self, path):
         path = path.replace("\\", "/")
         path = re.sub("^/+", "", path)
         return ArtifactoryPath(f"{self.repository_url}/{path}", session=self.session)
 
+    @_timed
     def get_path_properties(self, path: str) -> dict:
         """
         Gets all the properties for the specified file in Artifactory
@@ -91,6 +124,7 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed to retrieve properties of `{path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="get_path_properties")
                 time.sleep(self.retry_sleep)
 
         if error:
@@ -98,6 +132,7 @@ class ArtifactoryHelper:
 
         return properties
 
+    @_timed
     def set_path_properties(self, path, properties: dict):
         if not properties:
             return
@@ -123,11 +158,13 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed to set properties for `{path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="set_path_properties")
                 time.sleep(self.retry_sleep)
 
         if error:
             raise error
 
+    @_timed
     def delete_path(self, path):
         artifactory_path = self._get_path(path)
 
@@ -141,11 +178,13 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed to delete path `{path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="delete_path")
                 time.sleep(self.retry_sleep)
 
         if error:
             raise error
 
+    @_timed
     def upload(self, path_to_upload, upload_path, properties=None, delete_target_first=True):
         if not path_to_upload:
             return
@@ -188,10 +227,12 @@ class ArtifactoryHelper:
                         explode_archive=explode,
                         explode_archive_atomic=explode,
                     )
+                    metrics.increment("artifactory.uploaded_bytes", os.path.getsize(path_to_upload))
                     break
                 except Exception as e:
                     error = e
                     print(f"Failed to upload `{original_path_to_upload}` to `{upload_path}`. Error: {e}")
+                    metrics.increment("artifactory.retries", operation="upload")
                     time.sleep(self.retry_sleep)
 
             if error:
@@ -199,26 +240,13 @@ class ArtifactoryHelper:
 
         self.set_path_properties(upload_path, properties)
 
-    def search_for_child_folder_with_properties(self, path, properties=None, naming_pattern=None,
-                                                mandatory_properties=None, quiet=False):
-        validate_properties(properties)
-        search = [
-            {"repo": self.repository},
-            {"path": {"$match": path}},
-            {"type": "folder"},
-        ]
-        if properties:
-            for k, v in properties.items():
-                search.append({f"@{k}": v})
-        aql = [
-            "items.find",
-            {
-                "$and": search
-            },
-            ".include",
-            ["path", "name", "repo", "property"],
-        ]
-
+    @_timed
+    def run_aql(self, aql: list) -> list:
+        """
+        Runs an AQL query
+        :param aql the query parts as accepted by `ArtifactoryPath.aql`
+        :return the list of results
+        """
         artifacts_list = list()
         error = None
         for retry in range(self.retry_count):
@@ -229,11 +257,16 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed to run AQL query`{aql}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="run_aql")
                 time.sleep(self.retry_sleep)
 
         if error:
             raise error
 
+        return artifacts_list
+
+    @staticmethod
+    def _filter_artifacts(artifacts_list, naming_pattern=None, mandatory_properties=None, quiet=False):
         if naming_pattern:
             regex = re.compile(naming_pattern)
             artifacts_list_filtered = list()
@@ -271,10 +304,84 @@ class ArtifactoryHelper:
                     artifacts_list_filtered.append(ar)
             artifacts_list = artifacts_list_filtered
 
+        return artifacts_list
+
+    @_timed
+    def search_for_child_folder_with_properties(self, path, properties=None, naming_pattern=None,
+                                                mandatory_properties=None, quiet=False, name_match=None,
+                                                lexically_ordered=False):
+        """
+        Searches for the latest folder under the specified path having the specified properties.
+
+        The properties, the `name_match` wildcard pattern and the presence of the mandatory properties are evaluated by
+        Artifactory. The `naming_pattern` regex and the mandatory properties values are then checked on the returned
+        folders. AQL cannot sort when properties are included in the results, so when the names of the matching folders
+        sort lexically the same way they sort naturally (e.g. fixed width timestamps), `lexically_ordered` makes
+        Artifactory return only the latest folder whose properties are then fetched separately.
+        :param path the path (AQL `$match` pattern) of the parent folder
+        :param properties the properties the folder must have
+        :param naming_pattern a regex the folder name must match
+        :param mandatory_properties the properties the folder must have with a non-empty value
+        :param quiet do not print the skipped folders
+        :param name_match an AQL wildcard pattern the folder name must match
+        :param lexically_ordered whether the matching folders names sort lexically in their natural order
+        :return the AQL result of the found folder with its properties, or None
+        """
+        validate_properties(properties)
+        search = [
+            {"repo": self.repository},
+            {"path": {"$match": path}},
+            {"type": "folder"},
+        ]
+        if name_match:
+            search.append({"name": {"$match": name_match}})
+        if properties:
+            for k, v in properties.items():
+                search.append({f"@{k}": v})
+        if mandatory_properties:
+            for mandatory_property in mandatory_properties:
+                search.append({f"@{mandatory_property}": {"$match": "*"}})
+                search.append({f"@{mandatory_property}": {"$ne": ""}})
+
+        artifacts_list = list()
+        search_all = True
+        if lexically_ordered:
+            aql = [
+                "items.find",
+                {
+                    "$and": search
+                },
+                ".include",
+                ["path", "name", "repo"],
+                ".sort",
+                {"$desc": ["path", "name"]},
+                ".limit",
+                1,
+            ]
+            latest_list = self.run_aql(aql)
+            artifacts_list = self._filter_artifacts(latest_list, naming_pattern, quiet=quiet)
+            for ar in artifacts_list:
+                ar_properties = self.get_path_properties(f"{ar['path']}/{ar['name']}")
+                ar["properties"] = [{"key": k, "value": i} for k, v in ar_properties.items() for i in v]
+            artifacts_list = self._filter_artifacts(artifacts_list, mandatory_properties=mandatory_properties,
+                                                    quiet=quiet)
+            # Fallback to retrieving all the matching folders if the latest one does not pass the client side checks
+            search_all = bool(latest_list) and not artifacts_list
+
+        if search_all:
+            aql = [
+                "items.find",
+                {
+                    "$and": search
+                },
+                ".include",
+                ["path", "name", "repo", "property"],
+            ]
+            artifacts_list = self._filter_artifacts(self.run_aql(aql), naming_pattern, mandatory_properties, quiet)
+
         if not artifacts_list:
             return None
-        artifacts_list = sort_list_naturally(artifacts_list, key=lambda x: f"{x['path']}/{x['name']}")
-        artifact = artifacts_list[-1]
+        artifact = latest(artifacts_list, key=lambda x: f"{x['path']}/{x['name']}")
 
         if "properties" in artifact:
             artifact["properties"] = {
@@ -283,15 +390,40 @@ class ArtifactoryHelper:
 
         return artifact
 
-    def download_file(self, file_path: str, download_dir=None) -> None:
+    @_timed
+    def download_file(self, file_path: str, download_dir=None, checksum: str = None) -> None:
         """
-        Downloads the specified file from Artifactory
+        Downloads the specified file from Artifactory. Concurrent downloads of the same file, by the threads of the
+        process or by other processes, transfer it once, the other downloads linking the downloaded file.
         :param file_path the full path to the file to download
         :param download_dir the folder path where to download the file
+        :param checksum the sha256 of the file if known, so that only the downloads of the same content are shared
         """
         download_dir = download_dir or os.getcwd()
         file_path = file_path.replace("\\", "/")
-
+        local_file_path = os.path.abspath(os.path.join(download_dir, file_path.split("/")[-1]))
+
+        def download(record):
+            if record and _is_recorded_file(record):
+                # Downloaded by another process while waiting for it
+                _copy_downloaded_file(record["path"], local_file_path)
+                metrics.increment("artifactory.shared_downloads")
+                return record
+            self._download_file(file_path, download_dir)
+            stat = os.stat(local_file_path)
+            return {"path": local_file_path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+        record, shared = self.downloads.run(get_key(self.repository_url, file_path, checksum), download)
+        if not shared:
+            return
+        if _is_recorded_file(record):
+            # Downloaded by another thread
+            _copy_downloaded_file(record["path"], local_file_path)
+            metrics.increment("artifactory.shared_downloads")
+        else:
+            self._download_file(file_path, download_dir)
+
+    def _download_file(self, file_path: str, download_dir: str) -> None:
         error = None
         for retry in range(self.retry_count):
             error = None
@@ -311,59 +443,62 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed while downloading file `{local_file_name}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="download_file")
                 time.sleep(self.retry_sleep)
 
         if error:
             raise error
 
+    @_timed
     def download_folder(self, folder_path: str, download_dir=None, extract=False) -> None:
         """
         Downloads the specified folder from Artifactory as a zip file
         :param folder_path the full path to the folder to download
         """
-        current_dir = os.getcwd()
         folder_path = folder_path.replace("\\", "/")
         file_base_name = folder_path.split("/")[-1]
         download_dir = download_dir if download_dir else file_base_name
         file_name = f"{file_base_name}.tar.gz"
 
+        # The paths are absolute rather than relative to the working dir so that the folders can be downloaded by
+        # concurrent threads, such as the requests of a server
         error = None
         for retry in range(self.retry_count):
             error = None
             try:
                 with tempfile.TemporaryDirectory() as tmp_dir_name:
-                    os.chdir(tmp_dir_name)
+                    archive_file = os.path.join(tmp_dir_name, file_name)
                     artifactory_path = self._get_path(folder_path)
 
                     # Attempt first to download the folder as archive
                     try:
-                        artifactory_path.archive(archive_type="tar.gz").writeto(file_name, chunk_size=self.chunk_size)
+                        artifactory_path.archive(archive_type="tar.gz").writeto(archive_file,
+                                                                                chunk_size=self.chunk_size)
 
-                        with tarfile.open(file_name) as f:
-                            f.extractall()
-                        os.remove(file_name)
+                        with tarfile.open(archive_file) as f:
+                            f.extractall(path=tmp_dir_name)
+                        os.remove(archive_file)
                     except ArtifactoryException as e:
-                        if os.path.exists(file_name):
-                            os.remove(file_name)
+                        if os.path.exists(archive_file):
+                            os.remove(archive_file)
                         if "exceeds the max allowed folder download size" not in str(e):
                             raise e
 
                         # Fallback to downloading the folder file by file
                         for child in self.get_children_of_folder(folder_path):
                             if self._get_path(child).is_dir():
-                                child_download_dir = f"{tmp_dir_name}/" + child.split("/")[-1]
+                                child_download_dir = os.path.join(tmp_dir_name, child.split("/")[-1])
                                 self.download_folder(child, child_download_dir, extract=False)
                             else:
                                 self.download_file(child, tmp_dir_name)
 
-                    download_dir_content = os.listdir()
+                    download_dir_content = os.listdir(tmp_dir_name)
                     if extract and len(download_dir_content) == 1 and download_dir_content[0].endswith(".tar.gz"):
-                        inner_tarball = download_dir_content[0]
+                        inner_tarball = os.path.join(tmp_dir_name, download_dir_content[0])
                         with tarfile.open(inner_tarball) as f:
-                            f.extractall()
+                            f.extractall(path=tmp_dir_name)
                         os.remove(inner_tarball)
 
-                    os.chdir(current_dir)
                     if download_dir:
                         os.makedirs(download_dir, exist_ok=True)
 
@@ -375,13 +510,13 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed while downloading `{folder_path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="download_folder")
                 time.sleep(self.retry_sleep)
-            finally:
-                os.chdir(current_dir)
 
         if error:
             raise error
 
+    @_timed
     def get_children_of_folder(self, path, exclude_folders=False, exclude_files=False):
         if exclude_folders and exclude_files:
             return []
@@ -398,6 +533,7 @@ class ArtifactoryHelper:
             except Exception as e:
                 error = e
                 print(f"Failed to retrieve children of `{path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="get_children_of_folder")
                 time.sleep(self.retry_sleep)
 
         if error:
@@ -417,6 +553,7 @@ class ArtifactoryHelper:
                     except Exception as e:
                         error = e
                         print(f"Failed to check if `{child}` is a dir. Error: {e}")
+                        metrics.increment("artifactory.retries", operation="get_children_of_folder")
                         time.sleep(self.retry_sleep)
 
                 if error:
@@ -426,3 +563,42 @@ class ArtifactoryHelper:
                     continue
             children.append(child.path_in_repo.lstrip("/"))
         return sort_list_naturally(children)
+
+    @_timed
+    def list_files(self, path, deep=False) -> list:
+        """
+        Lists the files under the specified folder with a single request
+        :param path the full path to the folder
+        :param deep whether to also list the files of the sub folders
+        :return a naturally sorted list of dicts with the `path`, `size`, `sha1` and `sha256` of each file
+        """
+        path = path.replace("\\", "/").strip("/")
+        url = f"{self.artifactory_url}/api/storage/{self.repository}/{path}"
+        files = list()
+
+        error = None
+        for retry in range(self.retry_count):
+            error = None
+            try:
+                response = self.session.get(url, params=f"list&deep={int(deep)}&listFolders=0")
+                response.raise_for_status()
+                files = response.json().get("files", [])
+                break
+            except Exception as e:
+                error = e
+                print(f"Failed to list files of `{path}`. Error: {e}")
+                metrics.increment("artifactory.retries", operation="list_files")
+                time.sleep(self.retry_sleep)
+
+        if error:
+            raise error
+
+        files = [
+            {
+                "path": f"{path}{i['uri']}",
+                "size": int(i.get("size", 0)),
+                "sha1": i.get("sha1"),
+                "sha256": i.get("sha2"),
+            } for i in files
+        ]
+        return sort_list_naturally(files, key=lambda x: x["path"])
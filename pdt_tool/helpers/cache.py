@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+default_cache_dir = os.environ.get("PDT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "pdt")
+# A GUID identifies an immutable drop/package, the TTL only guards against locations deleted from Artifactory
+default_cache_ttl = 7 * 24 * 60 * 60
+# Bytes read from a file at a time when computing its checksum
+checksum_chunk_size = 1024 * 1024
+
+
+class SearchCache:
+    """
+    Local cache of resolved search results stored as one json file per search under the cache dir.
+    """
+
+    def __init__(self, cache_dir=None, ttl=None):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir, "search")
+        self.ttl = ttl if ttl is not None else default_cache_ttl
+        # Number of searches served from the cache
+        self.hits = 0
+
+    @staticmethod
+    def get_key(*args) -> str:
+        return hashlib.sha256(json.dumps(args, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _get_file(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Gets a cached search result
+        :param key the key of the search as returned by `get_key`
+        :return the cached result or None if it is not cached or expired
+        """
+        cache_file = self._get_file(key)
+        try:
+            with open(cache_file) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("time", 0) > self.ttl:
+            return None
+        self.hits += 1
+        return entry.get("value")
+
+    def put(self, key, value):
+        """
+        Caches a search result. Failing to write the cache is not an error.
+        :param key the key of the search as returned by `get_key`
+        :param value the json serializable search result
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+                json.dump({"time": time.time(), "value": value}, f)
+            os.replace(f.name, self._get_file(key))
+        except OSError as e:
+            print(f"Failed to cache search result in `{self.cache_dir}`. Error: {e}")
+
+
+class ChecksumCache:
+    """
+    Local cache of the sha256 of local files stored as a single json file under the cache dir. A file is identified
+    by its inode so that the hard links of the published generations share their checksum, which is computed again once
+    the size or the modification time of the file changed.
+    """
+
+    def __init__(self, cache_dir=None, ttl=None):
+        self.cache_file = os.path.join(cache_dir or default_cache_dir, "checksums.json")
+        self.ttl = ttl if ttl is not None else default_cache_ttl
+        # Number of checksums computed
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def get_sha256(self, path) -> str:
+        stat = os.stat(path)
+        key = f"{stat.st_dev}:{stat.st_ino}"
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entry = self._entries.get(key)
+        if not entry or entry["signature"] != signature:
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(checksum_chunk_size), b""):
+                    sha256.update(chunk)
+            entry = {"signature": signature, "sha256": sha256.hexdigest()}
+            self.misses += 1
+        with self._lock:
+            self._entries[key] = dict(entry, time=time.time())
+        return entry["sha256"]
+
+    def save(self):
+        """
+        Merges the checksums with the ones saved by other processes and drops the ones unused for the TTL. Failing to
+        write the cache is not an error.
+        """
+        with self._lock:
+            if not self._entries:
+                return
+            entries = self._load()
+            entries.update(self._entries)
+        now = time.time()
+        entries = {k: v for k, v in entries.items() if now - v.get("time", 0) <= self.ttl}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.cache_file), suffix=".tmp",
+                                             delete=False) as f:
+                json.dump(entries, f)
+            os.replace(f.name, self.cache_file)
+        except OSError as e:
+            print(f"Failed to cache checksums in `{self.cache_file}`. Error: {e}")
@@ -0,0 +1,165 @@
+import collections
+import json
+import os
+import threading
+
+# The socket modules are imported when serving or sending a request so that the tools importing the default socket
+# start quickly, and on platforms without Unix sockets.
+
+# Socket of the server the tools send their requests to instead of running them, if any
+default_socket = os.environ.get("PDT_SERVER")
+
+
+class ServerError(Exception):
+    """
+    Error raised by the server while running a request
+    """
+
+
+def send_request(socket_path: str, request: dict):
+    """
+    Sends a request to a server and waits for its result
+    :param request a dict with the `action` to run and its `args`
+    :return the result of the request
+    :raise OSError if the server is not running, ServerError if the request failed
+    """
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with client.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ServerError("The server closed the connection without responding")
+    response = json.loads(line)
+    if "error" in response:
+        raise ServerError(response["error"])
+    return response["result"]
+
+
+def is_server_running(socket_path: str) -> bool:
+    try:
+        send_request(socket_path, {"action": "ping"})
+        return True
+    except (OSError, ValueError, ServerError):
+        return False
+
+
+def _create_server(socket_path: str, daemon):
+    """
+    Creates a server handling each connection in its own thread
+    """
+    import socketserver
+
+    if not hasattr(socketserver, "UnixStreamServer"):
+        raise Exception("The server mode is not supported on this platform")
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                response = {"result": daemon.process(json.loads(line))}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return UnixServer(socket_path, RequestHandler)
+
+
+class Daemon:
+    """
+    Serves the requests of the clients connecting to a Unix socket, each of them in its own thread. Each request is a
+    json line with the `action` to run and its `args`, answered by a json line with its `result` or its `error`.
+
+    Identical requests received while one of them is running share its result so that concurrent clients asking for
+    the same package trigger a single transfer.
+    """
+
+    def __init__(self, socket_path: str, handler, get_stats=None):
+        """
+        :param handler the function running a request and returning its json serializable result
+        :param get_stats the function returning the stats of the handler added to the ones of the server
+        """
+        self.socket_path = socket_path
+        self.handler = handler
+        self.get_stats = get_stats
+        self.requests = collections.Counter()
+        self.shared_requests = 0
+        self._lock = threading.Lock()
+        self._in_flight = dict()
+        self._server = None
+
+    def process(self, request: dict):
+        from concurrent.futures import Future
+
+        action = request.get("action")
+        if action == "ping":
+            return {"pid": os.getpid()}
+        if action == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return {}
+        if action == "stats":
+            with self._lock:
+                return {"requests": dict(self.requests), "shared requests": self.shared_requests,
+                        "in flight": len(self._in_flight), **(self.get_stats() if self.get_stats else dict())}
+
+        key = json.dumps(request, sort_keys=True)
+        with self._lock:
+            self.requests[action] += 1
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.shared_requests += 1
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(self.handler(request))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def serve_forever(self):
+        """
+        Serves the requests until `shutdown` is called, a `shutdown` request is received or the process is terminated
+        """
+        import signal
+
+        if os.path.exists(self.socket_path):
+            if is_server_running(self.socket_path):
+                raise Exception(f"A server is already listening on `{self.socket_path}`")
+            # Left by a server which was killed
+            os.remove(self.socket_path)
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir:
+            os.makedirs(socket_dir, exist_ok=True)
+
+        # Only the user running the server can connect to it since it uses its credentials
+        umask = os.umask(0o177)
+        try:
+            self._server = _create_server(self.socket_path, self)
+        finally:
+            os.umask(umask)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=self.shutdown).start())
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
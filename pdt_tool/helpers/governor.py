@@ -0,0 +1,192 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from helpers.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# Limits of the Artifactory traffic of a process. The environment allows to limit the tools run by generate_repository.py
+# and to share the limits between them through a state file.
+default_requests_per_second = float(os.environ.get("PDT_MAX_REQUESTS_PER_SECOND") or 0) or None
+default_bytes_per_second = float(os.environ.get("PDT_MAX_BYTES_PER_SECOND") or 0) or None
+default_state_file = os.environ.get("PDT_GOVERNOR_FILE")
+# Maximum number of concurrent requests, each of them using its own pooled connection
+default_max_concurrency = 16
+# Statuses with which Artifactory, or its load balancer, throttles the clients
+throttling_statuses = (429, 503)
+# Maximum time the requests are paused for when throttled
+max_pause = 60
+
+
+class Governor:
+    """
+    Limits the requests and bytes per second sent to Artifactory with token buckets, and the number of concurrent
+    requests with an adaptive limit halved when Artifactory throttles the requests and increased as they succeed.
+
+    The buckets and the pause requested by a throttling response are kept in memory, or in a state file locked by the
+    processes sharing it so that their traffic is limited as a whole.
+    """
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None, max_concurrency=default_max_concurrency,
+                 state_file=None):
+        """
+        :param requests_per_second the maximum rate of requests, None for no limit
+        :param bytes_per_second the maximum rate of bytes sent and received, None for no limit
+        :param max_concurrency the maximum number of concurrent requests
+        :param state_file the file shared with other processes
+        """
+        if state_file and not fcntl:
+            raise Exception("Sharing the traffic limits between processes is not supported on this platform")
+        self.requests_per_second = requests_per_second
+        self.bytes_per_second = bytes_per_second
+        self.max_concurrency = max(max_concurrency, 1)
+        self.concurrency = self.max_concurrency
+        self.state_file = state_file
+        self._successes = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._state = dict()
+
+    @contextlib.contextmanager
+    def _get_state(self):
+        """
+        Yields the state of the buckets to update, locked for the threads of the process and the processes sharing it
+        """
+        with self._lock:
+            if not self.state_file:
+                yield self._state
+                return
+            with open(self.state_file, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except ValueError:
+                        state = dict()
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _take(state, name, tokens, rate, now) -> float:
+        """
+        Takes tokens from a bucket refilled at `rate` tokens per second and holding at most one second of tokens. The
+        bucket goes in debt when there are not enough tokens so that more tokens than it holds can be taken.
+        :return the seconds to wait for the debt to be paid back
+        """
+        available, last = state.get(name, (rate, now))
+        available = min(rate, available + (now - last) * rate) - tokens
+        state[name] = (available, now)
+        return -available / rate if available < 0 else 0.0
+
+    def wait(self, requests=0, size=0):
+        """
+        Waits for the tokens of `requests` requests and of `size` bytes and for the end of a pause requested by
+        Artifactory
+        """
+        if not (self.requests_per_second and requests) and not (self.bytes_per_second and size) and \
+                not self.state_file and not self._state.get("paused until"):
+            return
+        with self._get_state() as state:
+            now = time.time()
+            seconds = max(state.get("paused until", 0) - now, 0)
+            if self.requests_per_second and requests:
+                seconds = max(seconds, self._take(state, "requests", requests, self.requests_per_second, now))
+            if self.bytes_per_second and size:
+                seconds = max(seconds, self._take(state, "bytes", size, self.bytes_per_second, now))
+        if seconds > 0:
+            metrics.increment("artifactory.governor_wait_seconds", seconds)
+            time.sleep(seconds)
+
+    def get_chunk_size(self, chunk_size: int) -> int:
+        """
+        Limits the size of the chunks a response is read by so that the bytes are limited while they are received
+        """
+        if not self.bytes_per_second:
+            return chunk_size
+        return max(min(chunk_size, int(self.bytes_per_second / 10)), 1024)
+
+    def acquire(self, sent_bytes=0):
+        """
+        Waits for a free request slot and for the tokens of the request. The slot is held until `release` is called.
+        :param sent_bytes the bytes of the request body
+        """
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            self.wait(requests=1, size=sent_bytes)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def request(self, sent_bytes=0):
+        """
+        Holds a request slot while running the body of the `with` statement
+        :param sent_bytes the bytes of the request body
+        """
+        self.acquire(sent_bytes)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, status: int, retry_after: str = None):
+        """
+        Adapts the concurrency to the status of a response. The concurrency is halved when Artifactory throttles the
+        requests, and increased by one once as many requests as the concurrency succeeded.
+        :param retry_after the `Retry-After` header of the response, for which all the requests are paused
+        """
+        if status in throttling_statuses:
+            metrics.increment("artifactory.throttled", status=status)
+            with self._condition:
+                self.concurrency = max(self.concurrency // 2, 1)
+                self._successes = 0
+            pause = get_retry_after_seconds(retry_after)
+            if pause:
+                with self._get_state() as state:
+                    state["paused until"] = max(state.get("paused until", 0), time.time() + min(pause, max_pause))
+        elif status < 400 and self.concurrency < self.max_concurrency:
+            with self._condition:
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+                    self._successes = 0
+                    self._condition.notify()
+
+
+def get_retry_after_seconds(retry_after: str) -> float:
+    """
+    Parses a `Retry-After` header, either a number of seconds or an HTTP date
+    """
+    if not retry_after:
+        return 0.0
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        return max(email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,210 @@
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# File the spans and counters are written to at exit by the tools when `--metrics-file` is not specified. It allows
+# processes spawning the tools to collect their metrics in a single file.
+default_metrics_file = os.environ.get("PDT_METRICS_FILE")
+# Prefix of the Prometheus metrics names
+prometheus_prefix = "pdt"
+
+
+class Span:
+    """
+    A timed phase of a run with the bytes transferred and the requests issued during it
+    """
+
+    def __init__(self, name: str, labels: dict = None):
+        self.name = name
+        self.labels = labels or dict()
+        self.start = time.time()
+        self.duration = 0.0
+        self.bytes = 0
+        self.requests = 0
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "type": "span",
+            "name": self.name,
+            "labels": self.labels,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6),
+            "bytes": self.bytes,
+            "requests": self.requests,
+            "error": self.error,
+            "pid": os.getpid(),
+        }
+
+
+class Metrics:
+    """
+    Thread safe collection of the spans and counters of a run
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = list()
+        self.counters = dict()
+        # Records loaded from other processes
+        self.records = list()
+
+    @contextlib.contextmanager
+    def span(self, name: str, stats=None, **labels):
+        """
+        Times the enclosed block. The requests and bytes recorded by the transport stats during the block are added to
+        the span, and more bytes can be added to the yielded span.
+        :param name the name of the phase
+        :param stats the `TransportStats` of the session used by the block
+        :param labels the labels identifying the span, like a product or a channel
+        """
+        span = Span(name, {k: str(v) for k, v in labels.items()})
+        requests, transferred = stats.totals() if stats else (0, 0)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            if stats:
+                totals = stats.totals()
+                span.requests += totals[0] - requests
+                span.bytes += totals[1] - transferred
+            with self._lock:
+                self.spans.append(span)
+
+    def increment(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_records(self) -> list:
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+            records = list(self.records)
+        records += [i.to_dict() for i in spans]
+        records += [{"type": "counter", "name": name, "labels": dict(labels), "value": value, "pid": os.getpid()}
+                    for (name, labels), value in counters.items()]
+        return records
+
+    def load(self, metrics_file):
+        """
+        Adds the records written by other processes to a json lines file
+        """
+        if not os.path.isfile(metrics_file):
+            return
+        with open(metrics_file) as f:
+            records = [json.loads(i) for i in f if i.strip()]
+        with self._lock:
+            self.records += records
+
+    def write_json_lines(self, metrics_file):
+        """
+        Appends the records to a json lines file with a single write so that several processes can share the file
+        """
+        content = "".join(json.dumps(i, sort_keys=True) + "\n" for i in self.get_records())
+        directory = os.path.dirname(metrics_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, content.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def get_prometheus_text(self) -> str:
+        """
+        Aggregates the spans by name and labels, and the counters, in the Prometheus text format
+        """
+        def format_labels(labels):
+            if not labels:
+                return ""
+            values = ",".join(f'{re.sub(r"[^a-zA-Z0-9_]", "_", k)}="{json.dumps(str(v))[1:-1]}"'
+                              for k, v in sorted(labels.items()))
+            return "{" + values + "}"
+
+        def format_name(name):
+            return f"{prometheus_prefix}_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        spans = dict()
+        counters = dict()
+        for record in self.get_records():
+            if record["type"] == "span":
+                labels = format_labels(dict(record["labels"], span=record["name"]))
+                total = spans.setdefault(labels, [0, 0.0, 0, 0, 0])
+                total[0] += 1
+                total[1] += record["duration"]
+                total[2] += record["bytes"]
+                total[3] += record["requests"]
+                total[4] += 1 if record.get("error") else 0
+            else:
+                key = (format_name(record["name"]) + "_total", format_labels(record["labels"]))
+                counters[key] = counters.get(key, 0) + record["value"]
+
+        lines = []
+        for index, (name, description) in enumerate([
+            ("span_count", "Number of times a phase ran"),
+            ("span_duration_seconds", "Total duration of a phase"),
+            ("span_bytes", "Bytes transferred by a phase"),
+            ("span_requests", "Requests issued by a phase"),
+            ("span_errors", "Number of times a phase failed"),
+        ]):
+            name = f"{prometheus_prefix}_{name}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f"{name}{labels} {total[index]:g}" for labels, total in sorted(spans.items())]
+        for name in sorted({i[0] for i in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{labels} {value:g}" for (n, labels), value in sorted(counters.items()) if n == name]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, metrics_file):
+        """
+        Writes the metrics as a Prometheus textfile, atomically so that a node exporter never reads a partial file
+        """
+        directory = os.path.dirname(os.path.abspath(metrics_file))
+        os.makedirs(directory, exist_ok=True)
+        temp_file = f"{metrics_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            f.write(self.get_prometheus_text())
+        os.replace(temp_file, metrics_file)
+
+    def export(self, metrics_file):
+        """
+        Writes the metrics as a Prometheus textfile when the file has the `.prom` extension, as json lines otherwise
+        """
+        if metrics_file.endswith(".prom"):
+            self.write_prometheus(metrics_file)
+        else:
+            self.write_json_lines(metrics_file)
+
+
+# The metrics of the current process
+metrics = Metrics()
+
+
+@contextlib.contextmanager
+def profile(profile_file=None, top=30):
+    """
+    Profiles the enclosed block with cProfile, printing the slowest functions by cumulative time to stderr
+    :param profile_file where to dump the profile stats, e.g. for snakeviz or `python -m pstats`
+    :param top the number of functions printed
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if profile_file:
+            profiler.dump_stats(profile_file)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
@@ -0,0 +1,62 @@
+import functools
+import heapq
+import re
+
+_digits_regex = re.compile(r"(\d+)")
+
+
+@functools.lru_cache(maxsize=256 * 1024)
+def natural_key(value: str) -> tuple:
+    """
+    Splits a string into a tuple grouping consecutive digits together as a single int and anything else together.
+    Underscores are considered as dots so that `1_2` and `1.2` sort the same way. The keys are memoized since the same
+    paths are sorted over and over by the child listings and the searches.
+    """
+    return tuple(int(c) if c.isdigit() else c for c in _digits_regex.split(value.replace("_", ".")))
+
+
+def sort_list_naturally(list_to_sort, reverse=False, key=None):
+    """
+    Sorts a list with considering consecutive digits as a single int.
+
+    The way this function works is that it splits each string in the list into another list grouping consecutive digits
+    together and anything else together then sorting the initial list accordingly. For example, if the list to be sorted
+    contains the strings
+    [
+        "something-123/something_else.1.2.211",
+        "something-2/something_else.1.2.0",
+    ]
+    then this function will split generate the following list
+    [
+        ["something-", 123, "/something_else.", 1, ".", 2, ".", 211], # Notice that the numbers are not strings here!
+        ["something-", 2, "/something_else.", 1, ".", 2, ".", 0],
+    ]
+    then when sorting the 2 sub-lists, each item will be compared to its corresponding index in the other list where
+    numbers will be sorted correctly.
+    """
+    key = key or str
+    return sorted(list_to_sort, key=lambda x: natural_key(key(x)), reverse=reverse)
+
+
+def latest(iterable, key=None, default=None):
+    """
+    Gets the naturally greatest item in a single pass instead of sorting the whole list.
+    It returns the same item as `sort_list_naturally(iterable, key=key)[-1]`, i.e. the last one among equal items.
+    """
+    key = key or str
+    latest_item = default
+    latest_key = None
+    for item in iterable:
+        item_key = natural_key(key(item))
+        if latest_key is None or item_key >= latest_key:
+            latest_item = item
+            latest_key = item_key
+    return latest_item
+
+
+def top_k(iterable, k, key=None):
+    """
+    Gets the k naturally greatest items, greatest first, without sorting the whole list.
+    """
+    key = key or str
+    return heapq.nlargest(k, iterable, key=lambda x: natural_key(key(x)))
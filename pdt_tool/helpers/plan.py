@@ -0,0 +1,40 @@
+import os
+
+# Aggregated bandwidth, in bytes per second, and latency per request, in seconds, the duration of the downloads is
+# estimated with. The latency of the listing requests is used instead when it was measured.
+default_bandwidth = float(os.environ.get("PDT_PLAN_BANDWIDTH") or 50 * 1024 * 1024)
+default_latency = float(os.environ.get("PDT_PLAN_LATENCY") or 0.1)
+
+
+def estimate_duration(size: int, requests: int, jobs=1, bandwidth=None, latency=None) -> float:
+    """
+    Estimates the seconds needed to download `size` bytes with `requests` requests split across `jobs` parallel
+    downloads. The latencies of the parallel downloads overlap while they share the bandwidth.
+    """
+    bandwidth = bandwidth or default_bandwidth
+    latency = latency if latency is not None else default_latency
+    return requests * latency / max(jobs, 1) + size / bandwidth
+
+
+def summarize_plan(plan: dict, requests: int = None, jobs=1, bandwidth=None, latency=None) -> dict:
+    """
+    Adds the totals and the estimated duration to a download plan
+    :param plan a dict with the `files` to download and the `existing files` and `duplicate files` which are not
+    downloaded
+    :param requests the number of download requests. Defaults to one per file.
+    :return the plan
+    """
+    skipped = plan.get("existing files", []) + plan.get("duplicate files", [])
+    plan["download files"] = len(plan["files"])
+    plan["download bytes"] = sum(i["size"] for i in plan["files"])
+    plan["skipped files"] = len(skipped)
+    plan["skipped bytes"] = sum(i["size"] for i in skipped)
+    requests = requests if requests is not None else len(plan["files"])
+    plan["estimated seconds"] = round(estimate_duration(plan["download bytes"], requests, jobs, bandwidth, latency), 1)
+    return plan
+
+
+def format_plan(plan: dict) -> str:
+    return (f"{plan['download files']} files to download ({plan['download bytes'] / 1024 / 1024:.1f} MB), "
+            f"{plan['skipped files']} files skipped ({plan['skipped bytes'] / 1024 / 1024:.1f} MB saved), "
+            f"estimated duration {plan['estimated seconds']:.1f}s")
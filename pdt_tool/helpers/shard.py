@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import platform
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# Number of shards the files are split in by default. More shards than workers balance the load of the workers.
+default_shards = 64
+
+
+def get_shard(path: str, shards: int) -> int:
+    """
+    Gets the shard of a file from the hash of its path so that every worker, on any host, assigns it the same shard
+    """
+    return int(hashlib.sha256(path.encode("utf-8")).hexdigest()[:16], 16) % shards
+
+
+def get_shard_files(files: list, index: int, shards: int) -> list:
+    """
+    Gets the files of a shard
+    :param files the files as listed by `pdt list`
+    :param index the index of the shard, from 0 to `shards` - 1
+    """
+    return [i for i in files if get_shard(i["path"], shards) == index]
+
+
+class ShardQueue:
+    """
+    Work queue of the shards of a list of files shared by workers through a folder, which can be on a storage shared by
+    several hosts.
+
+    A worker claims a shard by locking its lock file and marks it as done once it is fetched. The lock of a worker
+    which crashed is released by the system so that its shard is claimed again, by another worker or when the run is
+    resumed.
+    """
+
+    def __init__(self, queue_dir: str, shards: int):
+        """
+        :param shards the number of shards. The number of shards of an existing queue takes precedence so that all its
+        workers split the files the same way.
+        """
+        if not fcntl:
+            raise Exception("Shard queues are not supported on this platform")
+        self.queue_dir = queue_dir
+        os.makedirs(queue_dir, exist_ok=True)
+        queue_file = os.path.join(queue_dir, "queue.json")
+        # The queue file is linked once written so that the workers starting at the same time never read it partially
+        temp_file = f"{queue_file}.{platform.node()}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"shards": shards}, f)
+        try:
+            os.link(temp_file, queue_file)
+        except FileExistsError:
+            with open(queue_file) as f:
+                shards = json.load(f)["shards"]
+        finally:
+            os.remove(temp_file)
+        self.shards = shards
+
+    def _get_file(self, index, extension):
+        return os.path.join(self.queue_dir, f"shard_{index}.{extension}")
+
+    def is_done(self, index: int) -> bool:
+        return os.path.exists(self._get_file(index, "done"))
+
+    def get_pending(self) -> list:
+        return [i for i in range(self.shards) if not self.is_done(i)]
+
+    def claim(self):
+        """
+        Yields the shards which are neither done nor claimed by another worker. A shard is marked as done when the
+        caller asks for the next one, and released without being marked when the caller fails.
+        """
+        for index in range(self.shards):
+            if self.is_done(index):
+                continue
+            with open(self._get_file(index, "lock"), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    # Done by another worker since it was checked
+                    if self.is_done(index):
+                        continue
+                    yield index
+                    with open(self._get_file(index, "done"), "w"):
+                        pass
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# Seconds the result of a call is shared with the calls of other processes which were waiting for it
+default_result_ttl = 60
+
+
+def get_key(*args) -> str:
+    return hashlib.sha256(json.dumps(args).encode("utf-8")).hexdigest()
+
+
+def _is_same_file(f, path) -> bool:
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+class SingleFlight:
+    """
+    Runs a function once for concurrent calls with the same key.
+
+    The threads of the process calling with a key already in flight wait for the result of the running call. Processes
+    sharing the lock dir run the calls of a key one at a time under a file lock, each call getting the result recorded
+    by the previous one if it is recent enough to be reused. The lock files of the results expired are removed.
+    """
+
+    def __init__(self, lock_dir: str = None, result_ttl=None):
+        """
+        :param lock_dir the folder of the lock files shared with other processes, None to share the calls of the
+        threads of the process only
+        """
+        self.lock_dir = lock_dir if fcntl else None
+        self.result_ttl = result_ttl if result_ttl is not None else default_result_ttl
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self._prune_time = 0
+
+    def run(self, key: str, func):
+        """
+        :param key identifies the call
+        :param func the function called with the json result recorded by another process, or None, and returning the
+        json serializable result of the call
+        :return the result and whether it was shared by another thread
+        """
+        from concurrent.futures import Future
+
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+        if not owner:
+            return future.result(), True
+
+        try:
+            future.set_result(self._run_locked(key, func))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+    def _run_locked(self, key, func):
+        if not self.lock_dir:
+            return func(None)
+        lock_file = os.path.join(self.lock_dir, f"{key}.lock")
+        while True:
+            try:
+                os.makedirs(self.lock_dir, exist_ok=True)
+                self._prune()
+                lock = open(lock_file, "a+")
+            except OSError:
+                # The calls are not shared with other processes when the lock dir is not writable
+                return func(None)
+            try:
+                # File systems such as NFS may not support the locks
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except OSError:
+                lock.close()
+                return func(None)
+            if _is_same_file(lock, lock_file):
+                break
+            # Removed by a prune while waiting for the lock
+            lock.close()
+
+        with lock:
+            try:
+                lock.seek(0)
+                try:
+                    record = json.loads(lock.read() or "null")
+                except ValueError:
+                    record = None
+                if record and time.time() - record["time"] > self.result_ttl:
+                    record = None
+                result = func(record["result"] if record else None)
+                lock.seek(0)
+                lock.truncate()
+                lock.write(json.dumps({"time": time.time(), "result": result}))
+                lock.flush()
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _prune(self):
+        """
+        Removes the lock files of the calls whose result expired, at most once per TTL
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._prune_time < self.result_ttl:
+                return
+            self._prune_time = now
+        for name in os.listdir(self.lock_dir):
+            lock_file = os.path.join(self.lock_dir, name)
+            try:
+                if not name.endswith(".lock") or now - os.path.getmtime(lock_file) <= self.result_ttl:
+                    continue
+                with open(lock_file, "a+") as lock:
+                    # Skips the calls running, and the files replaced since they were listed
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if _is_same_file(lock, lock_file) and now - os.fstat(lock.fileno()).st_mtime > self.result_ttl:
+                        os.remove(lock_file)
+            except OSError:
+                continue
+
@@ -0,0 +1,362 @@
+import contextlib
+import contextvars
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from helpers.governor import default_max_concurrency
+
+logger = logging.getLogger("pdt.transport")
+
+# Number of keep-alive connections kept open per host. Artifactory is a single host, so this is effectively the
+# number of transfers that can run at the same time without opening (and TLS handshaking) new connections.
+default_pool_size = default_max_concurrency
+
+
+def get_keepalive_socket_options():
+    """
+    Socket options enabling TCP keep-alive probes so that idle pooled connections are not silently dropped by
+    firewalls/load balancers between two Artifactory calls.
+    """
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15))
+    if hasattr(socket, "TCP_KEEPCNT"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4))
+    return options
+
+
+# Number of TCP (and TLS) connections established by the current thread
+_connects = threading.local()
+
+
+def _get_connect_count():
+    return getattr(_connects, "count", 0)
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        _connects.count = _get_connect_count() + 1
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _connects.count = _get_connect_count() + 1
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+# The operation, e.g. the `ArtifactoryHelper` method, the requests issued by the current thread are attributed to
+_operation = contextvars.ContextVar("operation", default=None)
+
+
+@contextlib.contextmanager
+def operation(name: str):
+    """
+    Attributes the requests issued in the enclosed block to an operation. Nested operations take precedence.
+    """
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def get_url_class(method: str, url: str) -> str:
+    """
+    Classifies an Artifactory URL by the REST API it calls, so that requests can be grouped regardless of the paths
+    """
+    url = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(url.path)
+    path = path.split("/artifactory/", 1)[1] if "/artifactory/" in path else path.lstrip("/")
+    query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+    if path.startswith("api/storage/"):
+        if "properties" in query:
+            return "storage properties" if method == "GET" else "storage set properties"
+        if "list" in query:
+            return "storage list"
+        return "storage"
+    if path.startswith("api/metadata/"):
+        return "metadata"
+    if path.startswith("api/search/aql"):
+        return "aql"
+    if path.startswith("api/archive/"):
+        return "archive"
+    if path.startswith("api/"):
+        return "api " + path.split("/")[1]
+    return "folder" if path.endswith("/") else "item"
+
+
+class RequestTiming:
+    """
+    Timing of a single HTTP request.
+
+    `setup_seconds` is the time from sending the request until the response headers were received. It includes the
+    TCP connect and TLS handshake when `new_connection` is set. `transfer_seconds` is the time spent reading the
+    response body. `bytes` are the bytes of the response body and `sent_bytes` the ones of the request body.
+    """
+
+    def __init__(self, method, url, sent_bytes=0):
+        self.method = method
+        self.url = url
+        self.url_class = get_url_class(method, url)
+        self.operation = _operation.get()
+        self.status = None
+        self.new_connection = False
+        self.setup_seconds = 0.0
+        self.transfer_seconds = 0.0
+        self.bytes = 0
+        self.sent_bytes = sent_bytes
+        self._body_start = None
+
+    @property
+    def seconds(self):
+        return self.setup_seconds + self.transfer_seconds
+
+    def to_dict(self):
+        return {
+            "operation": self.operation,
+            "method": self.method,
+            "url": self.url,
+            "url class": self.url_class,
+            "status": self.status,
+            "new connection": self.new_connection,
+            "setup seconds": round(self.setup_seconds, 6),
+            "transfer seconds": round(self.transfer_seconds, 6),
+            "bytes": self.bytes,
+            "sent bytes": self.sent_bytes,
+        }
+
+
+class TransportStats:
+    """
+    Thread safe collection of the timings of all the requests issued through a session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = list()
+        self._bytes = 0
+
+    def add(self, timing: RequestTiming):
+        with self._lock:
+            self.requests.append(timing)
+
+    def add_bytes(self, size):
+        with self._lock:
+            self._bytes += size
+
+    def totals(self) -> tuple:
+        """
+        Gets the number of requests and of bytes received so far without going through all the requests
+        """
+        with self._lock:
+            return len(self.requests), self._bytes
+
+    def summary(self) -> dict:
+        with self._lock:
+            requests_list = list(self.requests)
+        return {
+            "requests": len(requests_list),
+            "new connections": sum(1 for i in requests_list if i.new_connection),
+            "setup seconds": round(sum(i.setup_seconds for i in requests_list), 3),
+            "transfer seconds": round(sum(i.transfer_seconds for i in requests_list), 3),
+            "bytes": sum(i.bytes for i in requests_list),
+        }
+
+    def get_table(self) -> list:
+        """
+        Aggregates the requests by operation, method and URL class, the slowest first. Many requests of the same class
+        for a single operation call reveal N+1 patterns.
+        :return a list of dicts with the `operation`, `method`, `url class`, `requests`, `errors`, `new connections`,
+        `seconds`, `mean ms`, `max ms`, `bytes` and `sent bytes`
+        """
+        with self._lock:
+            requests_list = list(self.requests)
+        rows = dict()
+        for i in requests_list:
+            key = (i.operation or "-", i.method, i.url_class)
+            row = rows.setdefault(key, {"operation": key[0], "method": key[1], "url class": key[2], "requests": 0,
+                                        "errors": 0, "new connections": 0, "seconds": 0.0, "max ms": 0.0,
+                                        "bytes": 0, "sent bytes": 0})
+            row["requests"] += 1
+            row["errors"] += 1 if i.status is None or i.status >= 400 else 0
+            row["new connections"] += 1 if i.new_connection else 0
+            row["seconds"] += i.seconds
+            row["max ms"] = max(row["max ms"], i.seconds * 1000)
+            row["bytes"] += i.bytes
+            row["sent bytes"] += i.sent_bytes
+        for row in rows.values():
+            row["mean ms"] = round(row["seconds"] * 1000 / row["requests"], 1)
+            row["max ms"] = round(row["max ms"], 1)
+            row["seconds"] = round(row["seconds"], 3)
+        return sorted(rows.values(), key=lambda x: x["seconds"], reverse=True)
+
+    def format_table(self) -> str:
+        """
+        Formats the aggregated requests as a text table
+        """
+        columns = [("operation", 40), ("method", 7), ("url class", 24), ("requests", 9), ("errors", 7),
+                   ("new connections", 16), ("seconds", 9), ("mean ms", 9), ("max ms", 9), ("bytes", 13),
+                   ("sent bytes", 13)]
+        lines = ["".join(f"{name:<{width}}" if index < 3 else f"{name:>{width}}"
+                         for index, (name, width) in enumerate(columns))]
+        for row in self.get_table():
+            lines.append("".join(f"{str(row[name])[:width - 1]:<{width}}" if index < 3 else f"{row[name]:>{width}}"
+                                 for index, (name, width) in enumerate(columns)))
+        return "\n".join(lines)
+
+    def write_trace(self, trace_file):
+        """
+        Writes every request as a json line
+        """
+        with self._lock:
+            requests_list = list(self.requests)
+        with open(trace_file, "w") as f:
+            for i in requests_list:
+                f.write(json.dumps(i.to_dict()) + "\n")
+
+
+class _TimedRawResponse:
+    """
+    Wraps the urllib3 response so that the time spent reading the body is added to the request timing, and the bytes
+    read are limited by the governor. The request slot of the governor is released once the body is read or the
+    response closed.
+    """
+
+    def __init__(self, raw, timing: RequestTiming, stats: TransportStats, governor=None):
+        self._raw = raw
+        self._timing = timing
+        self._stats = stats
+        self._governor = governor
+        self._release = governor.release if governor else None
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        self._release_slot()
+
+    def _release_slot(self):
+        release, self._release = self._release, None
+        if release:
+            release()
+
+    def _account(self, size):
+        if self._timing._body_start is None:
+            self._timing._body_start = time.perf_counter()
+        self._timing.bytes += size
+        if size:
+            self._stats.add_bytes(size)
+            if self._governor:
+                self._governor.wait(size=size)
+        self._timing.transfer_seconds = time.perf_counter() - self._timing._body_start
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        self._timing._body_start = time.perf_counter()
+        if self._governor:
+            amt = self._governor.get_chunk_size(amt)
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._account(len(chunk))
+            yield chunk
+        self._release_slot()
+
+    def read(self, amt=None, *args, **kwargs):
+        data = self._raw.read(amt, *args, **kwargs)
+        self._account(len(data) if data else 0)
+        if amt is None or not data:
+            self._release_slot()
+        return data
+
+    def close(self):
+        self._release_slot()
+        return self._raw.close()
+
+    def release_conn(self):
+        self._release_slot()
+        return self._raw.release_conn()
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter with a sized keep-alive connection pool which records the timing of every request it sends. The
+    requests are limited by the governor if any.
+    """
+
+    def __init__(self, stats: TransportStats = None, pool_size=None, governor=None, **kwargs):
+        self.stats = stats if stats is not None else TransportStats()
+        self.governor = governor
+        pool_size = pool_size or default_pool_size
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("socket_options", get_keepalive_socket_options())
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        timing = RequestTiming(request.method, request.url, int(request.headers.get("Content-Length") or 0))
+        # The request slot is held until the body is read, released by the wrapped raw response
+        if self.governor:
+            self.governor.acquire(timing.sent_bytes)
+        connects = _get_connect_count()
+        start = time.perf_counter()
+        try:
+            response = super().send(request, *args, **kwargs)
+        except BaseException:
+            if self.governor:
+                self.governor.release()
+            raise
+        finally:
+            timing.setup_seconds = time.perf_counter() - start
+            timing.new_connection = _get_connect_count() > connects
+            self.stats.add(timing)
+
+        timing.status = response.status_code
+        if self.governor:
+            self.governor.record(response.status_code, response.headers.get("Retry-After"))
+        response.raw = _TimedRawResponse(response.raw, timing, self.stats, self.governor)
+        logger.debug(f"{timing.method} {timing.url} -> {timing.status} "
+                     f"(new connection: {timing.new_connection}, setup: {timing.setup_seconds:.3f}s)")
+        return response
+
+
+def create_session(username: str, password: str, pool_size=None, stats: TransportStats = None,
+                   governor=None) -> requests.Session:
+    """
+    Creates a session reusing keep-alive connections (and so their TLS sessions) across all the Artifactory calls
+    :param username the user to authenticate with
+    :param password the password of the user
+    :param pool_size the maximum number of pooled connections per host
+    :param stats where to record the timing of the requests issued through the session
+    :param governor the `Governor` limiting the requests issued through the session
+    :return the configured session
+    """
+    session = requests.Session()
+    session.auth = (username, password)
+    adapter = TimedHTTPAdapter(stats=stats, pool_size=pool_size, governor=governor)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -1,4 +1,5 @@
 import pytest
+import responses
 
 from helpers.artifactory import *
 
@@ -56,3 +57,72 @@ def test_sort_list_naturally_string_reverse():
     list_to_sort = ["a_2/a_100", "a_123/a_2", "a_2/a_123", ]
     files_found = sort_list_naturally(list_to_sort, True)
     assert files_found == ['a_123/a_2', 'a_2/a_123', 'a_2/a_100']
+
+
+@responses.activate
+def test_search_for_child_folder_with_properties_lexically_ordered():
+    aql_url = f"{artifactory_url}/api/search/aql"
+    drop_path = f"{component_drop_relative_path}/20230102030405"
+    responses.add(responses.POST, aql_url, json={
+        "results": [{"repo": artifactory_repository, "path": component_drop_relative_path, "name": "20230102030405"}]
+    })
+    responses.add(responses.GET, f"{artifactory_url}/api/storage/{artifactory_repository}/{drop_path}", json={
+        "properties": {"auto.guid": ["guid"], "auto.timestamp": ["20230102030405"]}
+    })
+
+    artifact = ar.search_for_child_folder_with_properties(component_drop_relative_path, {"auto.guid": "guid"},
+                                                          naming_pattern=r"^\d{14}$",
+                                                          mandatory_properties=["auto.guid", "auto.timestamp"],
+                                                          name_match="?" * 14, lexically_ordered=True)
+
+    assert artifact["name"] == "20230102030405"
+    assert artifact["properties"] == {"auto.guid": ["guid"], "auto.timestamp": ["20230102030405"]}
+    assert len(responses.calls) == 2
+    aql = responses.calls[0].request.body
+    aql = aql.decode("utf-8") if isinstance(aql, bytes) else aql
+    assert '{"name": {"$match": "??????????????"}}' in aql
+    assert '{"@auto.timestamp": {"$ne": ""}}' in aql
+    assert aql.endswith('.sort({"$desc": ["path", "name"]}).limit(1)')
+
+
+@responses.activate
+def test_search_for_child_folder_with_properties_latest():
+    aql_url = f"{artifactory_url}/api/search/aql"
+    responses.add(responses.POST, aql_url, json={
+        "results": [
+            {"repo": artifactory_repository, "path": component_drop_relative_path, "name": "l_package_10",
+             "properties": [{"key": "auto.guid", "value": "guid10"}]},
+            {"repo": artifactory_repository, "path": component_drop_relative_path, "name": "l_package_9",
+             "properties": [{"key": "auto.guid", "value": "guid9"}]},
+            {"repo": artifactory_repository, "path": component_drop_relative_path, "name": "l_package_11",
+             "properties": [{"key": "auto.guid", "value": " "}]},
+        ]
+    })
+
+    artifact = ar.search_for_child_folder_with_properties(component_drop_relative_path,
+                                                          naming_pattern="^l_.*$",
+                                                          mandatory_properties=["auto.guid"],
+                                                          name_match="l_*", quiet=True)
+
+    assert artifact["name"] == "l_package_10"
+    assert artifact["properties"] == {"auto.guid": ["guid10"]}
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_list_files():
+    responses.add(responses.GET, component_storage_url, json={
+        "uri": component_storage_url,
+        "files": [
+            {"uri": "/b_10.rpm", "size": 20, "folder": False, "sha1": "sha1_b10", "sha2": "sha2_b10"},
+            {"uri": "/b_9.rpm", "size": 10, "folder": False, "sha1": "sha1_b9", "sha2": "sha2_b9"},
+        ]
+    })
+
+    files = ar.list_files(component_drop_relative_path)
+
+    assert files == [
+        {"path": f"{component_drop_relative_path}/b_9.rpm", "size": 10, "sha1": "sha1_b9", "sha256": "sha2_b9"},
+        {"path": f"{component_drop_relative_path}/b_10.rpm", "size": 20, "sha1": "sha1_b10", "sha256": "sha2_b10"},
+    ]
+    assert "list&deep=0&listFolders=0" in responses.calls[0].request.url
@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+from helpers.cache import *
+
+
+def test_search_cache_get_missing(tmp_path):
+    cache = SearchCache(str(tmp_path))
+    assert cache.get(SearchCache.get_key("pdt", "product", "release")) is None
+
+
+def test_search_cache_put_get(tmp_path):
+    cache = SearchCache(str(tmp_path))
+    key = SearchCache.get_key("pdt", "product", "release", {"auto.guid": "guid"})
+    meta = {"path": "products/product/release/packages/l_package", "resolved properties": {"a": ["b"]}}
+    cache.put(key, meta)
+    assert cache.get(key) == meta
+    assert os.listdir(os.path.join(str(tmp_path), "search")) == [f"{key}.json"]
+
+
+def test_search_cache_expired(tmp_path):
+    cache = SearchCache(str(tmp_path), ttl=-1)
+    key = SearchCache.get_key("cdt", "product", "release", "component", {"auto.guid": "guid"})
+    cache.put(key, {"path": "path"})
+    assert cache.get(key) is None
+
+
+def test_search_cache_key_depends_on_properties():
+    key1 = SearchCache.get_key("pdt", "product", "release", {"auto.guid": "guid1"})
+    key2 = SearchCache.get_key("pdt", "product", "release", {"auto.guid": "guid2"})
+    assert key1 != key2
+
+
+def test_search_cache_is_per_artifactory_instance(tmp_path):
+    from benchmarks.mock_artifactory import MockArtifactory
+    from helpers.artifactory import ArtifactoryHelper
+    from tools import pdt
+
+    cache = SearchCache(str(tmp_path))
+    guid = "00000000-0000-0000-0000-000000000001"
+    with MockArtifactory() as server, MockArtifactory() as other_server:
+        paths = list()
+        for index, mock in enumerate((server, other_server)):
+            path = f"products/product/2023.1/packages/l_product_p_2023.1.{index}_offline"
+            mock.add_folder(path, {"auto.guid": guid, "auto.package_id": f"product.2023.1.{index}"})
+            api = ArtifactoryHelper("username", "password", artifactory_url=mock.url)
+            paths.append(pdt.do_search(api, "product", "2023.1", "linux", guid=guid, cache=cache)["path"])
+    assert paths == [f"products/product/2023.1/packages/l_product_p_2023.1.{i}_offline" for i in range(2)]
+    assert cache.hits == 0
+
+
+def test_checksum_cache(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"content")
+    link = tmp_path / "link.bin"
+    os.link(path, link)
+    sha256 = hashlib.sha256(b"content").hexdigest()
+
+    checksums = ChecksumCache(str(tmp_path / "cache"))
+    assert checksums.get_sha256(str(path)) == sha256
+    checksums.save()
+
+    # Hard links share the checksum saved, which is computed again once the file changed
+    checksums = ChecksumCache(str(tmp_path / "cache"))
+    assert checksums.get_sha256(str(link)) == sha256
+    assert checksums.misses == 0
+    path.write_bytes(b"changed")
+    assert checksums.get_sha256(str(link)) == hashlib.sha256(b"changed").hexdigest()
+    assert checksums.misses == 1
+
+
+def test_rebuilt_file_with_same_size_is_downloaded_again(tmp_path):
+    from tools.pdt import is_file_downloaded
+
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"content")
+    file = {"size": 7, "sha256": hashlib.sha256(b"content").hexdigest()}
+    checksums = ChecksumCache(str(tmp_path / "cache"))
+    assert is_file_downloaded(file, str(path), checksums)
+    assert is_file_downloaded({"size": 7}, str(path), checksums)
+    assert not is_file_downloaded(dict(file, sha256=hashlib.sha256(b"rebuilt").hexdigest()), str(path), checksums)
+    assert not is_file_downloaded(dict(file, size=8), str(path), checksums)
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+from helpers.daemon import *
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """
+    Gets a function serving the requests with a handler in a thread
+    """
+    daemons = list()
+
+    def start(handler):
+        daemon = Daemon(str(tmp_path / "pdt.sock"), handler)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        while not is_server_running(daemon.socket_path):
+            time.sleep(0.01)
+        daemons.append((daemon, thread))
+        return daemon
+
+    yield start
+    for daemon, thread in daemons:
+        daemon.shutdown()
+        thread.join()
+
+
+def test_request_result_and_error(serve):
+    def handler(request):
+        if request["args"].get("fail"):
+            raise ValueError("Invalid request")
+        return {"echo": request["args"]}
+
+    daemon = serve(handler)
+    assert send_request(daemon.socket_path, {"action": "search", "args": {"guid": "guid"}}) == {"echo": {"guid": "guid"}}
+    with pytest.raises(ServerError, match="ValueError: Invalid request"):
+        send_request(daemon.socket_path, {"action": "search", "args": {"fail": True}})
+    assert send_request(daemon.socket_path, {"action": "stats"})["requests"] == {"search": 2}
+
+
+def test_identical_requests_share_result(serve):
+    calls = list()
+
+    def handler(request):
+        calls.append(request)
+        time.sleep(0.2)
+        return len(calls)
+
+    daemon = serve(handler)
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(
+        send_request(daemon.socket_path, {"action": "download", "args": {"guid": "guid"}}))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1, 1, 1]
+    assert len(calls) == 1
+    assert daemon.shared_requests == 2
+
+
+def test_stale_socket_is_replaced(serve, tmp_path):
+    (tmp_path / "pdt.sock").write_text("")
+    daemon = serve(lambda request: None)
+    assert is_server_running(daemon.socket_path)
+    with pytest.raises(Exception, match="already listening"):
+        Daemon(daemon.socket_path, lambda request: None).serve_forever()
+
+
+def test_server_not_running(tmp_path):
+    assert not is_server_running(str(tmp_path / "pdt.sock"))
+    with pytest.raises(FileNotFoundError):
+        send_request(str(tmp_path / "pdt.sock"), {"action": "ping"})
+
+
+def test_concurrent_clients_download_packages(tmp_path, monkeypatch):
+    from benchmarks.mock_artifactory import MockArtifactory
+    from helpers.artifactory import ArtifactoryHelper
+    from helpers.singleflight import SingleFlight
+    from tools import pdt
+
+    monkeypatch.setattr("helpers.cache.default_cache_dir", str(tmp_path / "cache"))
+    guids = [f"00000000-0000-0000-0000-00000000000{i}" for i in range(4)]
+    socket_path = str(tmp_path / "pdt.sock")
+    with MockArtifactory(latency=0.01) as server:
+        for index, guid in enumerate(guids):
+            path = f"products/product/2023.1/packages/l_product_p_2023.1.{index}_offline"
+            server.add_folder(path, {"auto.guid": guid, "auto.package_id": f"product.2023.1.{index}"})
+            for i in range(3):
+                server.add_file(f"{path}/webimage/file-{i}.sh", f"{guid}-{i}".encode("utf-8"))
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+        api.retry_sleep = 0
+        api.downloads = SingleFlight(str(tmp_path / "cache" / "downloads"))
+        thread = threading.Thread(target=pdt.do_serve, args=(api, socket_path))
+        thread.start()
+        while not is_server_running(socket_path):
+            time.sleep(0.01)
+
+        def download(index):
+            monkeypatch.setattr("sys.argv", ["pdt.py", "-u", "username", "--password", "password", "--server", socket_path, "download",
+                                             "-p", "product", "-r", "2023.1", "--os", "linux", "-g", guids[index],
+                                             "--part", "webimage", "--download-dir", str(tmp_path / str(index))])
+            args = pdt.parse_args()
+
+            def run():
+                try:
+                    pdt.run_remote(args)
+                except Exception as e:
+                    errors.append(e)
+
+            return run
+
+        errors = list()
+        try:
+            clients = [threading.Thread(target=download(i)) for i in range(len(guids))]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+        finally:
+            send_request(socket_path, {"action": "shutdown"})
+            thread.join()
+
+    assert not errors
+    for index, guid in enumerate(guids):
+        webimage_dir = tmp_path / str(index) / "webimage"
+        assert sorted(os.listdir(webimage_dir)) == [f"file-{i}.sh" for i in range(3)]
+        assert (webimage_dir / "file-0.sh").read_text() == f"{guid}-0"
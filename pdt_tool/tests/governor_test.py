@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from benchmarks.mock_artifactory import MockArtifactory
+from helpers.artifactory import ArtifactoryHelper
+from helpers.governor import *
+
+
+def test_requests_per_second():
+    governor = Governor(requests_per_second=20)
+    start = time.perf_counter()
+    for _ in range(30):
+        with governor.request():
+            pass
+    # The first second of requests is a burst
+    assert time.perf_counter() - start == pytest.approx(0.5, abs=0.1)
+
+
+def test_bytes_per_second_shared_between_governors(tmp_path):
+    state_file = str(tmp_path / "governor.json")
+    governors = [Governor(bytes_per_second=1000, state_file=state_file) for _ in range(2)]
+    start = time.perf_counter()
+    for governor in governors:
+        governor.wait(size=1000)
+        governor.wait(size=500)
+    assert time.perf_counter() - start == pytest.approx(2.0, abs=0.15)
+
+
+def test_concurrency_adapts_to_throttling():
+    governor = Governor(max_concurrency=8)
+    governor.record(429)
+    governor.record(503)
+    assert governor.concurrency == 2
+    for _ in range(2):
+        governor.record(200)
+    assert governor.concurrency == 3
+    for _ in range(100):
+        governor.record(200)
+    assert governor.concurrency == 8
+
+
+def test_retry_after():
+    assert get_retry_after_seconds("2") == 2
+    assert get_retry_after_seconds(None) == 0
+    assert get_retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert get_retry_after_seconds("invalid") == 0
+
+
+def test_throttled_requests_are_paused(tmp_path):
+    with MockArtifactory(failure_status=429, retry_after=0.3) as server:
+        server.add_file("file.txt", b"x" * 100)
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url, pool_size=4)
+        api.retry_sleep = 0
+        server.fail_next(1)
+        start = time.perf_counter()
+        api.download_file("file.txt", str(tmp_path))
+        assert time.perf_counter() - start >= 0.3
+        assert api.governor.concurrency == 2
+        assert server.requests["failure"] == 1
+
+
+def test_transfers_hold_request_slot(tmp_path):
+    import threading
+
+    from helpers.singleflight import SingleFlight
+
+    with MockArtifactory(bandwidth=2 * 1024 * 1024) as server:
+        for i in range(4):
+            server.add_file(f"file-{i}.bin", b"x" * 1024 * 1024)
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url,
+                                governor=Governor(max_concurrency=1))
+        api.downloads = SingleFlight(str(tmp_path / "locks"))
+        threads = [threading.Thread(target=api.download_file, args=(f"file-{i}.bin", str(tmp_path)))
+                   for i in range(4)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Each transfer takes 0.5s, one at a time
+        assert time.perf_counter() - start >= 1.9
+        assert len(list(tmp_path.glob("file-*.bin"))) == 4
+        assert api.governor._in_flight == 0
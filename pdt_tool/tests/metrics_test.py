@@ -0,0 +1,79 @@
+import json
+
+import pytest
+import responses
+
+from helpers.metrics import *
+from helpers.transport import TransportStats, create_session
+
+url = "https://ubit-artifactory-or.intel.com/artifactory/satgoneapi-or-local/file.txt"
+
+
+def test_span_records_duration_and_labels():
+    metrics = Metrics()
+    with metrics.span("download", channel="yum") as span:
+        span.bytes = 10
+    assert len(metrics.spans) == 1
+    assert metrics.spans[0].labels == {"channel": "yum"}
+    assert metrics.spans[0].bytes == 10
+    assert metrics.spans[0].duration >= 0
+    assert metrics.spans[0].error is None
+
+
+def test_span_records_error():
+    metrics = Metrics()
+    with pytest.raises(ValueError):
+        with metrics.span("search"):
+            raise ValueError()
+    assert metrics.spans[0].error == "ValueError"
+
+
+@responses.activate
+def test_span_records_requests_and_bytes():
+    responses.add(responses.GET, url, body=b"x" * 1024, status=200)
+    stats = TransportStats()
+    session = create_session("username", "password", stats=stats)
+    session.get(url)
+
+    metrics = Metrics()
+    with metrics.span("download", stats=stats):
+        session.get(url)
+        session.get(url)
+    assert metrics.spans[0].requests == 2
+    assert metrics.spans[0].bytes == 2048
+
+
+def test_json_lines_are_appended_and_loaded(tmp_path):
+    metrics_file = str(tmp_path / "metrics.jsonl")
+    for _ in range(2):
+        metrics = Metrics()
+        with metrics.span("fetch"):
+            pass
+        metrics.increment("artifactory.retries", operation="download_file")
+        metrics.export(metrics_file)
+
+    with open(metrics_file) as f:
+        records = [json.loads(i) for i in f]
+    assert [i["type"] for i in records] == ["span", "counter"] * 2
+
+    metrics = Metrics()
+    metrics.load(metrics_file)
+    assert len(metrics.get_records()) == 4
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = Metrics()
+    for _ in range(2):
+        with metrics.span("generate.download", channel="yum") as span:
+            span.bytes = 100
+    metrics.increment("artifactory.retries", operation="download_file")
+    metrics.increment("artifactory.retries", 2, operation="download_file")
+    metrics_file = str(tmp_path / "pdt.prom")
+    metrics.export(metrics_file)
+
+    with open(metrics_file) as f:
+        lines = f.read().splitlines()
+    assert 'pdt_span_count_total{channel="yum",span="generate.download"} 2' in lines
+    assert 'pdt_span_bytes_total{channel="yum",span="generate.download"} 200' in lines
+    assert "# TYPE pdt_span_duration_seconds_total counter" in lines
+    assert 'pdt_artifactory_retries_total{operation="download_file"} 3' in lines
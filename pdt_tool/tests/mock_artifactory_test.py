@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from benchmarks.mock_artifactory import *
+from helpers.artifactory import ArtifactoryHelper
+
+base = "products/product/2023.1/packages"
+
+
+@pytest.fixture
+def server():
+    with MockArtifactory(credentials=("username", "password")) as mock:
+        mock.add_folder(f"{base}/l_package_1", {"auto.guid": "guid1", "auto.package_id": "1"})
+        mock.add_folder(f"{base}/l_package_2", {"auto.guid": "guid2", "auto.package_id": "2"})
+        mock.add_folder(f"{base}/w_package_3", {"auto.guid": "guid3", "auto.package_id": "3"})
+        mock.add_file(f"{base}/l_package_2/webimage/a.sh", b"a" * 100)
+        mock.add_file(f"{base}/l_package_2/webimage/sub/b.sh", b"b" * 200)
+        yield mock
+
+
+@pytest.fixture
+def api(server):
+    helper = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+    helper.retry_sleep = 0
+    return helper
+
+
+def test_mock_list_files(api):
+    files = api.list_files(f"{base}/l_package_2/webimage", deep=True)
+    assert [(i["path"], i["size"]) for i in files] == [
+        (f"{base}/l_package_2/webimage/a.sh", 100),
+        (f"{base}/l_package_2/webimage/sub/b.sh", 200),
+    ]
+    assert files[0]["sha256"] == hashlib.sha256(b"a" * 100).hexdigest()
+    assert len(api.list_files(f"{base}/l_package_2/webimage")) == 1
+
+
+def test_mock_search(api, server):
+    search = dict(naming_pattern="^l_.*$", name_match="l_*", mandatory_properties=["auto.guid"], quiet=True)
+    assert api.search_for_child_folder_with_properties(base, **search)["name"] == "l_package_2"
+    found = api.search_for_child_folder_with_properties(base, {"auto.guid": "guid1"}, **search)
+    assert found["name"] == "l_package_1"
+    assert found["properties"] == {"auto.guid": ["guid1"], "auto.package_id": ["1"]}
+    assert api.search_for_child_folder_with_properties(base, lexically_ordered=True, **search)["name"] == "l_package_2"
+    assert server.requests["aql"] == 3
+
+
+def test_mock_download_folder(api, server, tmp_path):
+    api.download_folder(f"{base}/l_package_2/webimage", str(tmp_path / "archive"))
+    assert (tmp_path / "archive" / "sub" / "b.sh").read_bytes() == b"b" * 200
+    assert server.requests["archive"] == 1
+
+    server.max_archive_size = 0
+    api.download_folder(f"{base}/l_package_2/webimage", str(tmp_path / "files"))
+    assert (tmp_path / "files" / "sub" / "b.sh").read_bytes() == b"b" * 200
+    assert server.requests["download"] == 2
+
+
+def test_mock_upload(api, server, tmp_path):
+    (tmp_path / "folder" / "sub").mkdir(parents=True)
+    (tmp_path / "folder" / "sub" / "file.txt").write_text("content")
+    api.upload(str(tmp_path / "folder"), "drops/folder", properties={"key": "value"})
+    assert server.list_paths("drops/folder") == ["sub/file.txt"]
+    assert server.read_file("drops/folder/sub/file.txt") == b"content"
+    assert server.get_properties("drops/folder/sub/file.txt") == {"key": ["value"]}
+
+    api.upload(str(tmp_path / "folder" / "sub" / "file.txt"), "drops/file.txt")
+    assert server.read_file("drops/file.txt") == b"content"
+    api.delete_path("drops")
+    assert not server.exists("drops")
+
+
+def test_mock_failures_are_retried(api, server, tmp_path):
+    server.fail_next(2)
+    api.download_file(f"{base}/l_package_2/webimage/a.sh", str(tmp_path))
+    assert (tmp_path / "a.sh").read_bytes() == b"a" * 100
+    assert server.requests["failure"] == 2
+
+    api.retry_count = 1
+    server.fail_next(1)
+    with pytest.raises(Exception, match="503"):
+        api.list_files(base)
+
+
+def test_mock_rejects_bad_credentials(server):
+    api = ArtifactoryHelper("username", "wrong", artifactory_url=server.url)
+    api.retry_count = 1
+    api.retry_sleep = 0
+    with pytest.raises(Exception):
+        api.list_files(base)
+    assert server.requests["unauthorized"] == 1
+
+
+def test_mock_bandwidth_and_latency(api, server, tmp_path):
+    server.add_file("large.bin", os.urandom(256 * 1024))
+    server.latency = 0.05
+    server.bandwidth = 1024 * 1024
+    start = time.perf_counter()
+    api.download_file("large.bin", str(tmp_path))
+    assert time.perf_counter() - start >= 0.05 + 0.25
+    assert server.stats()["bytes sent"] == 256 * 1024
@@ -0,0 +1,31 @@
+from helpers.natsort import *
+
+paths = [
+    "products/p/r/packages/l_product_p_2023.1.0.10",
+    "products/p/r/packages/l_product_p_2023.1.0.9",
+    "products/p/r/packages/l_product_p_2023.0.0.100",
+    "products/p/r/packages/l_product_p_2023_1_0_9",
+]
+
+
+def test_natural_key():
+    assert natural_key("a_123/b.2") == ("a.", 123, "/b.", 2, "")
+
+
+def test_latest_matches_sort():
+    assert latest(paths) == sort_list_naturally(paths)[-1]
+    assert latest(paths) == "products/p/r/packages/l_product_p_2023.1.0.10"
+
+
+def test_latest_keeps_last_of_equal_items():
+    items = [{"name": "a_1", "id": 1}, {"name": "a.1", "id": 2}]
+    assert latest(items, key=lambda x: x["name"])["id"] == 2
+
+
+def test_latest_empty():
+    assert latest([]) is None
+    assert latest([], default="default") == "default"
+
+
+def test_top_k():
+    assert top_k(paths, 2) == sort_list_naturally(paths, reverse=True)[:2]
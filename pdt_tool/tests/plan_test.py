@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from benchmarks.mock_artifactory import MockArtifactory
+from helpers.artifactory import ArtifactoryHelper
+from helpers.cache import SearchCache
+from helpers.plan import *
+from tools.pdt import do_download
+
+base = "products/product/2023.1/packages"
+
+
+def test_estimate_duration():
+    assert estimate_duration(100 * 1024 * 1024, 10, bandwidth=50 * 1024 * 1024, latency=0.1) == pytest.approx(3.0)
+    assert estimate_duration(100 * 1024 * 1024, 10, jobs=4, bandwidth=50 * 1024 * 1024, latency=0.1) \
+        == pytest.approx(2.25)
+
+
+def test_summarize_plan():
+    plan = {
+        "files": [{"size": 10}, {"size": 20}],
+        "existing files": [{"size": 5}],
+        "duplicate files": [{"size": 7}],
+    }
+    summarize_plan(plan, bandwidth=30, latency=1)
+    assert plan["download files"] == 2
+    assert plan["download bytes"] == 30
+    assert plan["skipped files"] == 2
+    assert plan["skipped bytes"] == 12
+    assert plan["estimated seconds"] == 3.0
+
+
+def test_download_plan(tmp_path):
+    with MockArtifactory(credentials=("username", "password")) as server:
+        server.add_folder(f"{base}/l_package", {"auto.guid": "guid", "auto.package_id": "1"})
+        server.add_file(f"{base}/l_package/webimage/a.sh", b"a" * 100)
+        server.add_file(f"{base}/l_package/webimage/b.sh", b"b" * 200)
+        (tmp_path / "existing").mkdir()
+        (tmp_path / "existing" / "a.sh").write_bytes(b"a" * 100)
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+        cache = SearchCache(str(tmp_path / "cache"))
+
+        for _ in range(2):
+            do_download(api, "product", "2023.1", guid="guid", package_os="linux", download_dir=str(tmp_path),
+                        shallow=True, part="webimage", cache=cache, existing_dir=str(tmp_path / "existing"),
+                        plan_file=str(tmp_path / "plan.json"))
+        assert server.requests["download"] == 0
+        assert server.requests["aql"] == 1
+
+    with open(tmp_path / "plan.json") as f:
+        plan = json.load(f)
+    assert [i["name"] for i in plan["files"]] == ["b.sh"]
+    assert plan["files"][0]["sha256"]
+    assert [i["name"] for i in plan["existing files"]] == ["a.sh"]
+    assert plan["download bytes"] == 200
+    assert plan["search cache hits"] == 1
+    assert plan["estimated seconds"] >= 0
@@ -0,0 +1,37 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from helpers import py_cksum
+
+
+def test_known_checksums():
+    assert py_cksum.memcrc(b"") == 4294967295
+    assert py_cksum.memcrc(b"dummy") == 3723871108
+
+
+def test_chunked_file_matches_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(py_cksum, "chunk_size", 1000)
+    data = os.urandom(300 * 1024 + 7)
+    path = tmp_path / "file.bin"
+    path.write_bytes(data)
+    assert py_cksum.calculate_cksum(str(path)) == py_cksum.memcrc(data)
+
+
+@pytest.mark.skipif(not shutil.which("cksum"), reason="No `cksum` command")
+def test_batched_files_match_cksum_command(tmp_path, monkeypatch):
+    monkeypatch.setattr(py_cksum, "batch_size", 1024)
+    paths = list()
+    for i, size in enumerate([0, 1, 255, 256, 65536, 1024 * 1024 + 1, 3, 500]):
+        path = str(tmp_path / f"file{i}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+
+    expected = dict()
+    for line in subprocess.check_output(["cksum", *paths]).decode("utf-8").splitlines():
+        cksum, _, path = line.split(" ", 2)
+        expected[path] = int(cksum)
+    assert py_cksum.calculate_cksums(paths, jobs=3) == expected
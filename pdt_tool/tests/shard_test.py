@@ -0,0 +1,54 @@
+import pytest
+
+from benchmarks.mock_artifactory import MockArtifactory
+from helpers.artifactory import ArtifactoryHelper
+from helpers.shard import *
+from tools.pdt import do_fetch
+
+files = [{"path": f"products/product/2023.1/packages/l_package/webimage/{i}.sh", "name": f"{i}.sh", "size": 10}
+         for i in range(20)]
+
+
+def test_shards_partition_files():
+    shards = [get_shard_files(files, i, 4) for i in range(4)]
+    assert sorted(i["name"] for shard in shards for i in shard) == sorted(i["name"] for i in files)
+    assert get_shard(files[0]["path"], 4) == get_shard(files[0]["path"], 4)
+
+
+def test_queue_claims_each_shard_once(tmp_path):
+    queue = ShardQueue(str(tmp_path), 4)
+    other = ShardQueue(str(tmp_path), 8)
+    assert other.shards == 4
+
+    claimed = list()
+    claims = queue.claim()
+    claimed.append(next(claims))
+    # The shard claimed by the first worker is skipped by the other one
+    claimed += list(other.claim())
+    claimed += list(claims)
+    assert sorted(claimed) == [0, 1, 2, 3]
+    assert queue.get_pending() == []
+
+
+def test_queue_releases_failed_shard(tmp_path):
+    queue = ShardQueue(str(tmp_path), 2)
+    with pytest.raises(ValueError):
+        for _ in queue.claim():
+            raise ValueError()
+    assert queue.get_pending() == [0, 1]
+    assert list(queue.claim()) == [0, 1]
+
+
+def test_fetch_from_queue_resumes(tmp_path):
+    with MockArtifactory() as server:
+        for i in files:
+            server.add_file(i["path"], b"x" * 10)
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+
+        do_fetch(api, files, str(tmp_path / "download"), shard=(0, 2))
+        shard = get_shard_files(files, 0, 2)
+        assert sorted(i.name for i in (tmp_path / "download").iterdir()) == sorted(i["name"] for i in shard)
+
+        do_fetch(api, files, str(tmp_path / "download"), queue_dir=str(tmp_path / "queue"), shards=4)
+        assert len(list((tmp_path / "download").iterdir())) == len(files)
+        assert server.requests["download"] == len(files)
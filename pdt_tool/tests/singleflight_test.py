@@ -0,0 +1,105 @@
+import errno
+import os
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_artifactory import MockArtifactory
+from helpers.artifactory import ArtifactoryHelper
+from helpers.singleflight import *
+
+
+def run_concurrently(*funcs):
+    results = [None] * len(funcs)
+
+    def run(index):
+        results[index] = funcs[index]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(funcs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_share_result():
+    calls = list()
+
+    def func(record):
+        calls.append(record)
+        time.sleep(0.2)
+        return len(calls)
+
+    single_flight = SingleFlight()
+    results = run_concurrently(*[lambda: single_flight.run("key", func)] * 3)
+    assert sorted(results) == [(1, False), (1, True), (1, True)]
+    assert calls == [None]
+    assert single_flight.run("key", func) == (2, False)
+
+
+def test_error_is_shared():
+    def func(record):
+        time.sleep(0.2)
+        raise ValueError()
+
+    single_flight = SingleFlight()
+    with pytest.raises(ValueError):
+        single_flight.run("key", func)
+
+
+def test_processes_get_recorded_result(tmp_path):
+    # Each instance stands for a process sharing the lock dir
+    instances = [SingleFlight(str(tmp_path)) for _ in range(2)]
+    records = list()
+
+    def func(record):
+        records.append(record)
+        time.sleep(0.2)
+        return record or "downloaded"
+
+    results = run_concurrently(*[lambda instance=i: instance.run("key", func) for i in instances])
+    assert results == [("downloaded", False)] * 2
+    assert sorted(records, key=str) == [None, "downloaded"]
+
+    assert SingleFlight(str(tmp_path), result_ttl=-1).run("key", lambda record: record) == (None, False)
+
+
+def test_expired_lock_files_are_removed(tmp_path):
+    single_flight = SingleFlight(str(tmp_path), result_ttl=10)
+    for key in ("expired", "recent"):
+        single_flight.run(key, lambda record: key)
+    os.utime(tmp_path / "expired.lock", (time.time() - 20, time.time() - 20))
+
+    SingleFlight(str(tmp_path), result_ttl=10).run("other", lambda record: None)
+    assert sorted(os.listdir(tmp_path)) == ["other.lock", "recent.lock"]
+
+
+def test_unsupported_file_lock_is_not_shared(tmp_path, monkeypatch):
+    def flock(*args):
+        raise OSError(errno.ENOLCK, "No locks available")
+
+    monkeypatch.setattr("helpers.singleflight.fcntl.flock", flock)
+    assert SingleFlight(str(tmp_path)).run("key", lambda record: record or "result") == ("result", False)
+
+
+def test_concurrent_downloads_transfer_file_once(tmp_path):
+    with MockArtifactory(bandwidth=1024 * 1024) as server:
+        server.add_file("file.bin", b"x" * 256 * 1024)
+        api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+        api.downloads = SingleFlight(str(tmp_path / "locks"))
+        other_api = ArtifactoryHelper("username", "password", artifactory_url=server.url)
+        other_api.downloads = SingleFlight(str(tmp_path / "locks"))
+
+        run_concurrently(lambda: api.download_file("file.bin", str(tmp_path / "a")),
+                         lambda: api.download_file("file.bin", str(tmp_path / "b")),
+                         lambda: other_api.download_file("file.bin", str(tmp_path / "c")))
+        assert server.requests["download"] == 1
+        for i in "abc":
+            assert (tmp_path / i / "file.bin").read_bytes() == b"x" * 256 * 1024
+
+        # The file changed since its download is downloaded again
+        (tmp_path / "a" / "file.bin").write_bytes(b"y")
+        other_api.download_file("file.bin", str(tmp_path / "d"))
+        assert server.requests["download"] == 2
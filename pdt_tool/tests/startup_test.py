@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+tool_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules which take long to import and are only needed once the arguments are parsed
+heavy_modules = ["requests", "urllib3", "artifactory", "dohq_artifactory", "yaml", "tarfile", "cProfile"]
+
+
+def get_import_times(*args) -> dict:
+    """
+    Runs a tool with `-X importtime`
+    :return the cumulative import time in microseconds of each imported module
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=tool_dir, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    times = dict()
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("args", [
+    ["pdt.py", "--help"],
+    ["pdt.py", "-u", "username", "-p", "password", "download", "--help"],
+    ["pdt.py", "-u", "username", "download", "-p", "product", "-r", "release"],
+    ["cdt.py", "--help"],
+    ["cdt.py", "-u", "username", "-p", "password", "drop", "--help"],
+], ids=["pdt help", "pdt download help", "pdt argument error", "cdt help", "cdt drop help"])
+def test_cli_does_not_import_heavy_modules(args):
+    times = get_import_times(*args)
+    assert f"tools.{args[0][:-3]}" in times
+    assert [i for i in heavy_modules if i in times] == []
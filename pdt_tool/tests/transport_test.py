@@ -0,0 +1,71 @@
+import responses
+
+from helpers.transport import *
+
+url = "https://ubit-artifactory-or.intel.com/artifactory/satgoneapi-or-local/file.txt"
+
+
+def test_create_session_mounts_sized_adapter():
+    session = create_session("username", "password", pool_size=4)
+    adapter = session.get_adapter(url)
+    assert isinstance(adapter, TimedHTTPAdapter)
+    assert adapter._pool_maxsize == 4
+    assert session.auth == ("username", "password")
+
+
+def test_create_session_defaults_pool_size():
+    session = create_session("username", "password")
+    assert session.get_adapter(url)._pool_maxsize == default_pool_size
+
+
+@responses.activate
+def test_timed_adapter_records_requests():
+    responses.add(responses.GET, url, body=b"x" * 1024, status=200)
+    stats = TransportStats()
+    session = create_session("username", "password", stats=stats)
+
+    response = session.get(url, stream=True)
+    content = b"".join(response.iter_content(chunk_size=100))
+
+    assert len(content) == 1024
+    assert len(stats.requests) == 1
+    timing = stats.requests[0]
+    assert timing.method == "GET"
+    assert timing.status == 200
+    assert timing.bytes == 1024
+    summary = stats.summary()
+    assert summary["requests"] == 1
+    assert summary["bytes"] == 1024
+
+
+def test_get_url_class():
+    base = "https://ubit-artifactory-or.intel.com/artifactory"
+    assert get_url_class("GET", f"{base}/api/storage/repo/path?list&deep=1") == "storage list"
+    assert get_url_class("GET", f"{base}/api/storage/repo/path?properties") == "storage properties"
+    assert get_url_class("GET", f"{base}/api/storage/repo/path") == "storage"
+    assert get_url_class("POST", f"{base}/api/search/aql") == "aql"
+    assert get_url_class("GET", f"{base}/api/archive/download/repo/path?archiveType=tar.gz") == "archive"
+    assert get_url_class("PATCH", f"{base}/api/metadata/repo/path?recursive=1") == "metadata"
+    assert get_url_class("PUT", f"{base}/repo/path/") == "folder"
+    assert get_url_class("GET", f"{base}/repo/path/file.txt") == "item"
+
+
+@responses.activate
+def test_requests_table_groups_by_operation():
+    responses.add(responses.GET, url, body=b"x" * 10, status=200)
+    responses.add(responses.PUT, url, status=500)
+    stats = TransportStats()
+    session = create_session("username", "password", stats=stats)
+
+    with operation("download_file"):
+        session.get(url)
+        session.get(url)
+    session.put(url, data=b"y" * 5)
+
+    table = {(i["operation"], i["method"]): i for i in stats.get_table()}
+    assert table[("download_file", "GET")]["requests"] == 2
+    assert table[("download_file", "GET")]["bytes"] == 20
+    assert table[("download_file", "GET")]["url class"] == "item"
+    assert table[("-", "PUT")]["errors"] == 1
+    assert table[("-", "PUT")]["sent bytes"] == 5
+    assert len(stats.format_table().splitlines()) == 3
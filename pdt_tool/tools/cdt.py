@@ -1,14 +1,25 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
 import json
 import os.path
+import shutil
+import sys
 import uuid
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-import yaml
-
-from helpers.artifactory import *
-from helpers.bom import *
+from helpers.cache import SearchCache
+from helpers.governor import Governor, default_bytes_per_second, default_max_concurrency, \
+    default_requests_per_second, default_state_file
+from helpers.metrics import default_metrics_file, metrics, profile
 
-urllib3.disable_warnings()
+# The Artifactory helper imports requests and dohq-artifactory which take longer to import than the rest of the tool.
+# They are imported once the arguments are parsed so that `--help` and argument errors return immediately, as are yaml
+# and tarfile which are only needed by the `drop` action.
+if TYPE_CHECKING:
+    from helpers.artifactory import ArtifactoryHelper
 
 repo_dir = os.path.abspath(os.path.dirname(__file__))
 execution_dir = os.getcwd()
@@ -48,6 +59,54 @@ def parse_args():
     parser.add_argument("--verbose", "-v",
                         action="store_true",
                         help="Print debug messages")
+    parser.add_argument("--pool-size",
+                        metavar="POOL_SIZE",
+                        type=int,
+                        required=False,
+                        help="Maximum number of keep-alive connections to Artifactory. "
+                             f"Defaults to `{default_max_concurrency}`.")
+    parser.add_argument("--max-requests-per-second",
+                        metavar="REQUESTS",
+                        type=float,
+                        required=False,
+                        default=default_requests_per_second,
+                        help="Maximum number of requests per second sent to Artifactory. Defaults to the "
+                             "`PDT_MAX_REQUESTS_PER_SECOND` environment variable, no limit if not set.")
+    parser.add_argument("--max-bytes-per-second",
+                        metavar="BYTES",
+                        type=float,
+                        required=False,
+                        default=default_bytes_per_second,
+                        help="Maximum number of bytes per second downloaded from and uploaded to Artifactory. Defaults "
+                             "to the `PDT_MAX_BYTES_PER_SECOND` environment variable, no limit if not set.")
+    parser.add_argument("--governor-file",
+                        metavar="GOVERNOR_FILE",
+                        required=False,
+                        default=default_state_file,
+                        help="File shared with other processes so that the limits apply to their traffic as a whole. "
+                             "Defaults to the `PDT_GOVERNOR_FILE` environment variable.")
+    parser.add_argument("--metrics-file",
+                        metavar="METRICS_FILE",
+                        required=False,
+                        default=default_metrics_file,
+                        help="File where to write the timings, bytes and requests of the phases of the run, and the "
+                             "retries. Written as a Prometheus textfile if it has the `.prom` extension, appended as "
+                             "json lines otherwise. Defaults to the `PDT_METRICS_FILE` environment variable.")
+    parser.add_argument("--profile",
+                        metavar="PROFILE_FILE",
+                        nargs="?",
+                        const="",
+                        required=False,
+                        help="Profile the run with cProfile, printing the slowest functions and dumping the stats to "
+                             "PROFILE_FILE if specified.")
+    parser.add_argument("--trace",
+                        metavar="TRACE_FILE",
+                        nargs="?",
+                        const="",
+                        required=False,
+                        help="Trace the HTTP requests, printing at exit a table of the requests issued by each "
+                             "operation per URL class with their latency and bytes, and writing every request as json "
+                             "lines to TRACE_FILE if specified.")
 
     subparsers = parser.add_subparsers(dest='action', help='action to perform')
     subparsers.required = True
@@ -122,6 +181,10 @@ def parse_args():
                                metavar='SEARCH_META_FILE',
                                required=False,
                                help="Path to the where to place the json meta file related to the found drop.")
+    parser_search.add_argument('--no-cache',
+                               action='store_true',
+                               help="Do not use the local cache of search results. By default, searches by GUID are "
+                                    "cached since a GUID identifies an immutable drop.")
     subparsers.add_parser('search',
                           parents=[common_options, parser_search],
                           help='Search for a drop location based on some criteria.')
@@ -165,6 +228,7 @@ def parse_args():
                 parser.error(f"Invalid property `{i}`. Property should be of format `KEY=VALUE`.")
             key, value = i.split("=", 1)
             properties[key] = value
+        from helpers.artifactory import validate_properties
         validate_properties(properties)
         _args.property = properties
 
@@ -210,6 +274,13 @@ def do_drop(api: ArtifactoryHelper, product: str, release: str, component: str,
             reports_dir: str = None, meta_file: str = None, boms: list = None,
             properties: dict = None,
             timestamp: str = None, compress=True, result_file=None):
+    import tarfile
+
+    import yaml
+
+    from helpers.artifactory import validate_properties
+    from helpers.bom import generate_bom_for_path
+
     def print_summary():
         meta = {
             "product": product,
@@ -399,33 +470,48 @@ def do_drop(api: ArtifactoryHelper, product: str, release: str, component: str,
 
 
 def do_search(api: ArtifactoryHelper, product: str, release: str, component: str,
-              guid: str = None, timestamp: str = None, properties: dict = None, search_meta_file: str = None):
+              guid: str = None, timestamp: str = None, properties: dict = None, search_meta_file: str = None,
+              cache: SearchCache = None):
     properties = properties or dict()
     if guid:
         properties["auto.guid"] = guid
     if timestamp:
         properties["auto.timestamp"] = timestamp
-    base_artifactory_path = get_component_drop_base_location(product, release, component)
 
-    mandatory_properties = ["auto.guid", "auto.timestamp", "auto.drop_execution_time"]
-    path = api.search_for_child_folder_with_properties(base_artifactory_path, properties,
-                                                       naming_pattern=f"^\\d{{{len(execution_time)}}}$",
-                                                       mandatory_properties=mandatory_properties)
+    # Only searches by GUID are cached since other searches resolve to the latest drop which may change
+    # The repository URL tells apart the same searches sent to different Artifactory instances
+    cache_key = None
+    if cache and guid:
+        cache_key = SearchCache.get_key("cdt", api.repository_url, product, release, component, properties)
+    meta = cache.get(cache_key) if cache_key else None
+
+    if not meta:
+        base_artifactory_path = get_component_drop_base_location(product, release, component)
+
+        mandatory_properties = ["auto.guid", "auto.timestamp", "auto.drop_execution_time"]
+        path = api.search_for_child_folder_with_properties(base_artifactory_path, properties,
+                                                           naming_pattern=f"^\\d{{{len(execution_time)}}}$",
+                                                           mandatory_properties=mandatory_properties,
+                                                           name_match="?" * len(execution_time),
+                                                           lexically_ordered=True)
+
+        if not path:
+            msg = f"No component drop found that matches the search criteria"
+            if properties:
+                msg += f": `{properties}`"
+            raise Exception(msg)
+
+        meta = {
+            "product": product,
+            "release": release,
+            "component": component,
+            "path": f"{path['path']}/{path['name']}",
+            "search properties": properties,
+            "resolved properties": path["properties"],
+        }
+        if cache_key:
+            cache.put(cache_key, meta)
 
-    if not path:
-        msg = f"No component drop found that matches the search criteria"
-        if properties:
-            msg += f": `{properties}`"
-        raise Exception(msg)
-
-    meta = {
-        "product": product,
-        "release": release,
-        "component": component,
-        "path": f"{path['path']}/{path['name']}",
-        "search properties": properties,
-        "resolved properties": path["properties"],
-    }
     if search_meta_file:
         search_meta_file_dir = os.path.dirname(search_meta_file)
         if search_meta_file_dir:
@@ -437,7 +523,7 @@ def do_search(api: ArtifactoryHelper, product: str, release: str, component: str
 
 def do_download(api: ArtifactoryHelper, product: str, release: str, component: str,
                 guid: str = None, timestamp: str = None, properties: dict = None,
-                download_dir=None, extract=True, search_meta_file: str = None):
+                download_dir=None, extract=True, search_meta_file: str = None, cache: SearchCache = None):
     download_dir = download_dir or os.getcwd()
     meta = do_search(
         api=api,
@@ -448,6 +534,7 @@ def do_download(api: ArtifactoryHelper, product: str, release: str, component: s
         timestamp=timestamp,
         properties=properties,
         search_meta_file=search_meta_file,
+        cache=cache,
     )
     print(json.dumps(meta, indent=4))
     api.download_folder(
@@ -462,9 +549,8 @@ def do_download(api: ArtifactoryHelper, product: str, release: str, component: s
     return meta
 
 
-def main():
-    args = parse_args()
-    api = ArtifactoryHelper(args.username, args.password, verbose=args.verbose)
+def run(api: ArtifactoryHelper, args):
+    cache = None if getattr(args, "no_cache", True) else SearchCache()
     if args.action == "drop":
         do_drop(
             api=api,
@@ -489,6 +575,7 @@ def main():
             guid=args.guid,
             properties=args.property,
             search_meta_file=args.search_meta_file,
+            cache=cache,
         )
         print(json.dumps(meta, indent=4))
     elif args.action == "download":
@@ -502,8 +589,33 @@ def main():
             download_dir=args.download_dir,
             extract=args.extract,
             search_meta_file=args.search_meta_file,
+            cache=cache,
         )
 
+    if args.verbose:
+        print(json.dumps(api.transport_stats.summary(), indent=4))
+
+
+def main():
+    args = parse_args()
+    from helpers.artifactory import ArtifactoryHelper
+    governor = Governor(args.max_requests_per_second, args.max_bytes_per_second,
+                        args.pool_size or default_max_concurrency, args.governor_file)
+    api = ArtifactoryHelper(args.username, args.password, verbose=args.verbose, pool_size=args.pool_size,
+                            governor=governor)
+    labels = {i: getattr(args, i) for i in ("product", "release", "component") if getattr(args, i, None)}
+    try:
+        with profile(args.profile) if args.profile is not None else contextlib.nullcontext():
+            with metrics.span(f"cdt.{args.action}", stats=api.transport_stats, **labels):
+                run(api, args)
+    finally:
+        if args.metrics_file:
+            metrics.export(args.metrics_file)
+        if args.trace is not None:
+            print(api.transport_stats.format_table(), file=sys.stderr)
+            if args.trace:
+                api.transport_stats.write_trace(args.trace)
+
 
 if __name__ == "__main__":
     main()
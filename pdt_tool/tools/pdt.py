@@ -1,10 +1,26 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
 import json
+import os
+import platform
+import sys
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-from helpers.artifactory import *
-from helpers.bom import *
+from helpers.cache import ChecksumCache, SearchCache
+from helpers.daemon import default_socket
+from helpers.governor import Governor, default_bytes_per_second, default_max_concurrency, \
+    default_requests_per_second, default_state_file
+from helpers.metrics import default_metrics_file, metrics, profile
+from helpers.plan import format_plan, summarize_plan
+from helpers.shard import ShardQueue, default_shards, get_shard_files
 
-urllib3.disable_warnings()
+# The Artifactory helper imports requests and dohq-artifactory which take longer to import than the rest of the tool.
+# They are imported once the arguments are parsed so that `--help` and argument errors return immediately.
+if TYPE_CHECKING:
+    from helpers.artifactory import ArtifactoryHelper
 
 repo_dir = os.path.abspath(os.path.dirname(__file__))
 execution_dir = os.getcwd()
@@ -59,6 +75,62 @@ def parse_args():
     parser.add_argument("--verbose", "-v",
                         action="store_true",
                         help="Print debug messages")
+    parser.add_argument("--pool-size",
+                        metavar="POOL_SIZE",
+                        type=int,
+                        required=False,
+                        help="Maximum number of keep-alive connections to Artifactory. "
+                             f"Defaults to `{default_max_concurrency}`.")
+    parser.add_argument("--max-requests-per-second",
+                        metavar="REQUESTS",
+                        type=float,
+                        required=False,
+                        default=default_requests_per_second,
+                        help="Maximum number of requests per second sent to Artifactory. Defaults to the "
+                             "`PDT_MAX_REQUESTS_PER_SECOND` environment variable, no limit if not set.")
+    parser.add_argument("--max-bytes-per-second",
+                        metavar="BYTES",
+                        type=float,
+                        required=False,
+                        default=default_bytes_per_second,
+                        help="Maximum number of bytes per second downloaded from and uploaded to Artifactory. Defaults "
+                             "to the `PDT_MAX_BYTES_PER_SECOND` environment variable, no limit if not set.")
+    parser.add_argument("--governor-file",
+                        metavar="GOVERNOR_FILE",
+                        required=False,
+                        default=default_state_file,
+                        help="File shared with other processes so that the limits apply to their traffic as a whole. "
+                             "Defaults to the `PDT_GOVERNOR_FILE` environment variable.")
+    parser.add_argument("--metrics-file",
+                        metavar="METRICS_FILE",
+                        required=False,
+                        default=default_metrics_file,
+                        help="File where to write the timings, bytes and requests of the phases of the run, and the "
+                             "retries. Written as a Prometheus textfile if it has the `.prom` extension, appended as "
+                             "json lines otherwise. Defaults to the `PDT_METRICS_FILE` environment variable.")
+    parser.add_argument("--profile",
+                        metavar="PROFILE_FILE",
+                        nargs="?",
+                        const="",
+                        required=False,
+                        help="Profile the run with cProfile, printing the slowest functions and dumping the stats to "
+                             "PROFILE_FILE if specified.")
+    parser.add_argument("--trace",
+                        metavar="TRACE_FILE",
+                        nargs="?",
+                        const="",
+                        required=False,
+                        help="Trace the HTTP requests, printing at exit a table of the requests issued by each "
+                             "operation per URL class with their latency and bytes, and writing every request as json "
+                             "lines to TRACE_FILE if specified.")
+
+    parser.add_argument("--server",
+                        metavar="SOCKET",
+                        required=False,
+                        default=default_socket,
+                        help="Unix socket of a server started with the `serve` action to send the action to instead of "
+                             "running it. The action runs locally if the server is not running. Defaults to the "
+                             "`PDT_SERVER` environment variable.")
 
     subparsers = parser.add_subparsers(dest='action', help='action to perform')
     subparsers.required = True
@@ -80,6 +152,10 @@ def parse_args():
                                metavar='SEARCH_META_FILE',
                                required=False,
                                help="Path to the where to place the json meta file related to the found package.")
+    parser_search.add_argument('--no-cache',
+                               action='store_true',
+                               help="Do not use the local cache of search results. By default, searches by GUID are "
+                                    "cached since a GUID identifies an immutable package.")
     subparsers.add_parser('search',
                           parents=[common_options, parser_search],
                           help='Search for a package location based on some criteria.')
@@ -99,6 +175,23 @@ def parse_args():
                                     required=False,
                                     default=False,
                                     help="Do not download subdirectory contents.")
+    subparser_download.add_argument('--existing-dir',
+                                    metavar='EXISTING_DIR',
+                                    required=False,
+                                    help="Folder holding previously downloaded files. Files present there with the "
+                                         "same name and size are not downloaded again. Requires `--shallow`.")
+    subparser_download.add_argument('--manifest-file',
+                                    metavar='MANIFEST_FILE',
+                                    required=False,
+                                    help="Path to where to place the json list of the files of the package, including "
+                                         "the ones not downloaded since they already exist.")
+    subparser_download.add_argument('--plan',
+                                    metavar='PLAN_FILE',
+                                    required=False,
+                                    help="Do not download anything but write to PLAN_FILE the json plan of the "
+                                         "download: the files with their size and checksums, the ones skipped since "
+                                         "they already exist and the estimated duration. The plan can be executed "
+                                         "later with the `fetch` action.")
     subparser_download.add_argument('--download-dir', '-d',
                                     metavar='DOWNLOAD_DIR',
                                     required=False,
@@ -106,6 +199,76 @@ def parse_args():
                                     help="Path to the folder where to download the package. Defaults "
                                          "to current dir.")
 
+    ######################################################################################################
+    # Define the parser to handle listing the files of package locations
+    ######################################################################################################
+    subparser_list = subparsers.add_parser('list',
+                                           parents=[common_options, parser_search],
+                                           help='Search and list the files of a package location without downloading '
+                                                'them')
+    subparser_list.add_argument('--part',
+                                metavar='PART',
+                                required=False,
+                                help="List only specific dir of the package.")
+    subparser_list.add_argument('--shallow',
+                                action='store_true',
+                                required=False,
+                                default=False,
+                                help="Do not list subdirectory contents.")
+    subparser_list.add_argument('--output', '-o',
+                                metavar='OUTPUT_FILE',
+                                required=False,
+                                help="Path to where to place the json list of the files. Defaults to printing it.")
+
+    ######################################################################################################
+    # Define the parser to handle downloading a list of files
+    ######################################################################################################
+    subparser_fetch = subparsers.add_parser('fetch',
+                                            help='Download the files listed in a json file as generated by the `list` '
+                                                 'action')
+    subparser_fetch.add_argument('--files-from', '-f',
+                                 metavar='FILES_FILE',
+                                 required=True,
+                                 help="Path to the json list of the files to download, or to a plan written by "
+                                      "`download --plan`.")
+    subparser_fetch.add_argument('--download-dir', '-d',
+                                 metavar='DOWNLOAD_DIR',
+                                 required=False,
+                                 default=os.getcwd(),
+                                 help="Path to the folder where to download the files. Defaults to current dir.")
+    subparser_fetch.add_argument('--shard',
+                                 metavar='INDEX/COUNT',
+                                 required=False,
+                                 help="Download only the files of a shard, the files being split in COUNT shards by the "
+                                      "hash of their path. Files already downloaded are skipped.")
+    subparser_fetch.add_argument('--queue-dir',
+                                 metavar='QUEUE_DIR',
+                                 required=False,
+                                 help="Folder, possibly shared by several hosts, of a queue of the shards of the files. "
+                                      "The shards which are neither done nor downloaded by another worker are "
+                                      "downloaded until all are done. Files already downloaded are skipped so that an "
+                                      "interrupted download is resumed.")
+    subparser_fetch.add_argument('--shards',
+                                 metavar='SHARDS',
+                                 type=int,
+                                 required=False,
+                                 default=default_shards,
+                                 help=f"Number of shards of a new queue. Defaults to `{default_shards}`.")
+
+    ######################################################################################################
+    # Define the parser to handle serving the actions of other pdt runs
+    ######################################################################################################
+    subparser_serve = subparsers.add_parser('serve',
+                                            help='Serve the actions of the pdt runs started with `--server` on a Unix '
+                                                 'socket, keeping the Artifactory session and the search cache warm '
+                                                 'between them')
+    subparser_serve.add_argument('--socket', '-s',
+                                 metavar='SOCKET',
+                                 required=False,
+                                 default=default_socket,
+                                 help="Path of the Unix socket to listen on. Defaults to the `PDT_SERVER` environment "
+                                      "variable.")
+
     _args = parser.parse_args()
 
     # Evaluate the password option
@@ -128,11 +291,30 @@ def parse_args():
                 parser.error(f"Invalid property `{i}`. Property should be of format `KEY=VALUE`.")
             key, value = i.split("=", 1)
             properties[key] = value
+        from helpers.artifactory import validate_properties
         validate_properties(properties)
         _args.property = properties
 
+    if getattr(_args, "existing_dir", None) and not _args.shallow:
+        parser.error("Option `--existing-dir` requires `--shallow`.")
+
+    # Evaluate the shard option
+    if getattr(_args, "shard", None):
+        if _args.queue_dir:
+            parser.error("Options `--shard` and `--queue-dir` cannot be provided at the same time.")
+        try:
+            index, count = (int(i) for i in _args.shard.split("/"))
+        except ValueError:
+            parser.error(f"Invalid shard `{_args.shard}`. Shard should be of format `INDEX/COUNT`.")
+        if not 0 <= index < count:
+            parser.error(f"Invalid shard `{_args.shard}`. INDEX should be between 0 and COUNT - 1.")
+        _args.shard = (index, count)
+
+    if _args.action == "serve" and not _args.socket:
+        parser.error("Option `--socket` is required unless the `PDT_SERVER` environment variable is set.")
+
     # Evaluate the package OS selection
-    if _args.package_os:
+    if getattr(_args, "package_os", None):
         _args.package_os = resolve_package_os_abbreviation(_args.package_os)
 
     return _args
@@ -156,32 +338,45 @@ def get_package_base_location(product: str, release: str):
 
 
 def do_search(api: ArtifactoryHelper, product: str, release: str, package_os: str = None, guid: str = None,
-              properties: dict = None, search_meta_file: str = None):
+              properties: dict = None, search_meta_file: str = None, cache: SearchCache = None):
     package_os = resolve_package_os_abbreviation(package_os)
     properties = properties or dict()
     if guid:
         properties["auto.guid"] = guid
-    base_artifactory_path = get_package_base_location(product, release)
-    mandatory_properties = ["auto.guid", "auto.package_id"]
-    path = api.search_for_child_folder_with_properties(base_artifactory_path, properties,
-                                                       naming_pattern=f"^{package_os}_.*$",
-                                                       mandatory_properties=mandatory_properties,
-                                                       quiet=True)
-
-    if not path:
-        msg = f"No package found that matches the search criteria"
-        if properties:
-            msg += f": `{properties}`"
-        raise Exception(msg)
-
-    meta = {
-        "product": product,
-        "release": release,
-        "package_os": package_os,
-        "path": f"{path['path']}/{path['name']}",
-        "search properties": properties,
-        "resolved properties": path["properties"],
-    }
+
+    # Only searches by GUID are cached since other searches resolve to the latest package which may change
+    # The repository URL tells apart the same searches sent to different Artifactory instances
+    cache_key = None
+    if cache and guid:
+        cache_key = SearchCache.get_key("pdt", api.repository_url, product, release, package_os, properties)
+    meta = cache.get(cache_key) if cache_key else None
+
+    if not meta:
+        base_artifactory_path = get_package_base_location(product, release)
+        mandatory_properties = ["auto.guid", "auto.package_id"]
+        path = api.search_for_child_folder_with_properties(base_artifactory_path, properties,
+                                                           naming_pattern=f"^{package_os}_.*$",
+                                                           name_match=f"{package_os}_*",
+                                                           mandatory_properties=mandatory_properties,
+                                                           quiet=True)
+
+        if not path:
+            msg = f"No package found that matches the search criteria"
+            if properties:
+                msg += f": `{properties}`"
+            raise Exception(msg)
+
+        meta = {
+            "product": product,
+            "release": release,
+            "package_os": package_os,
+            "path": f"{path['path']}/{path['name']}",
+            "search properties": properties,
+            "resolved properties": path["properties"],
+        }
+        if cache_key:
+            cache.put(cache_key, meta)
+
     if search_meta_file:
         search_meta_file_dir = os.path.dirname(search_meta_file)
         if search_meta_file_dir:
@@ -191,9 +386,21 @@ def do_search(api: ArtifactoryHelper, product: str, release: str, package_os: st
     return meta
 
 
+def is_file_downloaded(file: dict, local_path: str, checksums: ChecksumCache = None) -> bool:
+    """
+    Checks that a file was already downloaded with the same size and, when it is listed with its sha256, with the same
+    checksum so that a file rebuilt with the same size is downloaded again
+    :param checksums the cache of the checksums of the local files
+    """
+    if not os.path.isfile(local_path) or os.path.getsize(local_path) != file["size"]:
+        return False
+    return not file.get("sha256") or (checksums or ChecksumCache()).get_sha256(local_path) == file["sha256"]
+
+
 def do_download(api: ArtifactoryHelper, product: str, release: str, guid: str = None, properties: dict = None,
                 package_os: str = None, download_dir: str = None, shallow: bool = False, part: str = None,
-                search_meta_file: str = None):
+                search_meta_file: str = None, cache: SearchCache = None, existing_dir: str = None,
+                manifest_file: str = None, plan_file: str = None):
     download_dir = download_dir or os.getcwd()
     meta = do_search(
         api=api,
@@ -203,28 +410,197 @@ def do_download(api: ArtifactoryHelper, product: str, release: str, guid: str =
         properties=properties,
         package_os=package_os,
         search_meta_file=search_meta_file,
+        cache=cache,
     )
     print(json.dumps(meta, indent=4))
 
     path = meta["path"] if not part else meta["path"] + "/" + part
+    if plan_file:
+        plan = get_download_plan(api, meta, path, shallow=shallow, existing_dir=existing_dir, cache=cache)
+        write_files_list(plan, plan_file)
+        print(f"Download plan of `{path}`: {format_plan(plan)}")
+        return meta
+
     download_dir = download_dir if not part else download_dir + "/" + part
+    files = None
     if shallow:
-        for fn in api.get_children_of_folder(path, exclude_folders=True):
-            api.download_file(fn, download_dir)
+        files = api.list_files(path)
+        checksums = ChecksumCache()
+        for file in files:
+            file_name = os.path.basename(file["path"])
+            if existing_dir and is_file_downloaded(file, os.path.join(existing_dir, file_name), checksums):
+                print(f"Skipping `{file_name}` since it already exists in `{existing_dir}`")
+                continue
+            api.download_file(file["path"], download_dir, checksum=file.get("sha256"))
+        checksums.save()
         for fn in api.get_children_of_folder(path, exclude_files=True):
             fn2 = os.path.join(download_dir, os.path.basename(fn))
             if not os.path.exists(fn2):
                 os.makedirs(fn2)
     else:
         api.download_folder(path, download_dir=download_dir)
+
+    if manifest_file:
+        files = files if files is not None else api.list_files(path, deep=True)
+        write_files_list(get_files_list(files, path), manifest_file)
     return meta
 
 
-def main():
-    args = parse_args()
-    api = ArtifactoryHelper(args.username, args.password, verbose=args.verbose)
+def get_download_plan(api: ArtifactoryHelper, meta: dict, path: str, shallow: bool = False, existing_dir: str = None,
+                      cache: SearchCache = None) -> dict:
+    """
+    Lists the files a download would transfer without downloading them
+    :param meta the found package as returned by `do_search`
+    :param path the path of the package, or of its part, to download
+    :return the plan with the `files` to download, the `existing files` skipped, the `search cache hits` and the
+    estimated duration
+    """
+    plan = {
+        "product": meta["product"],
+        "release": meta["release"],
+        "path": path,
+        "shallow": shallow,
+        "search cache hits": cache.hits if cache else 0,
+        "files": [],
+        "existing files": [],
+    }
+    checksums = ChecksumCache()
+    for file in get_files_list(api.list_files(path, deep=not shallow), path):
+        if existing_dir and is_file_downloaded(file, os.path.join(existing_dir, file["name"]), checksums):
+            plan["existing files"].append(file)
+        else:
+            plan["files"].append(file)
+    checksums.save()
+
+    # The duration is estimated with the latency of the search and listing requests. A deep download is a single
+    # archive request.
+    summary = api.transport_stats.summary()
+    latency = summary["setup seconds"] / summary["requests"] if summary["requests"] else None
+    return summarize_plan(plan, requests=len(plan["files"]) if shallow else 1, latency=latency)
+
+
+def get_files_list(files: list, path: str) -> list:
+    """
+    Adds to each listed file its `name` relative to the listed folder
+    """
+    return [dict(i, name=i["path"][len(path):].lstrip("/")) for i in files]
+
+
+def write_files_list(files: list, files_file: str):
+    files_file_dir = os.path.dirname(files_file)
+    if files_file_dir:
+        os.makedirs(files_file_dir, exist_ok=True)
+    with open(files_file, "w") as f:
+        json.dump(files, f, indent=4)
+
+
+def do_list(api: ArtifactoryHelper, product: str, release: str, guid: str = None, properties: dict = None,
+            package_os: str = None, shallow: bool = False, part: str = None, search_meta_file: str = None,
+            cache: SearchCache = None, output_file: str = None):
+    meta = do_search(
+        api=api,
+        product=product,
+        release=release,
+        guid=guid,
+        properties=properties,
+        package_os=package_os,
+        search_meta_file=search_meta_file,
+        cache=cache,
+    )
+
+    path = meta["path"] if not part else meta["path"] + "/" + part
+    files = get_files_list(api.list_files(path, deep=not shallow), path)
+    if output_file:
+        write_files_list(files, output_file)
+    else:
+        print(json.dumps(files, indent=4))
+    return files
+
+
+def do_fetch(api: ArtifactoryHelper, files: list, download_dir: str = None, shard: tuple = None,
+             queue_dir: str = None, shards: int = None):
+    """
+    Downloads the specified files keeping their `name` relative to the download dir
+    :param files the files as listed by `do_list`
+    :param download_dir the folder path where to download the files
+    :param shard the index and the count of the shards when downloading a single shard of the files
+    :param queue_dir the folder of the `ShardQueue` to claim the shards to download from
+    :param shards the number of shards of a new queue
+    """
+    download_dir = download_dir or os.getcwd()
+    if queue_dir:
+        queue = ShardQueue(queue_dir, shards or default_shards)
+        for index in queue.claim():
+            fetch_files(api, get_shard_files(files, index, queue.shards), download_dir, resume=True)
+    elif shard:
+        fetch_files(api, get_shard_files(files, *shard), download_dir, resume=True)
+    else:
+        fetch_files(api, files, download_dir)
+
+
+def fetch_files(api: ArtifactoryHelper, files: list, download_dir: str, resume: bool = False):
+    """
+    :param resume whether the files already downloaded with the same size and checksum are skipped
+    """
+    checksums = ChecksumCache()
+    for file in files:
+        name = file.get("name") or os.path.basename(file["path"])
+        if resume and is_file_downloaded(file, os.path.join(download_dir, name), checksums):
+            continue
+        api.download_file(file["path"], os.path.join(download_dir, os.path.dirname(name)), checksum=file.get("sha256"))
+    checksums.save()
+
+
+def do_serve(api: ArtifactoryHelper, socket_path: str):
+    """
+    Runs the actions sent by other pdt runs with the same Artifactory session and search cache until terminated
+    """
+    from helpers.daemon import Daemon
+
+    cache = SearchCache()
+
+    def handle(request):
+        if request["action"] not in remote_actions:
+            raise Exception(f"Unsupported action `{request['action']}`")
+        args = argparse.Namespace(**request["args"])
+        labels = {i: getattr(args, i) for i in ("product", "release") if getattr(args, i, None)}
+        with metrics.span(f"pdt.serve.{args.action}", stats=api.transport_stats, **labels):
+            return execute(api, args, None if args.no_cache else cache)
+
+    print(f"Serving on `{socket_path}`")
+    Daemon(socket_path, handle, lambda: {"transport": api.transport_stats.summary()}).serve_forever()
+
+
+# Actions which can be sent to a server
+remote_actions = ("search", "download", "list", "fetch")
+# Arguments of the actions which are paths, made absolute before being sent to a server
+path_args = ("download_dir", "search_meta_file", "existing_dir", "manifest_file", "plan", "output", "files_from",
+             "queue_dir")
+
+
+def run_remote(args):
+    """
+    Sends the action to the server and prints its result as the action would
+    """
+    from helpers.daemon import send_request
+
+    request_args = {k: v for k, v in vars(args).items() if k not in ("username", "password", "password_file")}
+    for i in path_args:
+        if request_args.get(i):
+            request_args[i] = os.path.abspath(request_args[i])
+    request_args.setdefault("no_cache", False)
+    result = send_request(args.server, {"action": args.action, "args": request_args})
+    if args.action in ("search", "download") or (args.action == "list" and not args.output):
+        print(json.dumps(result, indent=4))
+
+
+def execute(api: ArtifactoryHelper, args, cache: SearchCache = None):
+    """
+    Runs an action
+    :return the result of the action: the found package of `search` and `download`, the files of `list`
+    """
     if args.action == "search":
-        meta = do_search(
+        return do_search(
             api=api,
             product=args.product,
             release=args.release,
@@ -232,10 +608,10 @@ def main():
             properties=args.property,
             package_os=args.package_os,
             search_meta_file=args.search_meta_file,
+            cache=cache,
         )
-        print(json.dumps(meta, indent=4))
     if args.action == "download":
-        do_download(
+        return do_download(
             api=api,
             product=args.product,
             release=args.release,
@@ -246,7 +622,80 @@ def main():
             shallow=args.shallow,
             part=args.part,
             search_meta_file=args.search_meta_file,
+            cache=cache,
+            existing_dir=args.existing_dir,
+            manifest_file=args.manifest_file,
+            plan_file=args.plan,
+        )
+    if args.action == "list":
+        return do_list(
+            api=api,
+            product=args.product,
+            release=args.release,
+            guid=args.guid,
+            properties=args.property,
+            package_os=args.package_os,
+            shallow=args.shallow,
+            part=args.part,
+            search_meta_file=args.search_meta_file,
+            cache=cache,
+            output_file=args.output,
         )
+    if args.action == "fetch":
+        with open(args.files_from) as f:
+            files = json.load(f)
+        if isinstance(files, dict):
+            # A plan written by `download --plan`
+            files = files["files"]
+        do_fetch(
+            api=api,
+            files=files,
+            download_dir=args.download_dir,
+            shard=args.shard,
+            queue_dir=args.queue_dir,
+            shards=args.shards,
+        )
+
+
+def run(api: ArtifactoryHelper, args):
+    cache = None if getattr(args, "no_cache", True) else SearchCache()
+    if args.action == "serve":
+        do_serve(api, args.socket)
+    else:
+        result = execute(api, args, cache)
+        if args.action == "search":
+            print(json.dumps(result, indent=4))
+
+    if args.verbose:
+        print(json.dumps(api.transport_stats.summary(), indent=4))
+
+
+def main():
+    args = parse_args()
+    if args.server and args.action in remote_actions:
+        try:
+            return run_remote(args)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            print(f"Running `{args.action}` locally since the server `{args.server}` is not running: {e}",
+                  file=sys.stderr)
+
+    from helpers.artifactory import ArtifactoryHelper
+    governor = Governor(args.max_requests_per_second, args.max_bytes_per_second,
+                        args.pool_size or default_max_concurrency, args.governor_file)
+    api = ArtifactoryHelper(args.username, args.password, verbose=args.verbose, pool_size=args.pool_size,
+                            governor=governor)
+    labels = {i: getattr(args, i) for i in ("product", "release") if getattr(args, i, None)}
+    try:
+        with profile(args.profile) if args.profile is not None else contextlib.nullcontext():
+            with metrics.span(f"pdt.{args.action}", stats=api.transport_stats, **labels):
+                run(api, args)
+    finally:
+        if args.metrics_file:
+            metrics.export(args.metrics_file)
+        if args.trace is not None:
+            print(api.transport_stats.format_table(), file=sys.stderr)
+            if args.trace:
+                api.transport_stats.write_trace(args.trace)
 
 
 if __name__ == "__main__":